@@ -0,0 +1,227 @@
+import functools
+import threading
+
+import numpy as np
+import pandas as pd
+
+import settings
+from figure_cache import LRUCache
+from quantile_index import sortedColumn
+
+# Percentile bands are resolved on a grid of 202 slots per metric, -1 to 200: even slot 2p holds the rows
+# equal to the p-th percentile cutoff and odd slot 2p - 1 the rows strictly between cutoffs p - 1 and p.
+# That keeps a band [lo, hi] exact, ties at the cutoffs included, exactly like the filter engine's
+# binary search. Slot -1 holds rows whose metric is missing.
+# Rows read per pass while a cube is built, so the build never holds a per-row array of the whole source
+build_chunk_rows = 1 << 20
+
+
+def percentileSlots(values, cutoffs):
+    first = np.searchsorted(cutoffs, values, side='left')
+    on_cutoff = cutoffs[np.minimum(first, len(cutoffs) - 1)] == values
+    slots = np.where(on_cutoff, 2 * first, 2 * first - 1)
+    slots[np.isnan(values)] = -1
+    return slots
+
+
+def slotRange(cutoffs, percentiles):
+    low = np.searchsorted(cutoffs, cutoffs[int(percentiles[0])], side='left')
+    high = np.searchsorted(cutoffs, cutoffs[int(percentiles[1])], side='left')
+    return 2 * low, 2 * high
+
+
+def yearBuckets(years, width):
+    # Bucket b holds the years [b * width, (b + 1) * width); -1 holds rows whose year is missing
+    buckets = np.floor_divide(years, width)
+    return np.where(np.isnan(buckets), -1, buckets).astype(np.int16)
+
+
+def cubeBytes(cube):
+    return sum(values.nbytes for values in cube.values())
+
+
+class AggregationCube:
+    # Sparse cube of count, sum and sum of squares of the metric columns, keyed by category of a group
+    # column x build year bucket x valuation percentile slot x area percentile slot, so its size is
+    # bounded by the buckets, the slot grid and the categories rather than by the row count. The tab 3
+    # pies and bars over percentile bands and a build year range are a masked bincount over its cells.
+    # A year range that cuts through a bucket corrects that bucket with its rows on one side of the range,
+    # found by binary search in the year column's sorted positions, so at most the smaller halves of two
+    # edge buckets are ever read. rollUpRows is the fallback for a cube no smaller than the rows.
+    # Cubes are derived arrays of the source (saved in and memory-mapped from a columnar store), meant to
+    # be built before the app forks; the ones in use are kept in an LRU under max_bytes.
+    def __init__(self, filter_engine, max_bytes=settings.AGGREGATION_CUBE_MAX_BYTES,
+                 year_bucket_years=settings.AGGREGATION_CUBE_YEAR_BUCKET, valuation_col='taxvaluedollarcnt',
+                 area_col='calculatedfinishedsquarefeet', year_col='yearbuilt'):
+        self.filter_engine = filter_engine
+        self.source = filter_engine.source
+        self.quantile_index = filter_engine.quantile_index
+        self.metrics = [valuation_col, area_col]
+        self.year_col = year_col
+        self.year_bucket_years = year_bucket_years
+        self.year_index = self.source.derivedArrays(f"quantiles-{year_col}",
+                                                    functools.partial(sortedColumn, self.source, year_col))
+        self.cubes = LRUCache(max_bytes, size=cubeBytes)
+        self.lock = threading.Lock()
+
+    def buildCube(self, col):
+        keys = ['x', 'year_bucket', 'valuation_slot', 'area_slot']
+        cells = None
+        for start in range(0, len(self.source), build_chunk_rows):
+            rows = slice(start, start + build_chunk_rows)
+            years = np.asarray(self.source.column(self.year_col)[rows], dtype=float)
+            chunk = {'x': self.source.decode(col, rows), 'year_bucket': yearBuckets(years, self.year_bucket_years)}
+            for metric, slot in zip(self.metrics, keys[2:]):
+                values = np.asarray(self.source.column(metric)[rows], dtype=float)
+                chunk[slot] = percentileSlots(values, self.quantile_index.cutoffs[metric])
+                valid = ~np.isnan(values)
+                values = np.where(valid, values, 0)
+                chunk[metric + '_count'] = valid.astype(float)
+                chunk[metric + '_sum'] = values
+                chunk[metric + '_sumsq'] = values * values
+            chunk = pd.DataFrame(chunk).assign(rows=1)
+            # Rows without a category are in no group, as in a groupby
+            part = chunk.groupby(keys).sum()
+            cells = part if cells is None else pd.concat([cells, part]).groupby(level=keys).sum()
+
+        if cells is None:
+            cells = pd.DataFrame(columns=keys + ['rows'] + [metric + stat for metric in self.metrics
+                                                            for stat in ('_count', '_sum', '_sumsq')]).set_index(keys)
+        x_codes, categories = pd.factorize(cells.index.get_level_values('x'), sort=True)
+        cube = {
+            'categories': np.asarray(categories, dtype=object),
+            'x': x_codes.astype(np.min_scalar_type(max(len(categories), 1))),
+            'rows': cells['rows'].to_numpy().astype(np.int32),
+        }
+        for key in keys[1:]:
+            cube[key] = cells.index.get_level_values(key).to_numpy().astype(np.int16)
+        for metric in self.metrics:
+            cube[metric + '_count'] = cells[metric + '_count'].to_numpy().astype(np.int32)
+            for stat in ('_sum', '_sumsq'):
+                cube[metric + stat] = cells[metric + stat].to_numpy().astype(float)
+        return cube
+
+    def cube(self, col):
+        cube = self.cubes.get(col)
+        if cube is None:
+            with self.lock:
+                cube = self.cubes.get(col)
+                if cube is None:
+                    cube = self.source.derivedArrays(f"cube-{col}-{self.year_bucket_years}y",
+                                                     functools.partial(self.buildCube, col))
+                    self.cubes.set(col, cube)
+        return cube
+
+    def yearCoverage(self, year_built):
+        # The buckets the cube contributes whole, as a first and last bucket, and the row positions to add
+        # to and take away from them. Of a bucket year_built only partly covers, whichever side of the
+        # range holds fewer rows is read: the rows inside it are added, or the bucket is kept and the rows
+        # outside it are taken away.
+        sorted_years, positions = self.year_index['values'], self.year_index['positions']
+        width = self.year_bucket_years
+        low, high = year_built
+        first, last = int(np.floor_divide(low, width)), int(np.floor_divide(high, width))
+        inside = np.searchsorted(sorted_years, low, side='left'), np.searchsorted(sorted_years, high, side='right')
+        added, removed = [np.array([], dtype=np.int64)], [np.array([], dtype=np.int64)]
+        for bucket in sorted({first, last}):
+            start = np.searchsorted(sorted_years, bucket * width, side='left')
+            stop = np.searchsorted(sorted_years, (bucket + 1) * width, side='left')
+            lower = max(start, inside[0])
+            upper = max(min(stop, inside[1]), lower)
+            if (lower, upper) == (start, stop):
+                continue
+            if upper - lower <= (stop - start) - (upper - lower):
+                added.append(positions[lower:upper])
+                if bucket == first:
+                    first += 1
+                if bucket == last:
+                    last -= 1
+            else:
+                removed.extend([positions[start:lower], positions[upper:stop]])
+        return first, last, np.sort(np.concatenate(added)), np.sort(np.concatenate(removed))
+
+    def rollUp(self, col, valuation_percentiles=None, area_percentiles=None, year_built=None):
+        # One row per category of col, with the row count and, per metric, the mean under the metric's
+        # own name plus _sum, _count and _std columns
+        cube = self.cube(col)
+        if len(cube['x']) >= len(self.source):
+            # A cube with as many cells as there are rows saves nothing over summing the rows themselves
+            return self.rollUpRows(col, valuation_percentiles, area_percentiles, year_built)
+        return self.rollUpCube(col, valuation_percentiles, area_percentiles, year_built)
+
+    def rollUpCube(self, col, valuation_percentiles=None, area_percentiles=None, year_built=None):
+        cube = self.cube(col)
+        mask = np.ones(len(cube['x']), dtype=bool)
+        bands = {}
+        for metric, percentiles, slot in zip(self.metrics, (valuation_percentiles, area_percentiles),
+                                             ('valuation_slot', 'area_slot')):
+            if percentiles is not None and len(percentiles) == 2:
+                low, high = slotRange(self.quantile_index.cutoffs[metric], percentiles)
+                mask &= (cube[slot] >= low) & (cube[slot] <= high)
+                bands[metric] = self.quantile_index.bounds(metric, percentiles)
+        edges = ()
+        if year_built is not None and len(year_built) == 2:
+            first, last, added, removed = self.yearCoverage(year_built)
+            # Bucket -1, the rows without a year, is in no year range
+            mask &= (cube['year_bucket'] >= max(first, 0)) & (cube['year_bucket'] <= last)
+            edges = ((added, 1), (removed, -1))
+
+        x = cube['x'][mask]
+        n_categories = len(cube['categories'])
+        rows = np.bincount(x, weights=cube['rows'][mask], minlength=n_categories)
+        stats = {metric: {stat: np.bincount(x, weights=cube[metric + '_' + stat][mask], minlength=n_categories)
+                          for stat in ('count', 'sum', 'sumsq')}
+                 for metric in self.metrics}
+
+        for edge_rows, sign in edges:
+            if not len(edge_rows):
+                continue
+            # The edge rows go through the same percentile bands, compared by value as the filter engine
+            # does within a partition
+            keep = np.ones(len(edge_rows), dtype=bool)
+            for metric, (low, high) in bands.items():
+                values = np.asarray(self.source.column(metric)[edge_rows], dtype=float)
+                keep &= (values >= low) & (values <= high)
+            edge_rows = edge_rows[keep]
+            groups = pd.Index(cube['categories'], dtype=object).get_indexer(self.source.decode(col, edge_rows))
+            edge_rows, groups = edge_rows[groups >= 0], groups[groups >= 0]
+            rows = rows + sign * np.bincount(groups, minlength=n_categories)
+            for metric, edge_stats in self.rowStats(edge_rows, groups, n_categories).items():
+                for stat, values in edge_stats.items():
+                    stats[metric][stat] = stats[metric][stat] + sign * values
+        return self.summary(col, cube['categories'], rows, stats)
+
+    def rowStats(self, rows, groups, n_categories):
+        stats = {}
+        for metric in self.metrics:
+            values = np.asarray(self.source.column(metric)[rows], dtype=float)
+            valid = ~np.isnan(values)
+            values = np.where(valid, values, 0)
+            stats[metric] = {'count': np.bincount(groups, weights=valid, minlength=n_categories),
+                             'sum': np.bincount(groups, weights=values, minlength=n_categories),
+                             'sumsq': np.bincount(groups, weights=values * values, minlength=n_categories)}
+        return stats
+
+    def rollUpRows(self, col, valuation_percentiles=None, area_percentiles=None, year_built=None):
+        # The same summary from the rows the filter engine selects
+        rows = self.filter_engine.select(valuation_percentiles=valuation_percentiles,
+                                         area_percentiles=area_percentiles, year_built=year_built)
+        groups, categories = pd.factorize(pd.Series(self.source.decode(col, rows)), sort=True)
+        rows, groups = rows[groups >= 0], groups[groups >= 0]
+        n_categories = len(categories)
+        return self.summary(col, np.asarray(categories, dtype=object), np.bincount(groups, minlength=n_categories),
+                            self.rowStats(rows, groups, n_categories))
+
+    def summary(self, col, categories, rows, stats):
+        present = rows > 0
+        summary = pd.DataFrame({col: categories[present], 'rows': rows[present].astype(np.int64)})
+        for metric in self.metrics:
+            metric_stats = {name: values[present] for name, values in stats[metric].items()}
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = metric_stats['sum'] / metric_stats['count']
+                variance = (metric_stats['sumsq'] - metric_stats['count'] * mean * mean) / (metric_stats['count'] - 1)
+            summary[metric] = mean
+            summary[metric + '_sum'] = metric_stats['sum']
+            summary[metric + '_count'] = metric_stats['count'].astype(np.int64)
+            summary[metric + '_std'] = np.sqrt(np.maximum(variance, 0))
+        return summary
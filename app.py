@@ -2,19 +2,43 @@ import dash as dash
 import numpy as np
 from dash import dcc
 from dash import html
-from dash.dependencies import Input, Output
+from dash.dependencies import ClientsideFunction, Input, Output, State
 import pandas as pd
 import gc
+import functools
 import plotly.express as px
-from urllib.request import urlopen
-import json
-
-with urlopen('https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json') as response:
-    counties = json.load(response)
-
-external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css', 'assets/custom.css']
+from flask import Response, abort, request, send_from_directory
+from quantile_index import QuantileIndex
+from filter_engine import FilterEngine, SelectionStore, filter_cols
+from figure_cache import figureCacheFromSettings
+from binning import FineBins
+from summary_plots import boxAndViolinFigures, boxFigure
+from aggregation_cube import AggregationCube
+from regression import regressionFigure
+from sampling import StratifiedSamples, quantileInterval
+from category_labels import CategoryLabels
+import settings
+from schema import location_cols, metric_cols
+import artifacts
+import export
+from artifacts import timedStage
+from instrumentation import CallbackMetrics, figureCacheMetricLines, startupMetricLines, workerPoolMetricLines
+from worker_pool import WorkerPool
+
+try:
+    import flask_compress
+except ImportError:
+    flask_compress = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Served from the artifact cache after `python artifacts.py vendor`, and left out before that.
+# assets/custom.css is picked up by Dash from the assets folder on its own.
+external_stylesheets = artifacts.stylesheetUrls()
 # external_stylesheets = [dbc.themes.BOOTSTRAP]
-external_scripts = ["https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.5/MathJax.js?config=TeX-MML-AM_CHTML"]
+external_scripts = artifacts.scriptUrls()
 
 outer_div_style = {}
 tab_style = {
@@ -23,98 +47,87 @@ tab_style = {
 }
 
 ### Data loading and preproc
-df = pd.read_pickle("../processed/sold_houses_no_outlier.pkl")
-
-xls = pd.ExcelFile('../zillow_data_dictionary.xlsx')
-type_resolve_dictionary = {}
-HeatingOrSystemTypeID = pd.read_excel(xls, 'HeatingOrSystemTypeID')
-HeatingOrSystemTypeIDdict = dict(
-    zip(HeatingOrSystemTypeID.HeatingOrSystemTypeID, HeatingOrSystemTypeID.HeatingOrSystemDesc))
-type_resolve_dictionary['heatingorsystemtypeid'] = HeatingOrSystemTypeIDdict
-
-PropertyLandUseTypeID = pd.read_excel(xls, 'PropertyLandUseTypeID')
-PropertyLandUseTypeIDdict = dict(
-    zip(PropertyLandUseTypeID.PropertyLandUseTypeID, PropertyLandUseTypeID.PropertyLandUseDesc))
-type_resolve_dictionary['propertylandusetypeid'] = PropertyLandUseTypeIDdict
-
-StoryTypeID = pd.read_excel(xls, 'StoryTypeID')
-StoryTypeIDdict = dict(zip(StoryTypeID.StoryTypeID, StoryTypeID.StoryDesc))
-type_resolve_dictionary['storytypeid'] = StoryTypeIDdict
-
-AirConditioningTypeID = pd.read_excel(xls, 'AirConditioningTypeID')
-AirConditioningTypeIDdict = dict(
-    zip(AirConditioningTypeID.AirConditioningTypeID, AirConditioningTypeID.AirConditioningDesc))
-type_resolve_dictionary['airconditioningtypeid'] = AirConditioningTypeIDdict
-
-ArchitecturalStyleTypeID = pd.read_excel(xls, 'ArchitecturalStyleTypeID')
-ArchitecturalStyleTypeIDdict = dict(
-    zip(ArchitecturalStyleTypeID.ArchitecturalStyleTypeID, ArchitecturalStyleTypeID.ArchitecturalStyleDesc))
-type_resolve_dictionary['architecturalstyletypeid'] = ArchitecturalStyleTypeIDdict
-
-TypeConstructionTypeID = pd.read_excel(xls, 'TypeConstructionTypeID')
-TypeConstructionTypeIDdict = dict(
-    zip(TypeConstructionTypeID.TypeConstructionTypeID, TypeConstructionTypeID.TypeConstructionDesc))
-type_resolve_dictionary['typeconstructiontypeid'] = TypeConstructionTypeIDdict
-
-BuildingClassTypeID = pd.read_excel(xls, 'BuildingClassTypeID')
-BuildingClassTypeIDdict = dict(zip(BuildingClassTypeID.BuildingClassTypeID, BuildingClassTypeID.BuildingClassDesc))
-type_resolve_dictionary['buildingclasstypeid'] = BuildingClassTypeIDdict
-
-categorical_cols = ['heatingorsystemtypeid', 'propertylandusetypeid', 'storytypeid', 'airconditioningtypeid',
-                    'architecturalstyletypeid', 'typeconstructiontypeid', 'buildingclasstypeid']
-years_of_relevance = ['yearbuilt']
-binary_cols = ['fireplaceflag', 'taxdelinquencyflag', 'hashottuborspa']
-count_cols = ['numberofstories', 'unitcnt', 'roomcnt', 'poolcnt', 'bathroomcnt', 'bedroomcnt', 'fireplacecnt']
-rating_cols = ['buildingqualitytypeid']
-location_cols = ['fips']
-metric_cols = ['calculatedfinishedsquarefeet', 'taxvaluedollarcnt']
-luxury_metrics_cols = ['poolsizesum']
-id_col = ['parcelid']
-
-my_app = dash.Dash('Dashapp')
-
-my_app.layout = html.Div([
-                            html.Div([
-                                html.Div([
-                                    html.Img(src=r'assets/zillow.svg', alt='image', className="site-logo"),
-                                    html.Span('Z-Explanatory Data Visualization', className="zexp-header"),
-                                    html.Div([
-                                        html.Span("Built for Information Visualization Class(VT)"),
-                                        html.Span("Harish Ravi"),
-                                        html.Span("harishr@vt.edu")
-                                    ], className="course-specifics")
-                                ], style={'display': 'flex'}),
-                                html.Br(),
-                                html.Div([
-                                    html.Strong("PRELUDE:"),
-                                    html.Div(className="hl"),
-                                    html.Span(
-                                        "This dashboard is an opinionated visualization of Zillow's Zestimate dataset. It serves to explain the valuation of properties when analyzed through the lens of a homeowner. It's to be noted that, the dataset contains data for only three Californian counties, so the applicability of these insights is limited and only the sold houses of 2016-17 were considered here! But considering the richness of the data, and its origin from the real world, so we hope to Z-Explain the data, by slicing-dicing and plotting with and on some opinionated variables."),
-                                    html.A(children="DATA SOURCE", href="https://www.kaggle.com/competitions/zillow-prize-1/overview")
-                                ], className="intermediate-text"),
-                                html.Br(),
-                                dcc.Tabs(id='zillow_tabs',
-                                         children=[
-                                             dcc.Tab(label='Pricepoint/Area by Amenities', value='opt1'),
-                                             dcc.Tab(label='Amenities for Pricepoint/Area', value='opt2'),
-                                             dcc.Tab(label='Aggregations', value='opt3'),
-                                         ], value='opt1'),
-                                html.Br(),
-                                html.Div(id='layout'),
-                            ], style=outer_div_style, className="outer-div"),
-                            html.Div([
-                                html.Strong("ヽ(•‿•)ノ")
-                            ], id="footer")
-                           ],
-
-)
-
 fips_map = {
     '06111': 'Ventura County',
     '06037': 'Los Angeles County',
     '06059': 'Orange County'
 }
-type_resolve_dictionary['fips'] = fips_map
+
+source = artifacts.dataSource()
+
+with timedStage('quantile index'):
+    quantile_index = QuantileIndex(source, metric_cols)
+with timedStage('filter engine'):
+    filter_engine = FilterEngine(source, quantile_index)
+    selection_store = SelectionStore(filter_engine, settings.SELECTION_CACHE_MAX_BYTES)
+with timedStage('histogram bins'):
+    fine_bins = FineBins(source, metric_cols)
+with timedStage('aggregation cube'):
+    aggregation_cube = AggregationCube(filter_engine)
+with timedStage('layout bounds'):
+    # Slider and date picker limits, read once instead of on every layout build
+    layout_bounds = {col: source.bounds(col) for col in ('bedroomcnt', 'transactiondate', 'yearbuilt')}
+with timedStage('stratified samples'):
+    stratified_samples = StratifiedSamples(source, settings.APPROXIMATE_SAMPLE_FRACTIONS, filter_cols)
+with timedStage('category labels'):
+    category_labels = CategoryLabels(source, dict(artifacts.typeResolveDictionary(), fips=fips_map))
+
+my_app = dash.Dash('Dashapp', external_stylesheets=external_stylesheets, external_scripts=external_scripts)
+server = my_app.server
+if settings.COMPRESS_RESPONSES and flask_compress is not None:
+    # Set up here rather than through Dash(compress=True), which pins the algorithm to gzip.
+    # Figure JSON shrinks about tenfold either way; brotli is preferred by browsers that accept it.
+    server.config['COMPRESS_ALGORITHM'] = ['br', 'gzip'] if brotli is not None else ['gzip']
+    flask_compress.Compress(server)
+figure_cache = figureCacheFromSettings(artifacts.cacheVersion())
+
+# Every callback registered below is timed per phase and exposed on /metrics
+metrics = CallbackMetrics()
+metrics.attach(my_app.server)
+my_app.callback = metrics.wrapRegistration(my_app.callback)
+metrics.addCollector(lambda: figureCacheMetricLines(figure_cache))
+metrics.addCollector(lambda: startupMetricLines(artifacts.startup_timings))
+
+# Figure building runs in forked workers, started by whatever serves the app (see serve.py)
+worker_pool = WorkerPool(settings.WORKER_PROCESSES, metrics)
+worker_pool.attach(my_app.server)
+metrics.addCollector(lambda: workerPoolMetricLines(worker_pool))
+
+
+@my_app.server.route('/figure-cache/stats')
+def figureCacheStats():
+    return figure_cache.stats()
+
+
+# Outlines of the counties in fips_map, fetched once by the browser and referenced by URL from the
+# choropleth instead of being embedded in every figure
+county_geometry_url = '/geometry/counties.json'
+
+
+@my_app.server.route(county_geometry_url)
+def countyGeometry():
+    response = Response(artifacts.countyGeometry(tuple(fips_map)), mimetype='application/json')
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+@my_app.server.route('/vendor/<path:path>')
+def vendoredAsset(path):
+    return send_from_directory(artifacts.artifactPath(artifacts.vendor_artifact), path, max_age=86400)
+
+
+@functools.lru_cache(maxsize=None)
+def countiesBaseFigure():
+    # Sent with the tab layout; from then on the callbacks only send unit counts, which the
+    # clientside callback below writes into this figure's locations and z
+    base = pd.DataFrame({'fips': list(fips_map), 'dist': 0})
+    return px.choropleth(base, geojson=county_geometry_url, locations='fips', color='dist',
+                         color_continuous_scale="Viridis",
+                         scope="usa",
+                         labels={'dist': 'Units sold by county'}
+                         )
 
 
 def tab1Layout():
@@ -122,8 +135,8 @@ def tab1Layout():
         1: "Available",
         0: "Not-Available"
     }
-    min_bed_rooms = df.bedroomcnt.unique().min()
-    max_bed_rooms = df.bedroomcnt.unique().max()
+    min_bed_rooms, max_bed_rooms = layout_bounds['bedroomcnt']
+    min_date, max_date = layout_bounds['transactiondate']
     tab1layout = html.Div([
         html.Div([
             html.Span(
@@ -137,28 +150,31 @@ def tab1Layout():
                 id='fips-selection',
                 options=[{'label': f"{key} ({item})", 'value': item} for item, key in fips_map.items()],
                 className="fips-selector",
-                multi=True
+                multi=True,
+                persistence=True, persistence_type='session'
             ),
 
         ], className="selection-line-item"),
         html.Div([
             html.Span(children="Timeline-of-sale", className="sli-label"),
-            dcc.DatePickerRange(id="transaction-time-line", min_date_allowed=df.transactiondate.min(),
-                                max_date_allowed=df.transactiondate.max(), className="date-picker-ttl"),
+            dcc.DatePickerRange(id="transaction-time-line", min_date_allowed=min_date,
+                                max_date_allowed=max_date, className="date-picker-ttl",
+                                persistence=True, persistence_type='session'),
         ], className="selection-line-item"),
 
         html.Div([
             html.Span(children="Has a Pool?", className="sli-label"),
             dcc.Checklist(
                 id="pool-checkbox",
-                options=[{'label': f"{key}", 'value': item} for item, key in pool_map.items()]
+                options=[{'label': f"{key}", 'value': item} for item, key in pool_map.items()],
+                persistence=True, persistence_type='session'
             )
 
         ], className="selection-line-item"),
         html.Div([
             html.Span(children="Desired Bedrooms Range", className="sli-label"),
             dcc.RangeSlider(id="bedroom-slider", className="slider-range", min=min_bed_rooms, max=max_bed_rooms, step=1,
-                            value=[min_bed_rooms, max_bed_rooms]),
+                            value=[min_bed_rooms, max_bed_rooms], persistence=True, persistence_type='session'),
         ], className="selection-line-item"),
 
         html.Div([
@@ -175,28 +191,35 @@ def tab1Layout():
             html.Div([
                 html.H2("The Estimated Price of houses sold (with the specified conditions)"),
                 dcc.RadioItems(["Histogram", "Boxplot"], "Histogram", inline=True, id="valuation-radio",
-                               className="radio-buttons-g"),
+                               className="radio-buttons-g", persistence=True, persistence_type='session'),
                 html.Span(id="histogram-err-g1-t1", className="error-message", children=""),
                 html.Div([
                     html.Span("Bins:"),
-                    dcc.Input(id='histogram-ip-g1-t1', type="number", value=50, className="t1-bins-ip"),
+                    dcc.Input(id='histogram-ip-g1-t1', type="number", value=50, className="t1-bins-ip",
+                              persistence=True, persistence_type='session'),
                 ], id="histogram-ip-g1-t1-div",className='bins-field'),
                 dcc.Graph(id="valuation-graph", className="tab1-graphs"),
+                dcc.Store(id="valuation-summary-t1"),
             ], className="graph-with-radio-buttons"),
             html.Div([
                 html.H2("The Estimated Square Footage of houses sold (with the specified conditions)"),
                 dcc.RadioItems(["Histogram", "Boxplot"], "Histogram", inline=True, id="square-radio",
-                               className="radio-buttons-g"),
+                               className="radio-buttons-g", persistence=True, persistence_type='session'),
                 html.Span(id="histogram-err-g2-t1", className="error-message", children=""),
                 html.Div([
                     html.Span("Bins:"),
-                    dcc.Input(id='histogram-ip-g2-t1', type="number", value=50, className="t1-bins-ip"),
+                    dcc.Input(id='histogram-ip-g2-t1', type="number", value=50, className="t1-bins-ip",
+                              persistence=True, persistence_type='session'),
                 ],id="histogram-ip-g2-t1-div",className='bins-field'),
-                dcc.Graph(id="square-graph", className="tab1-graphs")
+                dcc.Graph(id="square-graph", className="tab1-graphs"),
+                dcc.Store(id="square-summary-t1"),
             ], className="graph-with-radio-buttons")
         ], className="plots-tab1"),
         html.H2("Counties with the sale deeds of interest"),
-        dcc.Graph(id="chloropleth-t1")
+        dcc.Graph(id="chloropleth-t1", figure=countiesBaseFigure()),
+        dcc.Store(id="county-counts-t1"),
+        # Handle to the rows matching the filters above, shared by the three graphs
+        dcc.Store(id="selection-t1"),
     ])
     return tab1layout
 
@@ -222,6 +245,11 @@ eligible_x = {
     "Air Conditioning": "airconditioningtypeid",
 }
 
+with timedStage('aggregation cubes'):
+    # Built here, before any worker process is forked, and kept in the columnar store once built
+    for col in eligible_x.values():
+        aggregation_cube.cube(col)
+
 
 def tab2Layout():
     tab2layout = html.Div([
@@ -239,13 +267,13 @@ def tab2Layout():
             html.Span(children="Valuation Percentile Range", className="sli-label"),
             dcc.RangeSlider(id="percentile-slider-valuation", className="slider-range", min=0, max=100, step=1,
                             marks={i: str(i) for i in range(0, 101, 10)},
-                            value=[30, 70]),
+                            value=[30, 70], persistence=True, persistence_type='session'),
         ], className="selection-line-item"),
         html.Div([
             html.Span(children="Square footage Percentile Range", className="sli-label"),
             dcc.RangeSlider(id="percentile-slider-area", className="slider-range", min=0, max=100, step=1,
                             marks={i: str(i) for i in range(0, 101, 10)},
-                            value=[30, 70]),
+                            value=[30, 70], persistence=True, persistence_type='session'),
         ], className="selection-line-item"),
         html.Div([
             html.Span(id="area_mean",children=""),
@@ -260,7 +288,8 @@ def tab2Layout():
                 options=[{'label': key, 'value': item} for key, item in eligible_y.items()],
                 className="fips-selector",
                 value="taxvaluedollarcnt",
-                multi=False
+                multi=False,
+                persistence=True, persistence_type='session'
             ),
             html.P("Select the x axis for the visualization"),
             dcc.Dropdown(
@@ -268,14 +297,18 @@ def tab2Layout():
                 options=[{'label': key, 'value': item} for key, item in eligible_x.items()],
                 className="fips-selector",
                 value="yearbuilt",
-                multi=False
+                multi=False,
+                persistence=True, persistence_type='session'
             ),
             dcc.RadioItems(["Violin", "Box"], "Box", inline=True, id="diced-graph-radio-valuation",
-                           className="radio-buttons-g"),
+                           className="radio-buttons-g", persistence=True, persistence_type='session'),
             html.Div([
                 dcc.Graph(id="diced-graph-valuation", className="tab2-graphs"),
                 dcc.Markdown(id="exp-area", dangerously_allow_html=True)
-            ], className="graph-expl-t2")
+            ], className="graph-expl-t2"),
+            # The box and the violin figure of the current selection (or the box alone, for few rows); the
+            # radio picks one in the browser
+            dcc.Store(id="diced-figures-t2"),
 
         ], className="graph-with-radio-buttons"),
     ])
@@ -283,8 +316,7 @@ def tab2Layout():
 
 
 def tab3Layout():
-    min_year = df.yearbuilt.min()
-    max_year = df.yearbuilt.max()
+    min_year, max_year = layout_bounds['yearbuilt']
     tab3layout = html.Div([
         html.Div([
             html.Span(
@@ -295,19 +327,19 @@ def tab3Layout():
             html.Span(children="Valuation Percentile Range", className="sli-label"),
             dcc.RangeSlider(id="percentile-slider-valuation-t3", className="slider-range", min=0, max=100, step=1,
                             marks={i: str(i) for i in range(0, 101, 10)},
-                            value=[30, 70]),
+                            value=[30, 70], persistence=True, persistence_type='session'),
         ], className="selection-line-item"),
         html.Div([
             html.Span(children="Square footage Percentile Range", className="sli-label"),
             dcc.RangeSlider(id="percentile-slider-area-t3", className="slider-range", min=0, max=100, step=1,
                             marks={i: str(i) for i in range(0, 101, 10)},
-                            value=[30, 70]),
+                            value=[30, 70], persistence=True, persistence_type='session'),
         ], className="selection-line-item"),
         html.Div([
             html.Span(children="Year Built", className="sli-label"),
             dcc.RangeSlider(id="year-built-slider", className="slider-range", min=min_year, max=max_year, step=1,
                             marks={i: str(i) for i in range(min_year, max_year + 20, 20)},
-                            value=[2010, max_year]),
+                            value=[2010, max_year], persistence=True, persistence_type='session'),
         ], className="selection-line-item"),
         html.Div([
             html.H2("Diced Visualization by selected variable"),
@@ -317,7 +349,8 @@ def tab3Layout():
                 options=[{'label': key, 'value': item} for key, item in eligible_x.items()],
                 className="fips-selector",
                 value="fips",
-                multi=False
+                multi=False,
+                persistence=True, persistence_type='session'
             ),
             html.Div([
                 dcc.Graph(id="aggregated-pie-valuation", className="tab3-graphs"),
@@ -340,150 +373,283 @@ def tab3Layout():
     return tab3layout
 
 
-## Plot the tabs
-@my_app.callback(
-    Output(component_id='layout', component_property='children'),
-    Input(component_id='zillow_tabs', component_property='value')
+### Page layout
+tab_layouts = {'opt1': tab1Layout(), 'opt2': tab2Layout(), 'opt3': tab3Layout()}
+
+my_app.layout = html.Div([
+                            html.Div([
+                                html.Div([
+                                    html.Img(src=r'assets/zillow.svg', alt='image', className="site-logo"),
+                                    html.Span('Z-Explanatory Data Visualization', className="zexp-header"),
+                                    html.Div([
+                                        html.Span("Built for Information Visualization Class(VT)"),
+                                        html.Span("Harish Ravi"),
+                                        html.Span("harishr@vt.edu")
+                                    ], className="course-specifics")
+                                ], style={'display': 'flex'}),
+                                html.Br(),
+                                html.Div([
+                                    html.Strong("PRELUDE:"),
+                                    html.Div(className="hl"),
+                                    html.Span(
+                                        "This dashboard is an opinionated visualization of Zillow's Zestimate dataset. It serves to explain the valuation of properties when analyzed through the lens of a homeowner. It's to be noted that, the dataset contains data for only three Californian counties, so the applicability of these insights is limited and only the sold houses of 2016-17 were considered here! But considering the richness of the data, and its origin from the real world, so we hope to Z-Explain the data, by slicing-dicing and plotting with and on some opinionated variables."),
+                                    html.A(children="DATA SOURCE", href="https://www.kaggle.com/competitions/zillow-prize-1/overview")
+                                ], className="intermediate-text"),
+                                html.Br(),
+                                dcc.Tabs(id='zillow_tabs',
+                                         children=[
+                                             dcc.Tab(label='Pricepoint/Area by Amenities', value='opt1'),
+                                             dcc.Tab(label='Amenities for Pricepoint/Area', value='opt2'),
+                                             dcc.Tab(label='Aggregations', value='opt3'),
+                                         ], value='opt1', persistence=True, persistence_type='session'),
+                                html.Br(),
+                                # Every tab is built once and stays mounted; switching only changes which is shown
+                                html.Div([html.Div(layout, id=f"tab-{tab}",
+                                                   style={} if tab == 'opt1' else {'display': 'none'})
+                                          for tab, layout in tab_layouts.items()], id='layout'),
+                            ], style=outer_div_style, className="outer-div"),
+                            html.Div([
+                                html.Strong("ヽ(•‿•)ノ")
+                            ], id="footer")
+                           ],
+
 )
-def rendertheRightTabs(ques):
-    if ques == 'opt1':
-        return tab1Layout()
-    elif ques == 'opt2':
-        return tab2Layout()
-    elif ques == 'opt3':
-        return tab3Layout()
-    return "The impaler"
 
 
+for tab in tab_layouts:
+    my_app.clientside_callback(
+        ClientsideFunction(namespace='zillow', function_name='showTab'),
+        Output(component_id=f"tab-{tab}", component_property="style"),
+        Input(component_id='zillow_tabs', component_property='value'),
+        State(component_id=f"tab-{tab}", component_property="id"),
+    )
+
+
+def metricSummary(query_df, rows, col, label):
+    # Everything the browser needs to draw col both ways without coming back to the server: bin counts
+    # it merges into whatever number of bins is asked for, and the box plot
+    if settings.HISTOGRAM_MODE == 'client':
+        # plotly.js bins the raw values itself; the browser only sets nbinsx on this figure
+        histogram = {'figure': px.histogram(query_df, x=col, labels={col: label, 'count': "Units Sold"})}
+    else:
+        histogram = fine_bins.compactCounts(col, rows)
+    histogram['default_bins'] = settings.HISTOGRAM_DEFAULT_BINS
+    return {'label': label, 'histogram': histogram,
+            'box': boxFigure(query_df, x=col, labels={col: label})}
+
+
+### Tab 1: the filters resolve to one shared selection, and each graph only redraws for its own controls
+# The tab 1 callbacks stay in the web process rather than the worker pool: they read the selection the
+# first one leaves in this process's SelectionStore, where a pool worker would have to filter again
 @my_app.callback(
-    Output(component_id="valuation-graph", component_property="figure"),
-    Output(component_id="histogram-ip-g1-t1-div", component_property="style"),
-    Output(component_id="square-graph", component_property="figure"),
-    Output(component_id="histogram-ip-g2-t1-div", component_property="style"),
-    Output(component_id="chloropleth-t1", component_property="figure"),
+    Output(component_id="selection-t1", component_property="data"),
 
     Input(component_id="fips-selection", component_property="value"),
-    Input(component_id="valuation-radio", component_property="value"),
-    Input(component_id="square-radio", component_property="value"),
     Input(component_id="pool-checkbox", component_property="value"),
     Input(component_id="transaction-time-line", component_property="start_date"),
     Input(component_id="transaction-time-line", component_property="end_date"),
     [Input('bedroom-slider', 'value')],
     Input(component_id="bottom-perc-valuation", component_property="n_clicks"),
     Input(component_id="bottom-perc-area", component_property="n_clicks"),
-    Input(component_id="histogram-ip-g1-t1", component_property="value"),
-    Input(component_id="histogram-ip-g2-t1", component_property="value")
 )
-def valuationPieByFilters(fips_selection, valuation_radio_opt, square_radio_opt, pools_selection, start_date, end_date,
-                          bed_rooms, bot_perc_val, bot_perc_area, bins_g1, bins_g2):
-    query_df = df
-    print(bed_rooms)
-    fig1 = None
-    fig2 = None
-    dispblockfig1 = None
-    dispblockfig2 = None
-
-    if start_date is not None:
-        query_df = query_df.query("transactiondate>=@start_date")
-    if end_date is not None:
-        query_df = query_df.query("transactiondate<=@end_date")
-    if fips_selection is not None:
-        if fips_selection != []:
-            query_df = query_df.query("fips == @fips_selection")
-    if pools_selection is not None:
-        if pools_selection != []:
-            query_df = query_df.query("poolcnt == @pools_selection")
-    if bed_rooms is not None:
-        if len(bed_rooms) == 2:
-            query_df = query_df.query("bedroomcnt>=@bed_rooms[0]")
-            query_df = query_df.query("bedroomcnt<=@bed_rooms[1]")
-    if bot_perc_val % 2 != 0:
-        bottom_50_percentile_pricepoint = df.taxvaluedollarcnt.quantile(.50)
-        query_df = query_df.query("taxvaluedollarcnt<=@bottom_50_percentile_pricepoint")
-    if bot_perc_area % 2 != 0:
-        bottom_50_percentile_area = df.calculatedfinishedsquarefeet.quantile(.50)
-        query_df = query_df.query("calculatedfinishedsquarefeet<=@bottom_50_percentile_area")
-    if valuation_radio_opt == "Histogram":
-        fig1 = px.histogram(query_df, x="taxvaluedollarcnt", nbins=bins_g1,
-                            labels=dict(taxvaluedollarcnt="Price Estimate($)", count="Units Sold"))
-        dispblockfig1 = {'display': 'block'}
-    else:
-        fig1 = px.box(query_df, x="taxvaluedollarcnt", labels=dict(taxvaluedollarcnt="Price Estimate($)"))
-        dispblockfig1 = {'display': 'none'}
+def selectTab1Rows(fips_selection, pools_selection, start_date, end_date, bed_rooms, bot_perc_val, bot_perc_area):
+    with metrics.phase('filter'):
+        selection = selection_store.handle(fips=fips_selection, pools=pools_selection, bed_rooms=bed_rooms,
+                                           start_date=start_date, end_date=end_date,
+                                           bottom_valuation=bot_perc_val % 2 != 0,
+                                           bottom_area=bot_perc_area % 2 != 0)
+    metrics.recordRows(selection['rows'])
+    return selection
 
-    if square_radio_opt == "Histogram":
-        fig2 = px.histogram(query_df, x="calculatedfinishedsquarefeet", nbins=bins_g2,
-                            labels=dict(calculatedfinishedsquarefeet="Square Footage", count="Units Sold"))
-        dispblockfig2 = {'display': 'block'}
-    else:
-        fig2 = px.box(query_df, x="calculatedfinishedsquarefeet",
-                      labels=dict(calculatedfinishedsquarefeet="Square Footage"))
-        dispblockfig2 = {'display': 'none'}
 
-    fips_summary = query_df.groupby(['fips']).size().reset_index(name='dist')
+def selectedFrame(selection, columns):
+    with metrics.phase('filter'):
+        rows = selection_store.rows(selection)
+        query_df = filter_engine.frame(rows, columns)
+    metrics.recordRows(len(rows))
+    return rows, query_df
 
-    fig3 = px.choropleth(fips_summary, geojson=counties, locations='fips', color='dist',
-                         color_continuous_scale="Viridis",
-                         range_color=(fips_summary.dist.min(), fips_summary.dist.max()),
-                         scope="usa",
-                         labels={'dist': 'Units sold by county'}
-                         )
 
-    return fig1, dispblockfig1, fig2, dispblockfig2, fig3
+@my_app.callback(
+    Output(component_id="valuation-summary-t1", component_property="data"),
+    Input(component_id="selection-t1", component_property="data"),
+)
+@figure_cache.memoize('plotValuationByFilters')
+def plotValuationByFilters(selection):
+    rows, query_df = selectedFrame(selection, ["taxvaluedollarcnt"])
+
+    with metrics.phase('figure'):
+        return metricSummary(query_df, rows, "taxvaluedollarcnt", "Price Estimate($)")
 
 
+@my_app.callback(
+    Output(component_id="square-summary-t1", component_property="data"),
+    Input(component_id="selection-t1", component_property="data"),
+)
+@figure_cache.memoize('plotSquareFootageByFilters')
+def plotSquareFootageByFilters(selection):
+    rows, query_df = selectedFrame(selection, ["calculatedfinishedsquarefeet"])
+
+    with metrics.phase('figure'):
+        return metricSummary(query_df, rows, "calculatedfinishedsquarefeet", "Square Footage")
+
+
+# The Histogram/Boxplot radios and the bins fields only change how the summaries above are drawn, which
+# assets/clientside.js does in the browser
+for graph_id, summary_id, radio_id, bins_id in (
+        ("valuation-graph", "valuation-summary-t1", "valuation-radio", "histogram-ip-g1-t1"),
+        ("square-graph", "square-summary-t1", "square-radio", "histogram-ip-g2-t1")):
+    my_app.clientside_callback(
+        ClientsideFunction(namespace='zillow', function_name='metricFigure'),
+        Output(component_id=graph_id, component_property="figure"),
+        Output(component_id=bins_id + "-div", component_property="style"),
+        Input(component_id=summary_id, component_property="data"),
+        Input(component_id=radio_id, component_property="value"),
+        Input(component_id=bins_id, component_property="value"),
+    )
+
+# The bottom percentile buttons filter on the server, but show whether they are on right away
+for button_id in ("bottom-perc-valuation", "bottom-perc-area"):
+    my_app.clientside_callback(
+        ClientsideFunction(namespace='zillow', function_name='toggleClass'),
+        Output(component_id=button_id, component_property="className"),
+        Input(component_id=button_id, component_property="n_clicks"),
+    )
+
+
+@my_app.callback(
+    Output(component_id="county-counts-t1", component_property="data"),
+    Input(component_id="selection-t1", component_property="data"),
+)
+@figure_cache.memoize('countCountiesByFilters')
+def countCountiesByFilters(selection):
+    rows, query_df = selectedFrame(selection, location_cols)
+
+    with metrics.phase('aggregate'):
+        fips_summary = query_df.groupby(['fips']).size().reset_index(name='dist')
+    return {'locations': fips_summary.fips.astype(str).tolist(), 'z': fips_summary.dist.tolist()}
+
+
+my_app.clientside_callback(
+    """
+    function(counts, figure) {
+        if (!counts || !figure) {
+            return window.dash_clientside.no_update;
+        }
+        var z = counts.z.length ? counts.z : [0];
+        var trace = Object.assign({}, figure.data[0], {locations: counts.locations, z: counts.z});
+        var coloraxis = Object.assign({}, figure.layout.coloraxis,
+                                      {cmin: Math.min.apply(null, z), cmax: Math.max.apply(null, z)});
+        var layout = Object.assign({}, figure.layout, {coloraxis: coloraxis});
+        return Object.assign({}, figure, {data: [trace], layout: layout});
+    }
+    """,
+    Output(component_id="chloropleth-t1", component_property="figure"),
+    Input(component_id="county-counts-t1", component_property="data"),
+    State(component_id="chloropleth-t1", component_property="figure"),
+)
+
+
+### Approximate answers while a slider is dragged: the sliders report drag_value continuously and value
+### on release, so a call triggered by drag values alone is answered from a stratified sample, and the
+### release that follows brings the exact figures
+def draggedSliders():
+    # Ids of the sliders being dragged, or an empty set when anything else triggered the call
+    triggered = dash.callback_context.triggered_prop_ids
+    if not triggered or not all(prop_id.endswith('.drag_value') for prop_id in triggered):
+        return set()
+    return set(triggered.values())
+
+
+def approximateSelection(**filters):
+    # The smallest sample still leaving APPROXIMATE_MIN_ROWS rows under the filters, with its mask of
+    # matching rows; (None, None) when no sample does, i.e. when the exact answer is cheap anyway
+    for sample in stratified_samples:
+        selected = filter_engine.sampleMask(sample, **filters)
+        if selected.sum() >= settings.APPROXIMATE_MIN_ROWS:
+            return sample, selected
+    return None, None
+
+
+def approximateNote(fig, sample, selected, detail=None):
+    count, count_error = sample.estimateCount(selected)
+    text = f"Approximate ({sample.fraction:.0%} sample): ~{count:,.0f} ± {count_error:,.0f} rows"
+    if detail:
+        text += f", {detail}"
+    fig.add_annotation(text=text + " (95%)", xref='paper', yref='paper', x=1, y=1.02, xanchor='right',
+                       yanchor='bottom', showarrow=False, font={'size': 11, 'color': 'gray'})
+
 
 @my_app.callback(
     Output(component_id="area-percentile", component_property="figure"),
     Output(component_id="valuation-percentile", component_property="figure"),
-    Output(component_id="diced-graph-valuation", component_property="figure"),
+    Output(component_id="diced-figures-t2", component_property="data"),
     Output(component_id="exp-area", component_property="children"),
     Output(component_id="area_mean", component_property="children"),
     Output(component_id="val_mean", component_property="children"),
-    Input(component_id="diced-graph-radio-valuation", component_property="value"),
     Input(component_id="diced-x-selection", component_property="value"),
     Input(component_id="diced-y-selection", component_property="value"),
     [Input('percentile-slider-area', 'value')],
     [Input('percentile-slider-valuation', 'value')],
-
+    Input('percentile-slider-area', 'drag_value'),
+    Input('percentile-slider-valuation', 'drag_value'),
 )
-def plotQuartileAfterSlicingDicing(graph3_type, x_selection, y_selection, area_percentiles, valuation_percentiles):
-    area_percentile_min = 0
-    area_percentile_max = 0
-
-    valuation_percentile_min = 0
-    valuation_percentile_max = 0
-    query_df = df
-
-    if area_percentiles is not None:
-        if len(area_percentiles) == 2:
-            area_percentile_min = df.calculatedfinishedsquarefeet.quantile(float(area_percentiles[0]) / 100.0)
-            area_percentile_max = df.calculatedfinishedsquarefeet.quantile(float(area_percentiles[1]) / 100.0)
-            query_df = query_df.query("calculatedfinishedsquarefeet<=@area_percentile_max")
-            query_df = query_df.query("calculatedfinishedsquarefeet>=@area_percentile_min")
-    if valuation_percentiles is not None:
-        if len(valuation_percentiles) == 2:
-            valuation_percentile_min = df.taxvaluedollarcnt.quantile(float(valuation_percentiles[0]) / 100.0)
-            valuation_percentile_max = df.taxvaluedollarcnt.quantile(float(valuation_percentiles[1]) / 100.0)
-            query_df = query_df.query("taxvaluedollarcnt<=@valuation_percentile_max")
-            query_df = query_df.query("taxvaluedollarcnt>=@valuation_percentile_min")
-
-    fig1 = px.box(query_df, x='calculatedfinishedsquarefeet')
-    fig2 = px.box(query_df, x='taxvaluedollarcnt')
-    if graph3_type == "Box":
-        fig3 = px.box(query_df, y=y_selection, x=x_selection)
-    else:
-        fig3 = px.violin(query_df, y=y_selection, x=x_selection)
-    explanation_of_vars = ""
-    if x_selection in type_resolve_dictionary:
-        explanation_of_vars = f"<b>Metadata for the x-axis variable {x_selection}</b> <br/><br/>"
-        for key, val in type_resolve_dictionary[x_selection].items():
-            explanation_of_vars = explanation_of_vars + str(key) + "\t" + val + "<br/>"
-    mean_str_area=f"The Mean Square footage for the filtered data {query_df.calculatedfinishedsquarefeet.mean():.2f}"
-    mean_str_val=f"The Mean Valuation for the filtered data is ${query_df.taxvaluedollarcnt.mean():.2f} "
+def plotQuartileAfterSlicingDicing(x_selection, y_selection, area_percentiles, valuation_percentiles, area_drag,
+                                   valuation_drag):
+    dragged = draggedSliders()
+    if dragged:
+        area_percentiles = area_drag if 'percentile-slider-area' in dragged else area_percentiles
+        valuation_percentiles = valuation_drag if 'percentile-slider-valuation' in dragged else valuation_percentiles
+        return quartileFigures(x_selection, y_selection, area_percentiles, valuation_percentiles, True)
+    return quartileFigures(x_selection, y_selection, area_percentiles, valuation_percentiles, False)
+
+
+@figure_cache.memoize('plotQuartileAfterSlicingDicing')
+@worker_pool.offload('plotQuartileAfterSlicingDicing')
+def quartileFigures(x_selection, y_selection, area_percentiles, valuation_percentiles, approximate=False):
+    with metrics.phase('filter'):
+        filters = dict(area_percentiles=area_percentiles, valuation_percentiles=valuation_percentiles)
+        sample, selected = approximateSelection(**filters) if approximate else (None, None)
+        rows = filter_engine.select(**filters) if sample is None else sample.rows[selected]
+        query_df = filter_engine.frame(rows, metric_cols + [x_selection, y_selection])
+    metrics.recordRows(len(rows))
+
+    # A sample is always drawn from server-side summaries, however few rows it has
+    min_rows = settings.SUMMARY_PLOT_MIN_ROWS if sample is None else 0
+    with metrics.phase('figure'):
+        fig1 = boxFigure(query_df, x='calculatedfinishedsquarefeet', min_rows=min_rows)
+        fig2 = boxFigure(query_df, x='taxvaluedollarcnt', min_rows=min_rows)
+        labelled_df = category_labels.resolveFrame(query_df, x_selection, rows)
+        # Past min_rows both come from one summary, which keeps the pair compact; below it only the box is
+        # shipped, with its points
+        fig3 = boxAndViolinFigures(labelled_df, x=x_selection, y=y_selection, min_rows=min_rows)
+    explanation_of_vars = category_labels.metadata(x_selection, f"Metadata for the x-axis variable {x_selection}")
+    with metrics.phase('aggregate'):
+        if sample is None:
+            mean_str_area=f"The Mean Square footage for the filtered data {query_df.calculatedfinishedsquarefeet.mean():.2f}"
+            mean_str_val=f"The Mean Valuation for the filtered data is ${query_df.taxvaluedollarcnt.mean():.2f} "
+        else:
+            for fig, col in ((fig1, 'calculatedfinishedsquarefeet'), (fig2, 'taxvaluedollarcnt')):
+                low, high = quantileInterval(query_df[col], .5)
+                approximateNote(fig, sample, selected, f"median within {low:,.0f} - {high:,.0f}")
+            for fig in fig3.values():
+                if fig is not None:
+                    approximateNote(fig, sample, selected)
+            area_mean, area_error = sample.estimateMean(sample.columns['calculatedfinishedsquarefeet'], selected)
+            val_mean, val_error = sample.estimateMean(sample.columns['taxvaluedollarcnt'], selected)
+            mean_str_area=f"The Mean Square footage for the filtered data is about {area_mean:.2f} ± {area_error:.2f}"
+            mean_str_val=f"The Mean Valuation for the filtered data is about ${val_mean:.2f} ± {val_error:.2f} "
     return fig1, fig2, fig3, explanation_of_vars,mean_str_area,mean_str_val
 
 
+my_app.clientside_callback(
+    ClientsideFunction(namespace='zillow', function_name='pickFigure'),
+    Output(component_id="diced-graph-valuation", component_property="figure"),
+    Input(component_id="diced-figures-t2", component_property="data"),
+    Input(component_id="diced-graph-radio-valuation", component_property="value"),
+)
+
+
 #     dcc.Graph(id="aggregated-pie-valuation", className="tab3-graphs"),
 #     dcc.Graph(id="aggregated-pie-area", className="tab3-graphs"),
 #
@@ -505,51 +671,118 @@ def plotQuartileAfterSlicingDicing(graph3_type, x_selection, y_selection, area_p
     [Input('percentile-slider-area-t3', 'value')],
     [Input('percentile-slider-valuation-t3', 'value')],
     [Input('year-built-slider', 'value')],
+    Input('percentile-slider-area-t3', 'drag_value'),
+    Input('percentile-slider-valuation-t3', 'drag_value'),
+    Input('year-built-slider', 'drag_value'),
 )
-def plotAggregatedMetrics(agg_col, area_percentiles, valuation_percentiles, year_built_range):
-    query_df = df
-
-    if area_percentiles is not None:
-        if len(area_percentiles) == 2:
-            area_percentile_min = df.calculatedfinishedsquarefeet.quantile(float(area_percentiles[0]) / 100.0)
-            area_percentile_max = df.calculatedfinishedsquarefeet.quantile(float(area_percentiles[1]) / 100.0)
-            query_df = query_df.query("calculatedfinishedsquarefeet<=@area_percentile_max")
-            query_df = query_df.query("calculatedfinishedsquarefeet>=@area_percentile_min")
-    if valuation_percentiles is not None:
-        if len(valuation_percentiles) == 2:
-            valuation_percentile_min = df.taxvaluedollarcnt.quantile(float(valuation_percentiles[0]) / 100.0)
-            valuation_percentile_max = df.taxvaluedollarcnt.quantile(float(valuation_percentiles[1]) / 100.0)
-            query_df = query_df.query("taxvaluedollarcnt<=@valuation_percentile_max")
-            query_df = query_df.query("taxvaluedollarcnt>=@valuation_percentile_min")
-
-    if year_built_range is not None:
-        if len(year_built_range) == 2:
-            query_df = query_df.query("yearbuilt<=@year_built_range[1]")
-            query_df = query_df.query("yearbuilt>=@year_built_range[0]")
-
-    fig1 = px.pie(query_df, values='taxvaluedollarcnt', names=agg_col,
-                  title=f"Pie plot of taxvaluedollarcnt exploded by {agg_col}")
-    fig2 = px.pie(query_df, values='calculatedfinishedsquarefeet', names=agg_col,
-                  title=f"Pie plot of calculatedfinishedsquarefeet exploded by {agg_col}")
-    explanation_of_vars = ""
-
-    agged_data_sqft = query_df.groupby(agg_col).mean()['calculatedfinishedsquarefeet'].reset_index()
-    agged_data_val = query_df.groupby(agg_col).mean()['taxvaluedollarcnt'].reset_index()
-    fig3 = px.bar(agged_data_sqft, x=agg_col, y='calculatedfinishedsquarefeet',
-                  title=f"Bar plot of {agg_col} vs Avg. calculatedfinishedsquarefeet")
-    fig4 = px.bar(agged_data_val, x=agg_col, y='taxvaluedollarcnt',
-                  title=f"Bar plot of {agg_col} vs Avg. taxvaluedollarcnt")
-
-    style_exp = {"background": "white"}
-    if agg_col in type_resolve_dictionary:
-        explanation_of_vars = f"<b>Metadata for variable {agg_col}</b> <br/><br/>"
-        style_exp = {}
-        for key, val in type_resolve_dictionary[agg_col].items():
-            explanation_of_vars = explanation_of_vars + str(key) + "\t" + val + "<br/>"
-
-    fig5 = px.scatter(query_df, x='taxvaluedollarcnt', y='calculatedfinishedsquarefeet', color=agg_col, trendline="ols",
-                      title=f"Plot of Square footage vs Tax Valuation with ({agg_col} hue)")
+def plotAggregatedMetrics(agg_col, area_percentiles, valuation_percentiles, year_built_range, area_drag,
+                          valuation_drag, year_built_drag):
+    dragged = draggedSliders()
+    if dragged:
+        area_percentiles = area_drag if 'percentile-slider-area-t3' in dragged else area_percentiles
+        valuation_percentiles = valuation_drag if 'percentile-slider-valuation-t3' in dragged else valuation_percentiles
+        year_built_range = year_built_drag if 'year-built-slider' in dragged else year_built_range
+        return aggregatedFigures(agg_col, area_percentiles, valuation_percentiles, year_built_range, True)
+    return aggregatedFigures(agg_col, area_percentiles, valuation_percentiles, year_built_range, False)
+
+
+@figure_cache.memoize('plotAggregatedMetrics')
+@worker_pool.offload('plotAggregatedMetrics')
+def aggregatedFigures(agg_col, area_percentiles, valuation_percentiles, year_built_range, approximate=False):
+    # The pies and bars come from AggregationCube.rollUp and stay exact while dragging; only the
+    # regression, which needs the rows themselves, is drawn from a sample then
+    with metrics.phase('aggregate'):
+        aggregated = aggregation_cube.rollUp(agg_col, valuation_percentiles=valuation_percentiles,
+                                             area_percentiles=area_percentiles, year_built=year_built_range)
+        aggregated = category_labels.resolveFrame(aggregated, agg_col)
+
+    with metrics.phase('figure'):
+        fig1 = px.pie(aggregated, values='taxvaluedollarcnt_sum', names=agg_col,
+                      labels={'taxvaluedollarcnt_sum': 'taxvaluedollarcnt'},
+                      title=f"Pie plot of taxvaluedollarcnt exploded by {agg_col}")
+        fig2 = px.pie(aggregated, values='calculatedfinishedsquarefeet_sum', names=agg_col,
+                      labels={'calculatedfinishedsquarefeet_sum': 'calculatedfinishedsquarefeet'},
+                      title=f"Pie plot of calculatedfinishedsquarefeet exploded by {agg_col}")
+
+    with metrics.phase('figure'):
+        fig3 = px.bar(aggregated, x=agg_col, y='calculatedfinishedsquarefeet',
+                      title=f"Bar plot of {agg_col} vs Avg. calculatedfinishedsquarefeet")
+        fig4 = px.bar(aggregated, x=agg_col, y='taxvaluedollarcnt',
+                      title=f"Bar plot of {agg_col} vs Avg. taxvaluedollarcnt")
+
+    explanation_of_vars = category_labels.metadata(agg_col, f"Metadata for variable {agg_col}")
+    style_exp = {} if agg_col in category_labels else {"background": "white"}
+
+    with metrics.phase('filter'):
+        filters = dict(area_percentiles=area_percentiles, valuation_percentiles=valuation_percentiles,
+                       year_built=year_built_range)
+        sample, selected = approximateSelection(**filters) if approximate else (None, None)
+        rows = filter_engine.select(**filters) if sample is None else sample.rows[selected]
+        query_df = category_labels.resolveFrame(filter_engine.frame(rows, metric_cols + [agg_col]), agg_col, rows)
+    metrics.recordRows(len(rows))
+    with metrics.phase('figure'):
+        fig5 = regressionFigure(query_df, 'taxvaluedollarcnt', 'calculatedfinishedsquarefeet', agg_col,
+                                title=f"Plot of Square footage vs Tax Valuation with ({agg_col} hue)")
+        if sample is not None:
+            approximateNote(fig5, sample, selected, "trendlines fitted on the sample")
     return fig1, fig2, fig3, fig4, fig5, explanation_of_vars, style_exp
 
 
-my_app.server.run(port=8020, host='0.0.0.0')
+
+### Export: the rows of any filter state, or their tab 3 aggregates, as a streamed download
+@my_app.server.route('/export')
+def exportSelection():
+    # /export?format=csv|parquet|arrow with the filters as query parameters (see export.parseFilters);
+    # group_by=<aggregator column> sends one row of aggregates per category instead of the rows, and
+    # columns=a,b,c picks the columns of a row export
+    file_format = request.args.get('format', 'csv')
+    if file_format not in export.availableFormats():
+        abort(400, f"format must be one of {', '.join(export.availableFormats())}")
+    try:
+        filters = export.parseFilters(request.args)
+    except ValueError as error:
+        abort(400, f"Bad filter: {error}")
+
+    group_by = request.args.get('group_by')
+    if group_by:
+        if group_by not in eligible_x.values():
+            abort(400, f"group_by must be one of {', '.join(eligible_x.values())}")
+        if set(filters) <= {'valuation_percentiles', 'area_percentiles', 'year_built'}:
+            # The tab 3 filters alone: the same cube roll-up the pies and bars are drawn from
+            aggregated = aggregation_cube.rollUp(group_by, **filters)
+        else:
+            aggregated = export.aggregateFrames(
+                (filter_engine.frame(rows, metric_cols + [group_by])
+                 for rows in filter_engine.selectChunks(settings.EXPORT_CHUNK_ROWS, **filters)),
+                group_by, aggregation_cube.metrics)
+        aggregated = category_labels.resolveFrame(aggregated, group_by)
+        frames, empty = [aggregated], aggregated.iloc[:0]
+    else:
+        columns = [col for arg in request.args.getlist('columns') for col in arg.split(',') if col]
+        columns = columns or source.columnNames()
+        unknown = [col for col in columns if col not in source.columnNames()]
+        if unknown:
+            abort(400, f"Unknown columns: {', '.join(unknown)}")
+        frames = (filter_engine.frame(rows, columns)[columns]
+                  for rows in filter_engine.selectChunks(settings.EXPORT_CHUNK_ROWS, **filters))
+        empty = filter_engine.frame(np.array([], dtype=np.int64), columns)[columns]
+
+    content_type, extension = export.export_formats[file_format]
+    if file_format == 'csv':
+        stream = export.csvStream(frames, empty)
+    else:
+        stream = export.arrowStream(frames, empty, file_format)
+    response = Response(stream, mimetype=content_type)
+    response.headers['Content-Disposition'] = f'attachment; filename="zillow-export.{extension}"'
+    return response
+
+
+# Every callback is registered by now
+figure_cache.attach(my_app)
+
+if __name__ == '__main__':
+    # Flask development server; `python serve.py` for multi-worker serving
+    with timedStage('worker pool'):
+        worker_pool.start()
+    print(artifacts.startupReport())
+    my_app.server.run(port=settings.PORT, host=settings.HOST, threaded=True)
@@ -0,0 +1,237 @@
+import argparse
+import functools
+import glob
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tarfile
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.request import urlopen
+
+import pandas as pd
+
+import settings
+from columnar_store import ColumnarStore, FrameSource, manifest_name, writeColumnarStore
+from geometry import processCounties
+from schema import date_cols, location_cols, stored_cols
+
+# column -> (sheet, id column, description column) in zillow_data_dictionary.xlsx
+dictionary_sheets = {
+    'heatingorsystemtypeid': ('HeatingOrSystemTypeID', 'HeatingOrSystemTypeID', 'HeatingOrSystemDesc'),
+    'propertylandusetypeid': ('PropertyLandUseTypeID', 'PropertyLandUseTypeID', 'PropertyLandUseDesc'),
+    'storytypeid': ('StoryTypeID', 'StoryTypeID', 'StoryDesc'),
+    'airconditioningtypeid': ('AirConditioningTypeID', 'AirConditioningTypeID', 'AirConditioningDesc'),
+    'architecturalstyletypeid': ('ArchitecturalStyleTypeID', 'ArchitecturalStyleTypeID', 'ArchitecturalStyleDesc'),
+    'typeconstructiontypeid': ('TypeConstructionTypeID', 'TypeConstructionTypeID', 'TypeConstructionDesc'),
+    'buildingclasstypeid': ('BuildingClassTypeID', 'BuildingClassTypeID', 'BuildingClassDesc'),
+}
+
+counties_artifact = 'counties.json'
+dictionary_artifact = 'type_resolve_dictionary.pkl'
+store_artifact = 'columns'
+vendor_artifact = 'vendor'
+vendored_stylesheet = 'bWLwgP.css'
+vendored_mathjax = 'mathjax'
+
+### Startup instrumentation
+startup_timings = OrderedDict()
+
+
+@contextmanager
+def timedStage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = time.perf_counter() - start
+
+
+def startupReport():
+    lines = [f"{name:<32}{seconds * 1000:>10.1f} ms" for name, seconds in startup_timings.items()]
+    lines.append(f"{'total':<32}{sum(startup_timings.values()) * 1000:>10.1f} ms")
+    return "\n".join(lines)
+
+
+def artifactPath(name):
+    return os.path.join(settings.ARTIFACT_CACHE_DIR, name)
+
+
+### Readers for the original sources
+def fetchCounties(url=settings.COUNTIES_GEOJSON_URL):
+    with urlopen(url) as response:
+        return json.load(response)
+
+
+def readTypeResolveDictionary(path=settings.DATA_DICTIONARY_PATH):
+    type_resolve_dictionary = {}
+    with pd.ExcelFile(path) as xls:
+        for col, (sheet, id_col, desc_col) in dictionary_sheets.items():
+            sheet_df = pd.read_excel(xls, sheet)
+            type_resolve_dictionary[col] = dict(zip(sheet_df[id_col], sheet_df[desc_col]))
+    return type_resolve_dictionary
+
+
+def readDataset(path=settings.DATASET_PATH):
+    return pd.read_pickle(path)
+
+
+def writeDatasetStore(df, directory):
+    partition_by = (location_cols[0], date_cols[0]) if settings.STORE_PARTITIONED else None
+    return writeColumnarStore(df, directory, [col for col in stored_cols if col in df], partition_by)
+
+
+### Lazy loaders: every artifact is read from the local cache when it has been built, falls back to
+### the original source otherwise, and is loaded at most once per process, on first use
+@functools.lru_cache(maxsize=None)
+def counties():
+    with timedStage('counties geojson'):
+        path = artifactPath(counties_artifact)
+        if os.path.exists(path):
+            with open(path) as handle:
+                return json.load(handle)
+        try:
+            return fetchCounties()
+        except OSError as error:
+            # Air-gapped and never built: the choropleth renders empty rather than the app failing
+            print(f"Could not load the counties geojson ({error}), run `python artifacts.py build` first")
+            return {'type': 'FeatureCollection', 'features': []}
+
+
+@functools.lru_cache(maxsize=None)
+def countyGeometry(fips_codes):
+    # The features of fips_codes, simplified and quantized, serialized once per process
+    with timedStage('county geometry'):
+        geometry = processCounties(counties(), fips_codes, settings.GEOMETRY_SIMPLIFY_TOLERANCE,
+                                   settings.GEOMETRY_DECIMALS)
+        return json.dumps(geometry, separators=(',', ':')).encode('utf-8')
+
+
+@functools.lru_cache(maxsize=None)
+def typeResolveDictionary():
+    with timedStage('type resolve dictionary'):
+        path = artifactPath(dictionary_artifact)
+        if os.path.exists(path):
+            with open(path, 'rb') as handle:
+                return pickle.load(handle)
+        return readTypeResolveDictionary()
+
+
+@functools.lru_cache(maxsize=None)
+def dataset():
+    with timedStage('dataset'):
+        return readDataset()
+
+
+@functools.lru_cache(maxsize=None)
+def dataSource():
+    # The memory-mapped columnar store when it has been built, else the pickled frame held in memory
+    path = artifactPath(store_artifact)
+    if os.path.exists(os.path.join(path, manifest_name)):
+        with timedStage('columnar store'):
+            return ColumnarStore(path)
+    return FrameSource(dataset())
+
+
+def cacheVersion():
+    # Fingerprint of everything a memoized figure depends on besides its inputs: the data served (the
+    # store manifest, or the pickled dataset's size and mtime), the data dictionary, the app's modules
+    # and the ZILLOW_* settings. Figures cached under another version are never read back.
+    digest = hashlib.sha1()
+    manifest = os.path.join(artifactPath(store_artifact), manifest_name)
+    for path in [manifest, settings.DATASET_PATH, settings.DATA_DICTIONARY_PATH]:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8'))
+    if os.path.exists(manifest):
+        with open(manifest, 'rb') as handle:
+            digest.update(handle.read())
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+        with open(path, 'rb') as handle:
+            digest.update(handle.read())
+    digest.update(json.dumps(sorted((name, value) for name, value in os.environ.items()
+                                    if name.startswith('ZILLOW_'))).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+### Page assets: only passed to the page once `python artifacts.py vendor` has copied them into the
+### artifact cache, so the app never depends on a third-party host
+def vendoredUrl(path):
+    if os.path.exists(os.path.join(artifactPath(vendor_artifact), path)):
+        return '/vendor/' + path
+    return None
+
+
+def stylesheetUrls():
+    stylesheet = vendoredUrl(vendored_stylesheet)
+    return [stylesheet] if stylesheet else []
+
+
+def scriptUrls():
+    mathjax = vendoredUrl(vendored_mathjax + '/MathJax.js')
+    return [f"{mathjax}?config={settings.MATHJAX_CONFIG}"] if mathjax else []
+
+
+def vendorAssets(cache_dir=settings.ARTIFACT_CACHE_DIR):
+    vendor_dir = os.path.join(cache_dir, vendor_artifact)
+    os.makedirs(vendor_dir, exist_ok=True)
+
+    with urlopen(settings.CODEPEN_STYLESHEET_URL) as response, \
+            open(os.path.join(vendor_dir, vendored_stylesheet), 'wb') as handle:
+        shutil.copyfileobj(response, handle)
+
+    # MathJax 2 loads its config, input/output jax and fonts relative to MathJax.js, so the whole
+    # package is unpacked, minus the unminified copies under unpacked/
+    with tempfile.TemporaryFile() as archive:
+        with urlopen(settings.MATHJAX_PACKAGE_URL) as response:
+            shutil.copyfileobj(response, archive)
+        archive.seek(0)
+        target = os.path.join(vendor_dir, vendored_mathjax)
+        shutil.rmtree(target, ignore_errors=True)
+        with tarfile.open(fileobj=archive, mode='r:gz') as package:
+            for member in package.getmembers():
+                name = member.name.split('/', 1)[-1]
+                if not member.isfile() or name.startswith('unpacked/') or '..' in name.split('/'):
+                    continue
+                path = os.path.join(target, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with package.extractfile(member) as source, open(path, 'wb') as handle:
+                    shutil.copyfileobj(source, handle)
+
+
+### One-time build step
+def buildArtifacts(cache_dir=settings.ARTIFACT_CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+
+    with timedStage('build columnar store'):
+        df = readDataset()
+        writeDatasetStore(df, os.path.join(cache_dir, store_artifact))
+
+    with timedStage('build counties geojson'):
+        # Only the counties present in the dataset are ever drawn
+        fips_codes = set(df.fips.astype(str).unique())
+        all_counties = fetchCounties()
+        subset = dict(all_counties, features=[feature for feature in all_counties['features']
+                                              if feature['id'] in fips_codes])
+        with open(os.path.join(cache_dir, counties_artifact), 'w') as handle:
+            json.dump(subset, handle)
+
+    with timedStage('build type resolve dictionary'):
+        with open(os.path.join(cache_dir, dictionary_artifact), 'wb') as handle:
+            pickle.dump(readTypeResolveDictionary(), handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the local artifact cache the dashboard loads from")
+    parser.add_argument('command', choices=['build', 'vendor'])
+    parser.add_argument('--cache-dir', default=settings.ARTIFACT_CACHE_DIR)
+    args = parser.parse_args()
+    if args.command == 'vendor':
+        vendorAssets(args.cache_dir)
+    else:
+        buildArtifacts(args.cache_dir)
+        print(startupReport())
@@ -0,0 +1,94 @@
+// Display-only interactions, answered in the browser from what the server callbacks already sent.
+// Dash loads every .js file in assets/ on its own; app.py refers to these through ClientsideFunction.
+
+// Callback requests carry an id of their page load, so the server only lets a request supersede an
+// earlier one of the same browser tab (see worker_pool.sessionId)
+(function () {
+    var page = Date.now().toString(36) + Math.random().toString(36).slice(2);
+    var fetch = window.fetch;
+    window.fetch = function (resource, init) {
+        var url = typeof resource === 'string' ? resource : resource.url;
+        if (url.indexOf('_dash-update-component') !== -1) {
+            init = Object.assign({}, init);
+            init.headers = Object.assign({}, init.headers, {'X-Zillow-Page': page});
+        }
+        return fetch.call(this, resource, init);
+    };
+})();
+
+function histogramFigure(histogram, nbins, label, template) {
+    nbins = nbins > 0 ? Math.floor(nbins) : histogram.default_bins;
+    if (histogram.figure) {
+        // Client histogram mode: plotly.js bins the raw values itself
+        var binned = Object.assign({}, histogram.figure.data[0], {nbinsx: nbins});
+        return Object.assign({}, histogram.figure, {data: [binned]});
+    }
+    // Merges the fine bins of FineBins.compactCounts: runs of `group` fine bins from the first occupied
+    // one, the last run padded past the occupied range
+    var counts = histogram.counts;
+    var step = (histogram.high - histogram.low) / histogram.n_fine;
+    var edge = function (index) {
+        return index >= histogram.n_fine ? histogram.high : histogram.low + index * step;
+    };
+    var group = Math.max(1, Math.ceil(counts.length / nbins));
+    var x = [], y = [], width = [];
+    for (var start = 0; start < counts.length; start += group) {
+        var total = 0;
+        for (var i = start; i < Math.min(start + group, counts.length); i++) {
+            total += counts[i];
+        }
+        var left = edge(histogram.first + start);
+        var right = edge(histogram.first + start + group);
+        x.push(left + (right - left) / 2);
+        y.push(total);
+        width.push(right - left);
+    }
+    return {
+        data: [{type: 'bar', x: x, y: y, width: width,
+                hovertemplate: label + '=%{x}<br>Units Sold=%{y}<extra></extra>'}],
+        layout: {template: template, bargap: 0, xaxis: {title: {text: label}}, yaxis: {title: {text: 'Units Sold'}}}
+    };
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    zillow: {
+        // Tab 1: the Histogram/Boxplot radio and the bins field redraw from the selection's summary
+        metricFigure: function (summary, kind, nbins) {
+            if (!summary) {
+                return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+            }
+            if (kind !== 'Histogram') {
+                return [summary.box, {display: 'none'}];
+            }
+            var template = summary.box.layout ? summary.box.layout.template : undefined;
+            return [histogramFigure(summary.histogram, nbins, summary.label, template), {display: 'block'}];
+        },
+        // Tab 2: the Violin/Box radio picks one of the figures sent for the selection. A selection of few
+        // rows comes with a raw-point box only, whose traces are turned into the violins px.violin draws
+        pickFigure: function (figures, kind) {
+            if (!figures) {
+                return window.dash_clientside.no_update;
+            }
+            if (figures[kind] || kind !== 'Violin') {
+                return figures[kind];
+            }
+            var box = figures.Box;
+            var data = box.data.map(function (trace) {
+                var violin = Object.assign({}, trace, {type: 'violin', box: {visible: false}, scalegroup: 'True'});
+                delete violin.notched;
+                return violin;
+            });
+            var layout = Object.assign({}, box.layout, {violinmode: box.layout.boxmode});
+            delete layout.boxmode;
+            return Object.assign({}, box, {data: data, layout: layout});
+        },
+        // Every tab stays mounted; the selected one is shown and the others hidden
+        showTab: function (value, id) {
+            return id === 'tab-' + value ? {} : {display: 'none'};
+        },
+        // The bottom percentile buttons are on after an odd number of clicks
+        toggleClass: function (n_clicks) {
+            return (n_clicks || 0) % 2 ? 'button-59 button-59-on' : 'button-59';
+        }
+    }
+});
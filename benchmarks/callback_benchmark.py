@@ -0,0 +1,163 @@
+import argparse
+import gc
+import importlib
+import itertools
+import json
+import os
+import sys
+import time
+import tracemalloc
+import zlib
+
+import numpy as np
+from plotly.utils import PlotlyJSONEncoder
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_data import datasetPaths, sizes, writeDataset  # noqa: E402
+
+### Calls the tab callbacks directly, in process, over a grid of filter and slider inputs, on a
+### synthetic dataset, and reports latency percentiles, peak traced memory and response payload size
+### per callback. Runs offline: the data, the data dictionary and the county shapes are all generated.
+###
+###   python benchmarks/callback_benchmark.py --size 1m [--store] [--repeat 3] [--json results.json]
+
+
+def tab1Grid(app):
+    min_bed_rooms, max_bed_rooms = app.source.bounds('bedroomcnt')
+    min_date, max_date = app.source.bounds('transactiondate')
+    middle_date = (min_date + (max_date - min_date) / 2).strftime('%Y-%m-%d')
+    for fips, pools, bed_rooms, dates, bottom in itertools.product(
+            [None, ['06037'], ['06059', '06111']], [None, [1]], [[min_bed_rooms, max_bed_rooms], [2, 4]],
+            [(None, None), (None, middle_date)], [(0, 0), (1, 0), (1, 1)]):
+        yield fips, pools, dates[0], dates[1], bed_rooms, bottom[0], bottom[1]
+
+
+def tab2Grid():
+    return itertools.product(["yearbuilt", "fips", "heatingorsystemtypeid", "bedroomcnt"],
+                             ["taxvaluedollarcnt", "calculatedfinishedsquarefeet"],
+                             [[0, 100], [10, 90], [40, 60]], [[0, 100], [25, 75]])
+
+
+def tab3Grid(app):
+    min_year, max_year = app.source.bounds('yearbuilt')
+    return itertools.product(["fips", "yearbuilt", "propertylandusetypeid", "airconditioningtypeid"],
+                             [[0, 100], [20, 80]], [[0, 100], [5, 50]],
+                             [[min_year, max_year], [1950, 2000]])
+
+
+def payloadBytes(outputs):
+    payload = json.dumps(outputs, cls=PlotlyJSONEncoder).encode('utf-8')
+    return len(payload), len(zlib.compress(payload, 6))
+
+
+def tab1Chain(app, filters):
+    # What one change of a tab 1 filter costs end to end: the shared selection and the data of the three
+    # figures (the Histogram/Boxplot radios and the bins fields are then redrawn in the browser)
+    selection = app.selectTab1Rows(*filters)
+    return (app.plotValuationByFilters(selection), app.plotSquareFootageByFilters(selection),
+            app.countCountiesByFilters(selection))
+
+
+def cases(app):
+    yield from (('tab1', tab1Chain, (app, filters)) for filters in tab1Grid(app))
+    yield from (('plotQuartileAfterSlicingDicing', app.quartileFigures, args + (False,)) for args in tab2Grid())
+    yield from (('plotAggregatedMetrics', app.aggregatedFigures, args + (False,)) for args in tab3Grid(app))
+    # The same inputs answered as while a slider is being dragged
+    yield from (('plotQuartileAfterSlicingDicing drag', app.quartileFigures, args + (True,)) for args in tab2Grid())
+    yield from (('plotAggregatedMetrics drag', app.aggregatedFigures, args + (True,)) for args in tab3Grid(app))
+
+
+def measure(app, repeat):
+    results = {}
+    for name, func, args in cases(app):
+        stats = results.setdefault(name, {'seconds': [], 'peak_bytes': [], 'payload_bytes': [], 'gzip_bytes': []})
+        # Timed runs first, then one traced run for memory, since tracing slows allocation down
+        for _ in range(repeat):
+            start = time.perf_counter()
+            outputs = func(*args)
+            stats['seconds'].append(time.perf_counter() - start)
+        gc.collect()
+        tracemalloc.start()
+        outputs = func(*args)
+        stats['peak_bytes'].append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        payload, compressed = payloadBytes(outputs)
+        stats['payload_bytes'].append(payload)
+        stats['gzip_bytes'].append(compressed)
+    return results
+
+
+def summarize(results):
+    summary = {}
+    for name, stats in results.items():
+        seconds = np.array(stats['seconds']) * 1000
+        summary[name] = {
+            'calls': len(seconds),
+            'p50_ms': float(np.percentile(seconds, 50)),
+            'p95_ms': float(np.percentile(seconds, 95)),
+            'max_ms': float(seconds.max()),
+            'peak_mib': max(stats['peak_bytes']) / 2 ** 20,
+            'payload_kib_p50': float(np.median(stats['payload_bytes'])) / 1024,
+            'payload_kib_max': max(stats['payload_bytes']) / 1024,
+            'gzip_kib_p50': float(np.median(stats['gzip_bytes'])) / 1024,
+        }
+    return summary
+
+
+def report(summary, startup):
+    columns = ['calls', 'p50_ms', 'p95_ms', 'max_ms', 'peak_mib', 'payload_kib_p50', 'payload_kib_max', 'gzip_kib_p50']
+    lines = [f"{'callback':<40}" + ''.join(f"{col:>16}" for col in columns)]
+    for name, stats in summary.items():
+        lines.append(f"{name:<40}" + ''.join(f"{stats[col]:>16.1f}" if isinstance(stats[col], float)
+                                             else f"{stats[col]:>16}" for col in columns))
+    lines.append("")
+    lines.append(startup)
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard callbacks on synthetic data")
+    parser.add_argument('--size', choices=list(sizes), default='100k')
+    parser.add_argument('--rows', type=int, help="exact row count, overrides --size")
+    parser.add_argument('--data-dir', default=os.path.join('..', 'benchmark-data'))
+    parser.add_argument('--store', action='store_true', help="build and serve from the columnar store")
+    parser.add_argument('--figure-cache', action='store_true',
+                        help="keep the figure cache on (off by default, so every call is computed)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help="also write the summary to this file")
+    args = parser.parse_args()
+
+    n_rows = args.rows or sizes[args.size]
+    directory = os.path.abspath(os.path.join(args.data_dir, str(n_rows)))
+    paths = datasetPaths(directory)
+    # settings reads the environment on import, so everything is pointed at the synthetic data first
+    os.environ.update({
+        'ZILLOW_DATASET_PATH': paths['dataset'],
+        'ZILLOW_DATA_DICTIONARY_PATH': paths['dictionary'],
+        'ZILLOW_ARTIFACT_CACHE_DIR': paths['artifacts'],
+        'ZILLOW_WORKER_PROCESSES': '0',
+    })
+    if not args.figure_cache:
+        os.environ['ZILLOW_FIGURE_CACHE'] = 'off'
+    writeDataset(directory, n_rows)
+
+    artifacts = importlib.import_module('artifacts')
+    store = os.path.join(paths['artifacts'], artifacts.store_artifact)
+    if args.store and not os.path.exists(os.path.join(store, artifacts.manifest_name)):
+        df = artifacts.readDataset()
+        artifacts.writeDatasetStore(df, store)
+        del df
+    elif not args.store and os.path.exists(store):
+        print(f"Serving from the columnar store in {store}; delete it to benchmark the in-memory frame")
+
+    app = importlib.import_module('app')
+    # Whatever artifacts.dataSource() picked, which is the store whenever one exists, --store or not
+    from_store = isinstance(app.source, artifacts.ColumnarStore)
+    summary = summarize(measure(app, args.repeat))
+    print(f"{n_rows} rows, {'columnar store' if from_store else 'in-memory frame'}")
+    print(report(summary, artifacts.startupReport()))
+    if args.json:
+        with open(args.json, 'w') as handle:
+            json.dump({'rows': n_rows, 'store': from_store, 'callbacks': summary,
+                       'startup_seconds': dict(artifacts.startup_timings)}, handle, indent=1)
@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+### Synthetic stand-in for processed/sold_houses_no_outlier.pkl: the same columns and dtypes, value
+### distributions close to the 2016-2017 Zillow sales of the three counties, and the ID categories
+### of the real data dictionary, so every callback path (including label resolution) is exercised.
+
+sizes = {'100k': 100_000, '1m': 1_000_000, '10m': 10_000_000}
+
+counties = {'06037': ('Los Angeles County', 0.65, (-118.25, 34.2)),
+            '06059': ('Orange County', 0.27, (-117.75, 33.7)),
+            '06111': ('Ventura County', 0.08, (-119.05, 34.4))}
+
+# column -> {id: (description, share of rows)}; whatever share is left over is missing
+id_distributions = {
+    'heatingorsystemtypeid': {1: ('Baseboard', 0.002), 2: ('Central', 0.39), 6: ('Forced air', 0.012),
+                              7: ('Floor/Wall', 0.22), 13: ('None', 0.001), 18: ('Radiant', 0.002),
+                              20: ('Solar', 0.001), 24: ('Yes', 0.013)},
+    'propertylandusetypeid': {31: ('Commercial/Office/Residential Mixed Used', 0.0005),
+                              246: ('Duplex (2 Units, Any Combination)', 0.011), 247: ('Triplex', 0.003),
+                              248: ('Quadruplex', 0.004), 260: ('Residential General', 0.001),
+                              261: ('Single Family Residential', 0.665), 263: ('Mobile Home', 0.001),
+                              265: ('Cluster Home', 0.0005), 266: ('Condominium', 0.24),
+                              269: ('Planned Unit Development', 0.072), 275: ('Manufactured, Modular, Prefab', 0.002)},
+    'storytypeid': {7: ('Basement', 0.0006)},
+    'airconditioningtypeid': {1: ('Central', 0.29), 3: ('Evaporative Cooler', 0.0001), 5: ('None', 0.003),
+                              9: ('Refrigeration', 0.0001), 11: ('Wall Unit', 0.0008), 13: ('Yes', 0.009)},
+    'architecturalstyletypeid': {2: ('Bungalow', 0.0001), 3: ('Cape Cod', 0.0003), 7: ('Contemporary', 0.0022),
+                                 8: ('Conventional', 0.0002), 21: ('Ranch/Rambler', 0.0001)},
+    'typeconstructiontypeid': {4: ('Concrete', 0.0001), 6: ('Frame', 0.0031), 13: ('Steel', 0.0001)},
+    'buildingclasstypeid': {3: ('Non-combustible exterior walls, wood or steel frame', 0.0001),
+                            4: ('Wood or wood and steel frames', 0.0002)},
+    'buildingqualitytypeid': {1: ('Best', 0.01), 4: ('Good', 0.27), 7: ('Average', 0.22), 10: ('Fair', 0.02),
+                              12: ('Poor', 0.002)},
+}
+
+
+def idColumn(rng, n_rows, distribution):
+    ids = np.array(list(distribution) + [np.nan])
+    shares = np.array([share for _, share in distribution.values()])
+    return rng.choice(ids, n_rows, p=np.append(shares, 1 - shares.sum()))
+
+
+def countColumn(rng, n_rows, values, shares, missing=0.0):
+    column = rng.choice(np.asarray(values, dtype=float), n_rows, p=shares)
+    column[rng.random(n_rows) < missing] = np.nan
+    return column
+
+
+def syntheticParcels(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    fips = rng.choice(list(counties), n_rows, p=[share for _, share, _ in counties.values()])
+    bedrooms = countColumn(rng, n_rows, range(0, 9), [0.01, 0.06, 0.28, 0.36, 0.21, 0.06, 0.015, 0.004, 0.001])
+    # Size follows bedrooms, value follows size with a county premium and a heavy right tail
+    square_feet = np.round(np.exp(rng.normal(6.9 + 0.17 * bedrooms, 0.3)))
+    county_premium = np.where(fips == '06059', 0.25, np.where(fips == '06111', 0.1, 0.0))
+    tax_value = np.round(np.exp(rng.normal(5.0 + 1.05 * np.log(square_feet) + county_premium, 0.55)))
+    year_built = np.clip(np.round(rng.normal(1962, 22, n_rows)), 1885, 2016).astype(np.int64)
+    days = rng.integers(0, 633, n_rows)
+
+    df = pd.DataFrame({
+        'parcelid': rng.permutation(np.arange(10_711_000, 10_711_000 + n_rows)),
+        'fips': fips,
+        'transactiondate': np.datetime64('2016-01-01') + days.astype('timedelta64[D]'),
+        'yearbuilt': year_built,
+        'fireplaceflag': rng.random(n_rows) < 0.002,
+        'taxdelinquencyflag': np.where(rng.random(n_rows) < 0.02, 'Y', None),
+        'hashottuborspa': rng.random(n_rows) < 0.025,
+        'numberofstories': countColumn(rng, n_rows, [1, 2, 3], [0.55, 0.43, 0.02], missing=0.77),
+        'unitcnt': countColumn(rng, n_rows, [1, 2, 3, 4], [0.97, 0.02, 0.005, 0.005], missing=0.35),
+        'roomcnt': countColumn(rng, n_rows, range(0, 12), [0.76] + [0.24 / 11] * 11),
+        'poolcnt': (rng.random(n_rows) < 0.2).astype(float),
+        'bathroomcnt': np.clip(np.round(rng.normal(bedrooms * 0.6 + 0.8, 0.6) * 2) / 2, 0, 10),
+        'bedroomcnt': bedrooms,
+        'fireplacecnt': countColumn(rng, n_rows, [1, 2, 3], [0.85, 0.12, 0.03], missing=0.89),
+        'calculatedfinishedsquarefeet': square_feet,
+        'taxvaluedollarcnt': tax_value,
+        'poolsizesum': np.where(rng.random(n_rows) < 0.01, np.round(rng.normal(500, 120, n_rows)), np.nan),
+    })
+    for col, distribution in id_distributions.items():
+        df[col] = idColumn(rng, n_rows, distribution)
+    return df
+
+
+def writeDataDictionary(path):
+    # Imported here: importing artifacts reads settings, which the benchmark points at this data first
+    from artifacts import dictionary_sheets
+    with pd.ExcelWriter(path) as writer:
+        for col, (sheet, id_col, desc_col) in dictionary_sheets.items():
+            distribution = id_distributions[col]
+            pd.DataFrame({id_col: list(distribution), desc_col: [desc for desc, _ in distribution.values()]}) \
+                .to_excel(writer, sheet_name=sheet, index=False)
+
+
+def writeCounties(path, vertices=400):
+    # Offline stand-in for the counties GeoJSON: one polygon per county, with about as many
+    # vertices as the real outlines so the choropleth payload stays representative
+    features = []
+    for code, (name, _, (lon, lat)) in counties.items():
+        angles = np.linspace(0, 2 * np.pi, vertices)
+        radius = 0.35 * (1 + 0.15 * np.sin(7 * angles))
+        ring = np.round(np.stack([lon + radius * np.cos(angles), lat + radius * np.sin(angles)], axis=1), 5)
+        ring[-1] = ring[0]
+        features.append({'type': 'Feature', 'id': code, 'properties': {'NAME': name},
+                         'geometry': {'type': 'Polygon', 'coordinates': [ring.tolist()]}})
+    with open(path, 'w') as handle:
+        json.dump({'type': 'FeatureCollection', 'features': features}, handle)
+
+
+def datasetPaths(directory):
+    return {
+        'dataset': os.path.join(directory, 'sold_houses_no_outlier.pkl'),
+        'dictionary': os.path.join(directory, 'zillow_data_dictionary.xlsx'),
+        'artifacts': os.path.join(directory, 'artifacts'),
+    }
+
+
+def writeDataset(directory, n_rows, seed=0):
+    # Lays out a self-contained data directory: the dataset, the data dictionary and a pre-seeded
+    # artifact cache holding the county shapes, so nothing is downloaded. Returns the paths.
+    from artifacts import counties_artifact
+    paths = datasetPaths(directory)
+    os.makedirs(paths['artifacts'], exist_ok=True)
+    if not os.path.exists(paths['dataset']):
+        syntheticParcels(n_rows, seed).to_pickle(paths['dataset'])
+    if not os.path.exists(paths['dictionary']):
+        writeDataDictionary(paths['dictionary'])
+    if not os.path.exists(os.path.join(paths['artifacts'], counties_artifact)):
+        writeCounties(os.path.join(paths['artifacts'], counties_artifact))
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic Zillow-like dataset for benchmarking")
+    parser.add_argument('--size', choices=list(sizes), default='100k')
+    parser.add_argument('--rows', type=int, help="exact row count, overrides --size")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=os.path.join('..', 'benchmark-data'))
+    args = parser.parse_args()
+    n_rows = args.rows or sizes[args.size]
+    print(writeDataset(os.path.join(args.out, str(n_rows)), n_rows, args.seed))
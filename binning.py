@@ -0,0 +1,49 @@
+import functools
+
+import numpy as np
+
+import settings
+
+
+def fineBinIds(source, col, n_fine):
+    values = np.asarray(source.column(col), dtype=float)
+    low = np.nanmin(values)
+    high = np.nanmax(values)
+    if high == low:
+        high = low + 1
+    scaled = np.clip(np.floor((values - low) / (high - low) * n_fine), 0, n_fine - 1)
+    # NaNs go to the extra bin n_fine, which is dropped from every count
+    scaled[np.isnan(scaled)] = n_fine
+    return {'edges': np.linspace(low, high, n_fine + 1), 'bin_ids': scaled.astype(np.min_scalar_type(n_fine))}
+
+
+class FineBins:
+    # Every row of a metric column is assigned, once, to one of n_fine equal-width bins over the
+    # column's full range. A histogram of any filtered selection is then a bincount over the selected
+    # rows' bin ids, and the coarser bins the user asks for are merged runs of fine bins. The bin ids
+    # are kept by the source (memory-mapped from a columnar store), not per process.
+    def __init__(self, source, columns, n_fine=settings.HISTOGRAM_FINE_BINS):
+        self.n_fine = n_fine
+        self.edges = {}
+        self.bin_ids = {}
+        for col in columns:
+            binned = source.derivedArrays(f"bins-{col}-{n_fine}", functools.partial(fineBinIds, source, col, n_fine))
+            self.edges[col] = np.array(binned['edges'])
+            self.bin_ids[col] = binned['bin_ids']
+
+    def fineCounts(self, col, rows=None):
+        bin_ids = self.bin_ids[col]
+        if rows is not None and len(rows) != len(bin_ids):
+            bin_ids = bin_ids[rows]
+        return np.bincount(bin_ids, minlength=self.n_fine + 1)[:self.n_fine]
+
+    def compactCounts(self, col, rows=None):
+        # The fine counts over their occupied range plus what rebuilds the edges: enough for the browser
+        # to merge them into any number of bins (histogramFigure in assets/clientside.js)
+        counts = self.fineCounts(col, rows)
+        occupied = np.flatnonzero(counts)
+        first, last = (int(occupied[0]), int(occupied[-1]) + 1) if len(occupied) else (0, 0)
+        edges = self.edges[col]
+        return {'first': first, 'counts': counts[first:last].tolist(), 'low': float(edges[0]),
+                'high': float(edges[-1]), 'n_fine': self.n_fine}
+
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+from figure_cache import normalizeInput
+
+
+def idKey(value):
+    # The data dictionary has integer IDs while the data holds floats (2.0) or zero-padded strings
+    # ('06037'), so both sides are matched on their numeric value where they have one
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def metadataHtml(heading, descriptions):
+    return f"<b>{heading}</b> <br/><br/>" + "".join(f"{key}\t{val}<br/>" for key, val in descriptions.items())
+
+
+class CategoryLabels:
+    # Resolves the ID columns that have a data dictionary sheet (fips and the *typeid columns) to
+    # their descriptions. Built with the other indexes, before the app forks: every such column of the
+    # source becomes a categorical over all of its rows, whose categories read "<description> (<id>)" in
+    # ID order, so labelling the rows of a request is a take of their codes. Values without their rows
+    # (the categories of an aggregate) are matched against the column's distinct raw values instead.
+    # The metadata HTML shown next to the figures is rendered once per column.
+    def __init__(self, source, type_resolve_dictionary):
+        self.dictionary = type_resolve_dictionary
+        self.domains = {}
+        self.categoricals = {}
+        self.html = {}
+        for col in self.dictionary:
+            if col in source.columnNames():
+                self.build(col, source.decode(col))
+
+    def __contains__(self, col):
+        return col in self.dictionary
+
+    def build(self, col, values):
+        descriptions = {idKey(key): val for key, val in self.dictionary[col].items()}
+        domain = pd.Index(sorted(pd.Series(values).dropna().unique(), key=idKey))
+        labels = [f"{descriptions[idKey(value)]} ({normalizeInput(value)})" if idKey(value) in descriptions
+                  else str(normalizeInput(value)) for value in domain]
+        dtype = pd.CategoricalDtype(labels, ordered=True)
+        self.domains[col] = domain
+        self.categoricals[col] = pd.Categorical.from_codes(domain.get_indexer(np.asarray(values)), dtype=dtype)
+
+    def resolve(self, values, col, rows=None):
+        # Labelled categorical for the raw values of col, which are those of the source's rows when rows
+        # is given; columns without a dictionary pass through
+        if col not in self.categoricals:
+            return values
+        if rows is not None:
+            return self.categoricals[col].take(rows)
+        codes = self.domains[col].get_indexer(np.asarray(values))
+        return pd.Categorical.from_codes(codes, dtype=self.categoricals[col].dtype)
+
+    def resolveFrame(self, frame, col, rows=None):
+        if col not in self.categoricals:
+            return frame
+        # Shallow copy: the other columns are shared with the source frame, not duplicated
+        labelled = frame.copy(deep=False)
+        labelled[col] = self.resolve(frame[col], col, rows)
+        return labelled
+
+    def metadata(self, col, heading):
+        key = (col, heading)
+        if key not in self.html:
+            self.html[key] = metadataHtml(heading, self.dictionary[col]) if col in self.dictionary else ""
+        return self.html[key]
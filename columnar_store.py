@@ -0,0 +1,297 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from schema import date_cols, isCategoricalCol
+
+manifest_name = 'manifest.json'
+# Subdirectory of the store holding arrays derived from its columns (see ColumnarStore.derivedArrays)
+derived_dir = 'derived'
+epoch = np.datetime64('1970-01-01', 'D')
+
+
+def smallestIntDtype(values):
+    for dtype in (np.int8, np.int16, np.int32, np.int64):
+        info = np.iinfo(dtype)
+        if len(values) == 0 or (values.min() >= info.min and values.max() <= info.max):
+            return np.dtype(dtype)
+
+
+def jsonScalar(value):
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(value).strftime('%Y-%m-%d')
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def encodeColumn(col, series):
+    # Returns the array to store and the manifest entry needed to decode it back
+    entry = {'original_dtype': str(series.dtype)}
+    if isCategoricalCol(col) or series.dtype == object:
+        codes, categories = pd.factorize(series, sort=True)
+        entry['kind'] = 'categorical'
+        entry['categories'] = [jsonScalar(category) for category in categories]
+        return codes.astype(smallestIntDtype(np.array([-1, len(categories)]))), entry
+    if np.issubdtype(series.dtype, np.datetime64):
+        if series.isna().any():
+            raise ValueError(f"{col} has missing dates, which the int32 day encoding cannot represent")
+        entry['kind'] = 'date'
+        return (series.to_numpy().astype('datetime64[D]') - epoch).astype(np.int32), entry
+    values = series.to_numpy()
+    entry['kind'] = 'numeric'
+    if values.dtype == bool:
+        return values, entry
+    if np.issubdtype(values.dtype, np.integer):
+        return values.astype(smallestIntDtype(values)), entry
+    valid = values[~np.isnan(values)]
+    if np.all(valid == np.round(valid)):
+        if len(valid) == len(values):
+            return values.astype(smallestIntDtype(valid)), entry
+        if len(valid) == 0 or np.abs(valid).max() < 2 ** 24:
+            # Null-bearing small integers (counts, flags) are exact in float32, which keeps NaN
+            return values.astype(np.float32), entry
+    return values, entry
+
+
+def partitionLayout(df, key_col, date_col):
+    # Row order that makes every (key, calendar month of date_col) partition one contiguous row range,
+    # and those ranges with the day span each one covers, in the store's int32 day encoding
+    keys, key_values = pd.factorize(df[key_col], sort=True)
+    dates = df[date_col].to_numpy()
+    months = dates.astype('datetime64[M]').astype(np.int64)
+    days = (dates.astype('datetime64[D]') - epoch).astype(np.int64)
+    order = np.lexsort((months, keys))
+    keys, months, days = keys[order], months[order], days[order]
+    starts = np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]) | (months[1:] != months[:-1])])
+    stops = np.r_[starts[1:], len(order)]
+    partitions = [{'key': jsonScalar(key_values[keys[start]]) if keys[start] >= 0 else None,
+                   'month': str(np.datetime64(int(months[start]), 'M')), 'start': int(start), 'stop': int(stop),
+                   'min_day': int(days[start:stop].min()), 'max_day': int(days[start:stop].max())}
+                  for start, stop in zip(starts, stops)]
+    return order, partitions
+
+
+def writeColumnarStore(df, directory, columns=None, partition_by=None):
+    # One .npy file per column plus a manifest; the files are what workers memory-map. With
+    # partition_by=(key column, date column) the rows are stored grouped by key and month and the
+    # manifest lists the row range of every partition, which is what lets filters skip them.
+    os.makedirs(directory, exist_ok=True)
+    # Whatever was derived from the previous columns no longer matches them
+    shutil.rmtree(os.path.join(directory, derived_dir), ignore_errors=True)
+    manifest = {'n_rows': len(df), 'columns': {}}
+    if partition_by is not None:
+        order, manifest['partitions'] = partitionLayout(df, *partition_by)
+        manifest['partition_by'] = list(partition_by)
+        df = df.take(order).reset_index(drop=True)
+    for col in columns or list(df.columns):
+        values, entry = encodeColumn(col, df[col])
+        entry['file'] = col + '.npy'
+        entry['dtype'] = str(values.dtype)
+        non_null = df[col].dropna()
+        if len(non_null) and entry['kind'] != 'categorical':
+            entry['min'] = jsonScalar(non_null.min())
+            entry['max'] = jsonScalar(non_null.max())
+        np.save(os.path.join(directory, entry['file']), values)
+        manifest['columns'][col] = entry
+    with open(os.path.join(directory, manifest_name), 'w') as handle:
+        json.dump(manifest, handle, indent=1)
+    return manifest
+
+
+def arrayBytes(values):
+    return values.nbytes
+
+
+def saveArrays(directory, arrays):
+    # Written to a temporary sibling and renamed into place, so a reader never sees a partial set; when
+    # another process got there first, its copy is kept
+    os.makedirs(os.path.dirname(directory), exist_ok=True)
+    staging = tempfile.mkdtemp(dir=os.path.dirname(directory), suffix='.tmp')
+    try:
+        for name, values in arrays.items():
+            np.save(os.path.join(staging, name + '.npy'), values)
+        os.rename(staging, directory)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        if not os.path.isdir(directory):
+            raise
+
+
+def loadArrays(directory):
+    arrays = {}
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.npy'):
+            try:
+                arrays[entry.name[:-4]] = np.load(entry.path, mmap_mode='r')
+            except ValueError:
+                # Object arrays (category labels) cannot be mapped; they are small
+                arrays[entry.name[:-4]] = np.load(entry.path, allow_pickle=True)
+    return arrays
+
+
+class ColumnarStore:
+    # Read side of the store. Columns are opened with mmap_mode='r', so every worker process maps the
+    # same files and shares their pages through the OS page cache; only the rows a callback selects
+    # are ever decoded into a private DataFrame.
+    # A partitioned store additionally serves the columns of single partitions: pruning picks the
+    # partitions a filter can match from the manifest alone, and only their row ranges are read, as
+    # read-only views of the mapping: nothing is copied into a process, whatever the partitions' size.
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, manifest_name)) as handle:
+            self.manifest = json.load(handle)
+        self.n_rows = self.manifest['n_rows']
+        self.arrays = {}
+        self.category_lookups = {}
+        self.partitions = self.manifest.get('partitions')
+        self.partitions_by_key = {}
+        for index, partition in enumerate(self.partitions or []):
+            self.partitions_by_key.setdefault(partition['key'], []).append(index)
+
+    def __len__(self):
+        return self.n_rows
+
+    def columnNames(self):
+        return list(self.manifest['columns'])
+
+    def column(self, col):
+        # Raw stored values: category codes for categoricals, int32 days for dates
+        if col not in self.arrays:
+            entry = self.manifest['columns'][col]
+            self.arrays[col] = np.load(os.path.join(self.directory, entry['file']), mmap_mode='r')
+        return self.arrays[col]
+
+    def prunePartitions(self, keys=None, start_day=None, end_day=None):
+        # (partition index, whether its whole day span lies within the dates) for every partition
+        # that can hold rows with one of keys between start_day and end_day; None means unbounded
+        if keys is None:
+            candidates = range(len(self.partitions))
+        else:
+            candidates = sorted(index for key in set(keys) for index in self.partitions_by_key.get(key, []))
+        selected = []
+        for index in candidates:
+            partition = self.partitions[index]
+            if start_day is not None and partition['max_day'] < start_day:
+                continue
+            if end_day is not None and partition['min_day'] > end_day:
+                continue
+            covered = ((start_day is None or partition['min_day'] >= start_day)
+                       and (end_day is None or partition['max_day'] <= end_day))
+            selected.append((index, covered))
+        return selected
+
+    def partitionColumn(self, index, col):
+        partition = self.partitions[index]
+        return self.column(col)[partition['start']:partition['stop']]
+
+    def derivedArrays(self, name, build):
+        # Per-row arrays computed from the columns (sort orders, bin ids, cubes) are built once, saved in
+        # the store and memory-mapped from there like the columns: every process shares one copy through
+        # the page cache, none holds them in its own memory, and later starts skip the build. A store that
+        # cannot be written to keeps them in memory instead.
+        directory = os.path.join(self.directory, derived_dir, name)
+        if not os.path.isdir(directory):
+            arrays = build()
+            try:
+                saveArrays(directory, arrays)
+            except OSError:
+                return arrays
+        return loadArrays(directory)
+
+    def categories(self, col):
+        if col not in self.category_lookups:
+            entry = self.manifest['columns'][col]
+            categories = pd.Series(entry['categories']).astype(entry['original_dtype']).to_numpy()
+            # Code -1 (missing) indexes the trailing null
+            self.category_lookups[col] = np.append(categories, None if categories.dtype == object else np.nan)
+        return self.category_lookups[col]
+
+    def encode(self, col, values):
+        entry = self.manifest['columns'][col]
+        if entry['kind'] != 'categorical':
+            return list(values)
+        positions = {category: code for code, category in enumerate(self.categories(col)[:-1])}
+        return [positions[value] for value in values if value in positions]
+
+    def encodeDate(self, date):
+        return int((np.datetime64(pd.Timestamp(date), 'D') - epoch).astype(np.int64))
+
+    def bounds(self, col):
+        entry = self.manifest['columns'][col]
+        if entry['kind'] == 'date':
+            return pd.Timestamp(entry['min']), pd.Timestamp(entry['max'])
+        return entry['min'], entry['max']
+
+    def decode(self, col, rows=None):
+        entry = self.manifest['columns'][col]
+        values = self.column(col)
+        values = values if rows is None else values[rows]
+        if entry['kind'] == 'categorical':
+            return self.categories(col)[values]
+        if entry['kind'] == 'date':
+            return values.astype('datetime64[D]').astype('datetime64[ns]')
+        return np.asarray(values).astype(entry['original_dtype'])
+
+    def frame(self, rows=None, columns=None):
+        if columns is None:
+            columns = self.columnNames()
+        columns = list(dict.fromkeys(col for col in columns if col is not None))
+        if rows is not None and len(rows) == self.n_rows:
+            rows = None
+        return pd.DataFrame({col: self.decode(col, rows) for col in columns},
+                            index=rows if rows is not None else None)
+
+
+class FrameSource:
+    # The same interface over an in-memory DataFrame, used when no columnar store has been built
+    partitions = None
+
+    def __init__(self, df):
+        self.df = df
+        self.n_rows = len(df)
+        self.dates = {}
+
+    def __len__(self):
+        return self.n_rows
+
+    def columnNames(self):
+        return list(self.df.columns)
+
+    def column(self, col):
+        if col in date_cols:
+            if col not in self.dates:
+                self.dates[col] = pd.to_datetime(self.df[col]).to_numpy()
+            return self.dates[col]
+        return self.df[col].to_numpy()
+
+    def derivedArrays(self, name, build):
+        # Nothing to persist them in: the data itself is already held in memory
+        return build()
+
+    def encode(self, col, values):
+        return list(values)
+
+    def encodeDate(self, date):
+        return pd.Timestamp(date).to_datetime64()
+
+    def bounds(self, col):
+        return self.df[col].min(), self.df[col].max()
+
+    def decode(self, col, rows=None):
+        values = self.df[col].to_numpy()
+        return values if rows is None else values[rows]
+
+    def frame(self, rows=None, columns=None):
+        # An unfiltered selection is served as the original frame rather than a copy of it, and a
+        # filtered one only materializes the columns the caller is going to plot
+        if rows is None or len(rows) == self.n_rows:
+            return self.df
+        if columns is None:
+            return self.df.take(rows)
+        columns = list(dict.fromkeys(col for col in columns if col is not None))
+        return self.df.iloc[rows, self.df.columns.get_indexer(columns)]
@@ -0,0 +1,154 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+### The /export download: a filter state's rows, or its aggregates by one column, written out as CSV,
+### Parquet or an Arrow IPC stream. The rows come from the FilterEngine the figures use, are decoded a
+### chunk at a time, and each chunk is encoded and sent before the next one is read.
+
+# format -> content type and file extension; all but CSV need pyarrow
+export_formats = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+# Query parameters, named after the FilterEngine keywords the tab callbacks pass
+list_params = ('fips', 'pools')
+date_params = ('start_date', 'end_date')
+range_params = ('bed_rooms', 'year_built')
+percentile_params = ('area_percentiles', 'valuation_percentiles')
+toggle_params = ('bottom_valuation', 'bottom_area')
+
+
+def availableFormats():
+    return [name for name in export_formats if name == 'csv' or pyarrow is not None]
+
+
+def parsePair(value, parse):
+    pair = [parse(bound) for bound in value.split(',')]
+    if len(pair) != 2 or pair[0] > pair[1]:
+        raise ValueError(f"expected low,high and got {value!r}")
+    return pair
+
+
+def parseFilters(args):
+    # Repeated or comma separated fips and pools, ISO dates, low,high ranges and 1/0 toggles. Raises
+    # ValueError on anything the filter engine would not accept.
+    filters = {}
+    for name in list_params:
+        values = [value for arg in args.getlist(name) for value in arg.split(',') if value]
+        if values:
+            filters[name] = values if name == 'fips' else [float(value) for value in values]
+    for name in date_params:
+        if args.get(name):
+            pd.Timestamp(args[name])
+            filters[name] = args[name]
+    for name in range_params:
+        if args.get(name):
+            filters[name] = parsePair(args[name], float)
+    for name in percentile_params:
+        if args.get(name):
+            filters[name] = parsePair(args[name], int)
+            if filters[name][0] < 0 or filters[name][1] > 100:
+                raise ValueError(f"{name} must lie within 0,100")
+    for name in toggle_params:
+        if args.get(name, '0').lower() in ('1', 'true'):
+            filters[name] = True
+    return filters
+
+
+def aggregateFrames(frames, col, metrics):
+    # The columns AggregationCube.rollUp gives (rows, then per metric its mean and _sum, _count and _std),
+    # added up over the frames one at a time; only one row per category is ever held
+    totals = None
+    for frame in frames:
+        groups = frame[col]
+        parts = {'rows': frame.groupby(groups).size()}
+        for metric in metrics:
+            values = frame[metric].astype(float)
+            parts[metric + '_count'] = values.groupby(groups).count()
+            parts[metric + '_sum'] = values.groupby(groups).sum()
+            parts[metric + '_sumsq'] = (values * values).groupby(groups).sum()
+        part = pd.DataFrame(parts)
+        totals = part if totals is None else totals.add(part, fill_value=0)
+    if totals is None:
+        totals = pd.DataFrame(columns=['rows'] + [metric + stat for metric in metrics
+                                                  for stat in ('_count', '_sum', '_sumsq')], dtype=float)
+    summary = pd.DataFrame({col: totals.index.to_numpy(), 'rows': totals['rows'].to_numpy().astype(np.int64)})
+    for metric in metrics:
+        count, total = totals[metric + '_count'].to_numpy(), totals[metric + '_sum'].to_numpy()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / count
+            variance = (totals[metric + '_sumsq'].to_numpy() - count * mean * mean) / (count - 1)
+        summary[metric] = mean
+        summary[metric + '_sum'] = total
+        summary[metric + '_count'] = count.astype(np.int64)
+        summary[metric + '_std'] = np.sqrt(np.maximum(variance, 0))
+    return summary
+
+
+def csvStream(frames, empty):
+    # empty: a frame with no rows and the exported columns, for the header
+    yield empty.to_csv(index=False)
+    for frame in frames:
+        yield frame.to_csv(header=False, index=False)
+
+
+class ChunkSink(io.RawIOBase):
+    # Write-only file pyarrow encodes into; whatever it has written so far is taken out with drain()
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def arrowSchema(empty):
+    # The schema every chunk is converted with, so chunks cannot disagree on a type. A column with no
+    # values to infer from comes out as null; the only object columns stored are strings.
+    schema = pyarrow.Schema.from_pandas(empty, preserve_index=False)
+    for index, field in enumerate(schema):
+        if pyarrow.types.is_null(field.type):
+            schema = schema.set(index, field.with_type(pyarrow.string()))
+    return schema
+
+
+def arrowStream(frames, empty, file_format):
+    # Parquet with one row group per chunk, or an Arrow IPC stream with one record batch per chunk
+    sink = ChunkSink()
+    schema = arrowSchema(empty)
+    if file_format == 'parquet':
+        writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    else:
+        writer = pyarrow.ipc.new_stream(sink, schema)
+    with writer:
+        for frame in frames:
+            writer.write_table(pyarrow.Table.from_pandas(frame, schema=schema, preserve_index=False))
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
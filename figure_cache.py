@@ -0,0 +1,317 @@
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from plotly.io.json import to_json_plotly
+
+import settings
+
+
+def normalizeInput(value, unordered=False):
+    # None, [] and an unselected dropdown all mean "no filter" to the callbacks, so they share a key
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or value == '' or value == [] or value == ():
+        return None
+    if isinstance(value, (list, tuple)):
+        value = [normalizeInput(item) for item in value]
+        if unordered:
+            value = sorted(value, key=repr)
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def cacheKey(name, args, version=''):
+    normalized = [normalizeInput(arg) for arg in args]
+    payload = json.dumps([version, name, normalized], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    # In-process LRU bounded by the total size of its values rather than by entry count: the bytes of
+    # the stored figure JSON by default, or whatever size() measures (array nbytes, for instance)
+    def __init__(self, max_bytes, size=len):
+        self.max_bytes = max_bytes
+        self.size = size
+        self.current_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            payload = self.entries.get(key)
+            if payload is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return payload
+
+    def set(self, key, payload):
+        if self.size(payload) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= self.size(previous)
+            self.entries[key] = payload
+            self.current_bytes += self.size(payload)
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.current_bytes -= self.size(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.current_bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class DirectoryCache:
+    # One file per key in a directory that every worker can see. Pointed at /dev/shm it behaves as a
+    # shared-memory cache, pointed at a regular path it survives restarts. Writes go through a temp
+    # file and os.replace so readers in other processes never observe a partial payload, and the
+    # file mtime doubles as the recency stamp for eviction.
+    eviction_interval = 32
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.writes_since_eviction = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as handle:
+                payload = handle.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return payload
+
+    def set(self, key, payload):
+        if len(payload) > self.max_bytes:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as handle:
+                handle.write(payload)
+            os.replace(tmp_path, self.path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.writes_since_eviction += 1
+        if self.writes_since_eviction >= self.eviction_interval:
+            self.writes_since_eviction = 0
+            self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_bytes -= size
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                os.remove(entry.path)
+
+
+def encodeOutputs(outputs):
+    # A JSON array of a small header and each output encoded as Dash encodes it, so that the outputs can
+    # be sliced out of the payload without parsing it
+    multiple = isinstance(outputs, tuple)
+    fragments = [to_json_plotly(output).encode('utf-8') for output in (outputs if multiple else (outputs,))]
+    header = json.dumps({'multiple': multiple, 'lengths': [len(fragment) for fragment in fragments]})
+    return b'[' + b','.join([header.encode('utf-8')] + fragments) + b']'
+
+
+def decodeFragments(payload):
+    # (whether the function returned a tuple, the encoded outputs)
+    header_end = payload.index(b'}') + 1
+    header = json.loads(payload[1:header_end])
+    fragments, start = [], header_end + 1
+    for length in header['lengths']:
+        fragments.append(payload[start:start + length].decode('utf-8'))
+        start += length + 1
+    return header['multiple'], fragments
+
+
+def decodeOutputs(payload):
+    multiple, fragments = decodeFragments(payload)
+    outputs = [json.loads(fragment) for fragment in fragments]
+    # A callback with a single Output returns the value itself, not a 1-tuple
+    return tuple(outputs) if multiple else outputs[0]
+
+
+class FigureCache:
+    # Memoizes callback outputs as serialized figure JSON: the in-process LRU is checked first, then
+    # the optional shared backend, whose hits get promoted into the LRU of the worker that asked.
+    # Keys include a version (see artifacts.cacheVersion), so a backend that outlives the process never
+    # answers with figures of an older dataset or an older build of the app.
+    # Within a Dash request (see attach), outputs are never decoded: the memoized function returns a
+    # placeholder string per output, Dash encodes the response around those, and the stored JSON of each
+    # output is spliced in for its placeholder. So a hit costs a copy of the payload, and a miss encodes
+    # its outputs once, for the cache, rather than again in Dash.
+    def __init__(self, memory=None, shared=None, version=''):
+        self.memory = memory
+        self.shared = shared
+        self.version = version
+        self.enabled = memory is not None or shared is not None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.callback_stats = {}
+        self.local = threading.local()
+
+    def get(self, key):
+        payload = None
+        if self.memory is not None:
+            payload = self.memory.get(key)
+        if payload is None and self.shared is not None:
+            payload = self.shared.get(key)
+            if payload is not None and self.memory is not None:
+                self.memory.set(key, payload)
+        return payload
+
+    def set(self, key, payload):
+        if self.memory is not None:
+            self.memory.set(key, payload)
+        if self.shared is not None:
+            self.shared.set(key, payload)
+
+    def record(self, name, hit):
+        with self.lock:
+            stats = self.callback_stats.setdefault(name, {'hits': 0, 'misses': 0})
+            if hit:
+                self.hits += 1
+                stats['hits'] += 1
+            else:
+                self.misses += 1
+                stats['misses'] += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'memory_entries': len(self.memory) if self.memory is not None else 0,
+                'memory_bytes': self.memory.current_bytes if self.memory is not None else 0,
+                'callbacks': {name: dict(stats) for name, stats in self.callback_stats.items()},
+            }
+
+    def attach(self, dash_app):
+        # Splices the stored outputs into the responses of the callbacks registered so far; call it once
+        # all of them are
+        if not self.enabled:
+            return
+        for entry in dash_app.callback_map.values():
+            if 'callback' in entry:
+                entry['callback'] = self.splicing(entry['callback'])
+
+    def splicing(self, respond):
+        @functools.wraps(respond)
+        def wrapper(*args, **kwargs):
+            self.local.fragments = {}
+            try:
+                body = respond(*args, **kwargs)
+                for placeholder, fragment in self.local.fragments.items():
+                    body = body.replace(json.dumps(placeholder), fragment)
+                return body
+            finally:
+                self.local.fragments = None
+
+        return wrapper
+
+    def splicingRequest(self):
+        return getattr(self.local, 'fragments', None) is not None
+
+    def outputs(self, key, payload):
+        if not self.splicingRequest():
+            # Called outside a Dash request: the outputs themselves
+            return decodeOutputs(payload)
+        multiple, fragments = decodeFragments(payload)
+        placeholders = []
+        for index, fragment in enumerate(fragments):
+            placeholder = f"figure-cache:{key}:{index}"
+            self.local.fragments[placeholder] = fragment
+            placeholders.append(placeholder)
+        return tuple(placeholders) if multiple else placeholders[0]
+
+    def memoize(self, name):
+        # For functions whose outputs the callback returns as they are: within a request they come back as
+        # placeholders for the encoded outputs. A function that can return its outputs already encoded
+        # (see WorkerPool.offload) exposes that as func.encoded.
+        def decorator(func):
+            if not self.enabled:
+                return func
+            encoded = getattr(func, 'encoded', None)
+
+            @functools.wraps(func)
+            def wrapper(*args):
+                key = cacheKey(name, args, self.version)
+                payload = self.get(key)
+                self.record(name, payload is not None)
+                if payload is None:
+                    if encoded is not None:
+                        payload = encoded(*args)
+                    else:
+                        outputs = func(*args)
+                        payload = encodeOutputs(outputs)
+                        if not self.splicingRequest():
+                            self.set(key, payload)
+                            return outputs
+                    self.set(key, payload)
+                return self.outputs(key, payload)
+
+            return wrapper
+
+        return decorator
+
+
+def figureCacheFromSettings(version=''):
+    backend = settings.FIGURE_CACHE_BACKEND
+    if backend == 'off':
+        return FigureCache()
+    memory = LRUCache(settings.FIGURE_CACHE_MAX_BYTES)
+    if backend == 'disk':
+        shared = DirectoryCache(settings.FIGURE_CACHE_DIR, settings.FIGURE_CACHE_SHARED_MAX_BYTES)
+        return FigureCache(memory, shared, version)
+    if backend == 'shm':
+        shared = DirectoryCache(settings.FIGURE_CACHE_SHM_DIR, settings.FIGURE_CACHE_SHARED_MAX_BYTES)
+        return FigureCache(memory, shared, version)
+    return FigureCache(memory, version=version)
@@ -0,0 +1,150 @@
+import functools
+
+import numpy as np
+
+from columnar_store import arrayBytes
+from figure_cache import LRUCache, cacheKey, normalizeInput
+
+filter_cols = ['fips', 'poolcnt', 'bedroomcnt', 'transactiondate', 'yearbuilt', 'taxvaluedollarcnt',
+               'calculatedfinishedsquarefeet']
+# Multi-select filters whose order does not change the selection
+unordered_filters = ('fips', 'pools')
+
+
+class FilterEngine:
+    # Turns the tab inputs into one combined boolean mask over plain NumPy column arrays, and then
+    # takes the matching rows from the data source once, instead of chaining DataFrame.query calls
+    # that each parse an expression and materialize an intermediate copy. The source is either a
+    # ColumnarStore or a FrameSource, and the mask is evaluated on its stored encoding (category
+    # codes, day numbers) so nothing is decoded for rows that get filtered out.
+    # Over a partitioned store, a selection by fips or transaction date only evaluates the partitions
+    # the store's manifest says can match, on the row ranges of those partitions alone.
+    def __init__(self, source, quantile_index):
+        self.source = source
+        self.quantile_index = quantile_index
+        self.n_rows = len(source)
+        self.columns = {col: source.column(col) for col in filter_cols}
+
+    def mask(self, **filters):
+        return self.evaluate(self.columns.__getitem__, self.n_rows, **filters)
+
+    def percentileMask(self, column, col, percentiles, whole):
+        if whole:
+            return self.quantile_index.percentileRangeMask(col, percentiles)
+        # Within a partition the same value range is compared directly; NaN falls outside it either way
+        low, high = self.quantile_index.bounds(col, percentiles)
+        values = column(col)
+        return (values >= low) & (values <= high)
+
+    def evaluate(self, column, n_rows, whole=True, fips=None, pools=None, bed_rooms=None, start_date=None,
+                 end_date=None, bottom_valuation=False, bottom_area=False, area_percentiles=None,
+                 valuation_percentiles=None, year_built=None):
+        mask = np.ones(n_rows, dtype=bool)
+
+        if start_date is not None:
+            mask &= column('transactiondate') >= self.source.encodeDate(start_date)
+        if end_date is not None:
+            mask &= column('transactiondate') <= self.source.encodeDate(end_date)
+        if fips is not None:
+            if fips != []:
+                mask &= np.isin(column('fips'), self.source.encode('fips', fips))
+        if pools is not None:
+            if pools != []:
+                mask &= np.isin(column('poolcnt'), self.source.encode('poolcnt', pools))
+        if bed_rooms is not None:
+            if len(bed_rooms) == 2:
+                mask &= column('bedroomcnt') >= bed_rooms[0]
+                mask &= column('bedroomcnt') <= bed_rooms[1]
+        if bottom_valuation:
+            mask &= column('taxvaluedollarcnt') <= self.quantile_index.cutoff('taxvaluedollarcnt', 50)
+        if bottom_area:
+            mask &= column('calculatedfinishedsquarefeet') <= self.quantile_index.cutoff(
+                'calculatedfinishedsquarefeet', 50)
+        if area_percentiles is not None:
+            if len(area_percentiles) == 2:
+                mask &= self.percentileMask(column, 'calculatedfinishedsquarefeet', area_percentiles, whole)
+        if valuation_percentiles is not None:
+            if len(valuation_percentiles) == 2:
+                mask &= self.percentileMask(column, 'taxvaluedollarcnt', valuation_percentiles, whole)
+        if year_built is not None:
+            if len(year_built) == 2:
+                mask &= column('yearbuilt') >= year_built[0]
+                mask &= column('yearbuilt') <= year_built[1]
+        return mask
+
+    def sampleMask(self, sample, **filters):
+        # The same filters over the rows of a StratifiedSample, which carries its own filter columns
+        return self.evaluate(sample.columns.__getitem__, len(sample), whole=False, **filters)
+
+    def prunes(self, filters):
+        # Only a fips or transaction date filter narrows a partitioned store down to some partitions
+        return self.source.partitions is not None and bool(
+            filters.get('fips') or filters.get('start_date') is not None or filters.get('end_date') is not None)
+
+    def partitionSelections(self, **filters):
+        # The selected rows of every partition that can match, one array per partition in row order
+        start_date, end_date = filters.get('start_date'), filters.get('end_date')
+        start_day = None if start_date is None else self.source.encodeDate(start_date)
+        end_day = None if end_date is None else self.source.encodeDate(end_date)
+        for index, covered in self.source.prunePartitions(filters.get('fips') or None, start_day, end_day):
+            partition = self.source.partitions[index]
+            # The partition key already matched the fips selection, and a partition whose days all lie
+            # in the date range needs no per-row date comparison
+            local_filters = dict(filters, fips=None)
+            if covered:
+                local_filters.update(start_date=None, end_date=None)
+            mask = self.evaluate(functools.partial(self.source.partitionColumn, index),
+                                 partition['stop'] - partition['start'], whole=False, **local_filters)
+            yield partition['start'] + np.flatnonzero(mask)
+
+    def select(self, **filters):
+        if not self.prunes(filters):
+            # Nothing to prune on: one pass over the whole (memory-mapped) columns
+            return np.flatnonzero(self.mask(**filters))
+        return np.concatenate([np.array([], dtype=np.int64)] + list(self.partitionSelections(**filters)))
+
+    def selectChunks(self, chunk_rows, **filters):
+        # The rows select() returns, in the same order, as arrays of chunk_rows indices (the last one
+        # shorter). Only one stretch of the mask, or one partition, is turned into indices at a time, so
+        # memory does not grow with the number of rows selected.
+        if self.prunes(filters):
+            parts = self.partitionSelections(**filters)
+        else:
+            mask = self.mask(**filters)
+            parts = (start + np.flatnonzero(mask[start:start + chunk_rows])
+                     for start in range(0, self.n_rows, chunk_rows))
+        pending = np.array([], dtype=np.int64)
+        for part in parts:
+            pending = np.concatenate([pending, part])
+            while len(pending) >= chunk_rows:
+                yield pending[:chunk_rows]
+                pending = pending[chunk_rows:]
+        if len(pending):
+            yield pending
+
+    def frame(self, rows, columns=None):
+        return self.source.frame(rows, columns)
+
+
+class SelectionStore:
+    # Row indices of recently used filter states, in an LRU bounded by their total size. A callback that
+    # owns the filters turns them into a small JSON handle (hash key plus the normalized filters) for a
+    # dcc.Store, and the callbacks drawing from that selection resolve the handle back to rows here.
+    # The handle carries its filters so a worker that never saw it, or has evicted it, recomputes it.
+    def __init__(self, filter_engine, max_bytes):
+        self.filter_engine = filter_engine
+        self.cache = LRUCache(max_bytes, size=arrayBytes)
+
+    def handle(self, **filters):
+        normalized = {name: normalizeInput(value, name in unordered_filters) for name, value in filters.items()}
+        key = cacheKey('selection', [normalized])
+        rows = self.rows({'key': key, 'filters': normalized})
+        return {'key': key, 'filters': normalized, 'rows': len(rows)}
+
+    def rows(self, handle):
+        rows = self.cache.get(handle['key'])
+        if rows is None:
+            rows = self.filter_engine.select(**handle['filters'])
+            rows.setflags(write=False)
+            self.cache.set(handle['key'], rows)
+        return rows
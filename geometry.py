@@ -0,0 +1,70 @@
+import numpy as np
+
+
+def simplifyRing(ring, tolerance):
+    # Douglas-Peucker on one closed ring: keep the point farthest from the chord of every span while
+    # it deviates by more than tolerance (in degrees), iteratively rather than recursively
+    points = np.asarray(ring, dtype=float)
+    if tolerance <= 0 or len(points) <= 4:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    spans = [(0, len(points) - 1)]
+    while spans:
+        start, end = spans.pop()
+        if end - start < 2:
+            continue
+        chord = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(chord[0], chord[1])
+        if length == 0:
+            # The closing span of a ring starts and ends on the same point
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(chord[0] * offsets[:, 1] - chord[1] * offsets[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            spans.extend([(start, split), (split, end)])
+    simplified = points[keep]
+    # A ring needs three distinct corners; anything smaller than the tolerance keeps its shape
+    return simplified if len(simplified) >= 4 else points
+
+
+def quantizeRing(points, decimals):
+    # Snap to a 10^-decimals degree grid and drop the points that collapse onto their predecessor
+    points = np.round(points, decimals)
+    distinct = np.ones(len(points), dtype=bool)
+    distinct[1:] = np.any(points[1:] != points[:-1], axis=1)
+    points = points[distinct]
+    return points if len(points) >= 4 else None
+
+
+def processPolygon(rings, tolerance, decimals):
+    processed = [quantizeRing(simplifyRing(ring, tolerance), decimals) for ring in rings]
+    if processed[0] is None:
+        return None
+    # Holes that vanish at this resolution are dropped with the outer ring kept
+    return [ring.tolist() for ring in processed if ring is not None]
+
+
+def processCounties(feature_collection, fips_codes, tolerance, decimals):
+    # Keeps only the features of fips_codes and reduces their geometry to what a county-level
+    # choropleth can show: simplified outlines on a quantized coordinate grid
+    fips_codes = set(fips_codes)
+    features = []
+    for feature in feature_collection['features']:
+        if feature.get('id') not in fips_codes:
+            continue
+        geometry = feature['geometry']
+        if geometry['type'] == 'Polygon':
+            coordinates = processPolygon(geometry['coordinates'], tolerance, decimals)
+        else:
+            coordinates = [polygon for polygon in (processPolygon(rings, tolerance, decimals)
+                                                   for rings in geometry['coordinates']) if polygon is not None]
+        if not coordinates:
+            continue
+        features.append({'type': 'Feature', 'id': feature['id'], 'properties': feature.get('properties', {}),
+                         'geometry': {'type': geometry['type'], 'coordinates': coordinates}})
+    return {'type': 'FeatureCollection', 'features': features}
@@ -0,0 +1,210 @@
+import argparse
+import csv
+import io
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+
+import settings
+from artifacts import artifactPath, startupReport, store_artifact, timedStage, writeDatasetStore
+from columnar_store import manifest_name
+from quantile_sketch import QuantileSketch
+from schema import (binary_cols, categorical_cols, count_cols, date_cols, location_cols, luxury_metrics_cols,
+                    metric_cols, rating_cols, stored_cols, years_of_relevance)
+
+### Builds processed/sold_houses_no_outlier.pkl from the raw Kaggle files without ever holding a
+### properties file in memory: each file is split into byte ranges at line boundaries, the ranges are
+### parsed in chunks by a pool of processes, every chunk is joined to the year's transactions through a
+### hash index on parcelid, and the metric bounds come from quantile sketches merged across processes.
+###
+###   python ingest.py [--raw-dir ../raw] [--workers 8] [--store]
+
+# properties file -> the transactions recorded against it
+raw_sources = {'properties_2016.csv': 'train_2016_v2.csv', 'properties_2017.csv': 'train_2017.csv'}
+
+# Explicit dtypes: no per-chunk type inference, and no column silently turning into objects because
+# one chunk happens to hold a stray string. IDs, counts and years are floats since most have gaps.
+raw_dtypes = dict({'parcelid': np.int64},
+                  **{col: np.float64 for col in location_cols + categorical_cols + years_of_relevance + count_cols
+                     + rating_cols + metric_cols + luxury_metrics_cols},
+                  **{col: str for col in binary_cols})
+raw_cols = [col for col in stored_cols if col not in date_cols]
+
+# Rows without these cannot be placed on the dashboard's sliders, filters or map
+required_cols = location_cols + years_of_relevance + metric_cols
+
+
+class ByteRange(io.RawIOBase):
+    # Read-only view of the bytes [start, end) of a file, so that pandas parses one slice of it
+    def __init__(self, path, start, end):
+        self.handle = open(path, 'rb')
+        self.handle.seek(start)
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.remaining <= 0:
+            return 0
+        n_read = self.handle.readinto(memoryview(buffer)[:min(len(buffer), self.remaining)])
+        self.remaining -= n_read
+        return n_read
+
+    def close(self):
+        self.handle.close()
+        super().close()
+
+
+def csvHeader(path):
+    with open(path, encoding='utf-8-sig', newline='') as handle:
+        return next(csv.reader(handle))
+
+
+def byteRanges(path, parts):
+    # Splits the rows of a CSV into about equal byte ranges, each starting at the beginning of a line.
+    # Assumes no quoted field spans lines, which holds for the Zillow files.
+    size = os.path.getsize(path)
+    with open(path, 'rb') as handle:
+        bounds = [len(handle.readline())]
+        for part in range(1, parts):
+            handle.seek(max(bounds[0] + (size - bounds[0]) * part // parts, bounds[-1]))
+            handle.readline()
+            bounds.append(handle.tell())
+        bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def readTransactions(path):
+    return pd.read_csv(path, usecols=['parcelid'] + date_cols, dtype={'parcelid': np.int64}, parse_dates=date_cols)
+
+
+class TransactionIndex:
+    # One year's transactions grouped by parcel behind a hash index of the distinct parcelids, built
+    # once per worker. Joining a chunk of parcels is one hash probe per parcel plus a take; parcels
+    # sold more than once in the year come out once per sale.
+    def __init__(self, transactions):
+        transactions = transactions.sort_values('parcelid', kind='stable').reset_index(drop=True)
+        parcel_ids = transactions.parcelid.to_numpy()
+        self.starts = np.flatnonzero(np.r_[True, parcel_ids[1:] != parcel_ids[:-1]])
+        self.counts = np.diff(np.r_[self.starts, len(parcel_ids)])
+        self.parcels = pd.Index(parcel_ids[self.starts])
+        self.columns = {col: transactions[col].to_numpy() for col in transactions if col != 'parcelid'}
+
+    def join(self, parcels):
+        matches = self.parcels.get_indexer(parcels.parcelid.to_numpy())
+        rows = np.flatnonzero(matches >= 0)
+        matches = matches[rows]
+        counts = self.counts[matches]
+        # Position of every output row within its parcel's run of transactions
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        transaction_rows = np.repeat(self.starts[matches], counts) + offsets
+        joined = parcels.iloc[np.repeat(rows, counts)].reset_index(drop=True)
+        for col, values in self.columns.items():
+            joined[col] = values[transaction_rows]
+        return joined
+
+
+def cleanSales(df):
+    # Raw encodings to the ones the dashboard filters on: zero-padded fips strings, pools as 0/1,
+    # the 'true'/blank flags as booleans and integer build years
+    df = df.dropna(subset=required_cols)
+    df = df.assign(fips=df.fips.map('{:05.0f}'.format), yearbuilt=df.yearbuilt.astype(np.int64),
+                   poolcnt=df.poolcnt.fillna(0), fireplaceflag=df.fireplaceflag.notna(),
+                   hashottuborspa=df.hashottuborspa.notna())
+    return df[stored_cols]
+
+
+### Pool side: each worker holds the transaction indexes and parses the byte ranges it is handed
+transaction_indexes = {}
+
+
+def initWorker(transactions):
+    transaction_indexes.update({name: TransactionIndex(df) for name, df in transactions.items()})
+
+
+def ingestRange(task):
+    path, header, start, end, chunk_rows = task
+    index = transaction_indexes[os.path.basename(path)]
+    sketches = {col: QuantileSketch() for col in metric_cols}
+    sales = []
+    rows_read = 0
+    with io.BufferedReader(ByteRange(path, start, end), buffer_size=1 << 20) as handle:
+        for chunk in pd.read_csv(handle, header=None, names=header, usecols=raw_cols, dtype=raw_dtypes,
+                                 chunksize=chunk_rows):
+            rows_read += len(chunk)
+            chunk_sales = cleanSales(index.join(chunk))
+            for col in metric_cols:
+                sketches[col].update(chunk_sales[col])
+            sales.append(chunk_sales)
+    return sales, sketches, rows_read
+
+
+def ingest(raw_dir=settings.RAW_DATA_DIR, workers=None, chunk_rows=settings.INGEST_CHUNK_ROWS,
+           quantiles=settings.INGEST_OUTLIER_QUANTILES):
+    sources = {name: train for name, train in raw_sources.items()
+               if os.path.exists(os.path.join(raw_dir, name)) and os.path.exists(os.path.join(raw_dir, train))}
+    if not sources:
+        raise FileNotFoundError(f"No properties_*.csv with its train_*.csv in {raw_dir}")
+    workers = workers or os.cpu_count() or 1
+
+    with timedStage('read transactions'):
+        transactions = {name: readTransactions(os.path.join(raw_dir, train)) for name, train in sources.items()}
+
+    with timedStage('join properties'):
+        tasks = []
+        for name in sources:
+            path = os.path.join(raw_dir, name)
+            header = csvHeader(path)
+            # A few ranges per worker keeps the pool busy while the last, slowest ranges finish
+            tasks.extend((path, header, start, end, chunk_rows) for start, end in byteRanges(path, workers * 4))
+        sales = []
+        sketches = {col: QuantileSketch() for col in metric_cols}
+        rows_read = 0
+        with multiprocessing.get_context('fork').Pool(workers, initializer=initWorker,
+                                                      initargs=(transactions,)) as pool:
+            for range_sales, range_sketches, range_rows in pool.imap_unordered(ingestRange, tasks):
+                sales.extend(range_sales)
+                for col, sketch in range_sketches.items():
+                    sketches[col].merge(sketch)
+                rows_read += range_rows
+
+    with timedStage('remove outliers'):
+        # Bounds are exact to the sketch's relative accuracy, so only rows within that of a bound can
+        # land on the other side of it
+        bounds = {col: (sketch.quantile(quantiles[0]), sketch.quantile(quantiles[1])) for col, sketch in sketches.items()}
+        df = pd.concat(sales, ignore_index=True)
+        n_sales = len(df)
+        keep = np.ones(n_sales, dtype=bool)
+        for col, (low, high) in bounds.items():
+            keep &= df[col].between(low, high).to_numpy()
+        # Parallel ranges finish in any order, so the rows are put in a stable one
+        df = df[keep].sort_values(date_cols + ['parcelid'], kind='stable').reset_index(drop=True)
+
+    print(f"{rows_read} parcels read, {n_sales} sales joined, {len(df)} kept within {bounds}")
+    return df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the processed dataset from the raw Kaggle CSVs")
+    parser.add_argument('--raw-dir', default=settings.RAW_DATA_DIR)
+    parser.add_argument('--out', default=settings.DATASET_PATH)
+    parser.add_argument('--workers', type=int, help="processes parsing the properties files (default: all cores)")
+    parser.add_argument('--chunk-rows', type=int, default=settings.INGEST_CHUNK_ROWS)
+    parser.add_argument('--store', action='store_true', help="also write the columnar store the app serves from")
+    args = parser.parse_args()
+
+    df = ingest(args.raw_dir, args.workers, args.chunk_rows)
+    with timedStage('write dataset'):
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        df.to_pickle(args.out)
+    store = artifactPath(store_artifact)
+    if args.store:
+        with timedStage('write columnar store'):
+            writeDatasetStore(df, store)
+    elif os.path.exists(os.path.join(store, manifest_name)):
+        print(f"The columnar store in {store} still holds the previous dataset; "
+              f"rerun with --store or `python artifacts.py build`")
+    print(startupReport())
@@ -0,0 +1,330 @@
+import cProfile
+import functools
+import heapq
+import itertools
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, abort, g, has_request_context, request
+
+import settings
+
+try:
+    import pyinstrument
+    import pyinstrument.renderers
+    import pyinstrument.session
+except ImportError:
+    pyinstrument = None
+
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+update_path = '/_dash-update-component'
+
+
+def formatLabels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{str(value)}"' for key, value in labels.items()) + '}'
+
+
+def formatMetric(name, kind, description, samples):
+    # samples: (suffix, labels, value) triples rendered in the Prometheus text exposition format
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+    lines.extend(f"{name}{suffix}{formatLabels(labels)} {value}" for suffix, labels, value in samples)
+    return lines
+
+
+class ShippedProfile:
+    # cProfile stats taken in a worker process, in the shape pstats.Stats loads a profiler from
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def profiledCall(kind, func, args):
+    # Runs func(*args) under the profiler a request asked for, in whichever process the body runs, and
+    # returns its outputs with the profile in a picklable form for absorbProfile
+    if kind == 'pyinstrument':
+        profiler = pyinstrument.Profiler()
+        profiler.start()
+        try:
+            outputs = func(*args)
+        finally:
+            profiler.stop()
+        return outputs, profiler.last_session.to_json()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        outputs = func(*args)
+    finally:
+        profiler.disable()
+    profiler.create_stats()
+    return outputs, profiler.stats
+
+
+class CallbackMetrics:
+    # Per-callback wall time, split into the filter / aggregate / figure phases marked inside the
+    # callbacks plus the serialize phase Dash spends turning the outputs into the response, along with
+    # filtered row counts and response payload bytes. Exposed as Prometheus text on /metrics.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.phase_seconds = {}
+        self.latency = {}
+        self.rows = {}
+        self.payload_bytes = {}
+        self.slowest = []
+        self.sequence = itertools.count()
+        self.collectors = []
+
+    ### Recording
+    def wrapRegistration(self, register):
+        # Drop-in replacement for app.callback that times every callback registered through it
+        @functools.wraps(register)
+        def callback(*args, **kwargs):
+            decorator = register(*args, **kwargs)
+
+            def instrumented(func):
+                return decorator(self.timed(func.__name__)(func))
+
+            return instrumented
+
+        return callback
+
+    def timed(self, name):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                record = {'callback': name, 'phases': {}, 'rows': None, 'inputs': args}
+                self.local.record = record
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    record['seconds'] = time.perf_counter() - start
+                    self.local.record = None
+                    self.finishCallback(record)
+
+            return wrapper
+
+        return decorator
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = getattr(self.local, 'record', None)
+            if record is not None:
+                record['phases'][name] = record['phases'].get(name, 0.0) + time.perf_counter() - start
+
+    def recordRows(self, n_rows):
+        record = getattr(self.local, 'record', None)
+        if record is not None:
+            record['rows'] = int(n_rows)
+
+    @contextmanager
+    def captured(self):
+        # Collects phases and rows on a fresh record without publishing it, for callback bodies that
+        # run in a worker process and report back to the request that waited on them
+        record = {'phases': {}, 'rows': None}
+        previous = getattr(self.local, 'record', None)
+        self.local.record = record
+        try:
+            yield record
+        finally:
+            self.local.record = previous
+
+    def absorb(self, captured):
+        record = getattr(self.local, 'record', None)
+        if record is None:
+            return
+        for phase, seconds in captured['phases'].items():
+            record['phases'][phase] = record['phases'].get(phase, 0.0) + seconds
+        if captured['rows'] is not None:
+            record['rows'] = captured['rows']
+
+    def requestedProfiler(self):
+        # 'cprofile' or 'pyinstrument' while the current request is being profiled, for callback bodies
+        # that run elsewhere and have to be profiled there
+        profiler = g.get('profiler') if has_request_context() else None
+        if profiler is None:
+            return None
+        return 'cprofile' if isinstance(profiler, cProfile.Profile) else 'pyinstrument'
+
+    def absorbProfile(self, profile):
+        # A profile returned by profiledCall, merged into the request's dump
+        if has_request_context():
+            g.setdefault('worker_profiles', []).append(profile)
+
+    def observe(self, table, key, value):
+        stats = table.setdefault(key, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += value
+        stats[2] = max(stats[2], value)
+
+    def finishCallback(self, record):
+        name = record['callback']
+        with self.lock:
+            for phase, seconds in record['phases'].items():
+                self.observe(self.phase_seconds, (name, phase), seconds)
+            buckets = self.latency.setdefault(name, [0] * (len(latency_buckets) + 1) + [0.0])
+            for position, bound in enumerate(latency_buckets):
+                if record['seconds'] <= bound:
+                    buckets[position] += 1
+            buckets[len(latency_buckets)] += 1
+            buckets[-1] += record['seconds']
+            if record['rows'] is not None:
+                self.observe(self.rows, name, record['rows'])
+        if has_request_context():
+            g.callback_record = record
+
+    def finishRequest(self, record, total_seconds, payload_bytes):
+        name = record['callback']
+        with self.lock:
+            self.observe(self.phase_seconds, (name, 'serialize'), max(total_seconds - record['seconds'], 0.0))
+            self.observe(self.payload_bytes, name, payload_bytes)
+            entry = (total_seconds, next(self.sequence), {
+                'callback': name,
+                'seconds': round(total_seconds, 6),
+                'rows': record['rows'],
+                'payload_bytes': payload_bytes,
+                'inputs': json.loads(json.dumps(record['inputs'], default=str)),
+            })
+            if len(self.slowest) < settings.METRICS_SLOW_REQUESTS_KEPT:
+                heapq.heappush(self.slowest, entry)
+            elif entry[0] > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, entry)
+
+    ### Exposition
+    def addCollector(self, collector):
+        # collector() returns extra exposition lines, e.g. cache counters owned by another module
+        self.collectors.append(collector)
+
+    def render(self):
+        with self.lock:
+            lines = formatMetric('zillow_callback_phase_seconds', 'summary',
+                                 "Wall time per callback phase (filter, aggregate, figure, serialize)",
+                                 [(suffix, {'callback': name, 'phase': phase}, stats[position])
+                                  for (name, phase), stats in sorted(self.phase_seconds.items())
+                                  for suffix, position in (('_count', 0), ('_sum', 1))])
+            samples = []
+            for name, buckets in sorted(self.latency.items()):
+                for position, bound in enumerate(latency_buckets):
+                    samples.append(('_bucket', {'callback': name, 'le': bound}, buckets[position]))
+                samples.append(('_bucket', {'callback': name, 'le': '+Inf'}, buckets[len(latency_buckets)]))
+                samples.append(('_count', {'callback': name}, buckets[len(latency_buckets)]))
+                samples.append(('_sum', {'callback': name}, buckets[-1]))
+            lines += formatMetric('zillow_callback_seconds', 'histogram', "Wall time of the callback body", samples)
+            for metric, table, description in (
+                    ('zillow_callback_rows', self.rows, "Rows left after filtering"),
+                    ('zillow_callback_response_bytes', self.payload_bytes, "Response payload bytes")):
+                lines += formatMetric(metric, 'summary', description,
+                                      [(suffix, {'callback': name}, stats[position])
+                                       for name, stats in sorted(table.items())
+                                       for suffix, position in (('_count', 0), ('_sum', 1))])
+                lines += formatMetric(metric + '_max', 'gauge', description + " (max)",
+                                      [('', {'callback': name}, stats[2]) for name, stats in sorted(table.items())])
+        for collector in self.collectors:
+            lines += collector()
+        return '\n'.join(lines) + '\n'
+
+    def slowRequests(self):
+        with self.lock:
+            return [entry for _, _, entry in sorted(self.slowest, reverse=True)]
+
+    ### Wiring into the Flask server behind Dash
+    def attach(self, server):
+        @server.before_request
+        def startCallbackRequest():
+            if not request.path.endswith(update_path):
+                return
+            g.request_start = time.perf_counter()
+            profiler = request.headers.get(settings.PROFILE_HEADER) if settings.PROFILING_ENABLED else None
+            if profiler == 'pyinstrument' and pyinstrument is not None:
+                g.profiler = pyinstrument.Profiler()
+                g.profiler.start()
+            elif profiler:
+                g.profiler = cProfile.Profile()
+                g.profiler.enable()
+
+        @server.after_request
+        def finishCallbackRequest(response):
+            record = g.pop('callback_record', None)
+            if record is None or 'request_start' not in g:
+                return response
+            profiler = g.pop('profiler', None)
+            if profiler is not None:
+                response.headers[settings.PROFILE_HEADER + '-Dump'] = self.dumpProfile(
+                    profiler, record['callback'], g.pop('worker_profiles', []))
+            payload_bytes = response.calculate_content_length()
+            if payload_bytes is None:
+                payload_bytes = 0 if response.is_streamed else len(response.get_data())
+            self.finishRequest(record, time.perf_counter() - g.request_start, payload_bytes)
+            return response
+
+        @server.route('/metrics')
+        def prometheusMetrics():
+            self.checkLocal()
+            return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+        @server.route('/metrics/slow')
+        def slowCallbackRequests():
+            self.checkLocal()
+            return {'slowest': self.slowRequests()}
+
+    def checkLocal(self):
+        if not settings.METRICS_PUBLIC and request.remote_addr not in ('127.0.0.1', '::1'):
+            abort(404)
+
+    def dumpProfile(self, profiler, name, worker_profiles=()):
+        # The request's own profile plus those of the bodies it handed to the worker pool
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+        stem = os.path.join(settings.PROFILE_DIR, f"{int(time.time() * 1000)}-{name}")
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            stats = pstats.Stats(profiler)
+            for profile in worker_profiles:
+                stats.add(ShippedProfile(profile))
+            stats.dump_stats(stem + '.prof')
+            return stem + '.prof'
+        profiler.stop()
+        session = profiler.last_session
+        for profile in worker_profiles:
+            session = pyinstrument.session.Session.combine(session, pyinstrument.session.Session.from_json(profile))
+        with open(stem + '.html', 'w') as handle:
+            handle.write(pyinstrument.renderers.HTMLRenderer().render(session))
+        return stem + '.html'
+
+
+def figureCacheMetricLines(figure_cache):
+    stats = figure_cache.stats()
+    lines = formatMetric('zillow_figure_cache_requests_total', 'counter', "Figure cache lookups by outcome",
+                         [('', {'callback': name, 'result': result}, counts[key])
+                          for name, counts in sorted(stats['callbacks'].items())
+                          for result, key in (('hit', 'hits'), ('miss', 'misses'))])
+    lines += formatMetric('zillow_figure_cache_memory_bytes', 'gauge', "Bytes held by the in-process figure LRU",
+                          [('', {}, stats['memory_bytes'])])
+    return lines
+
+
+def workerPoolMetricLines(worker_pool):
+    stats = worker_pool.stats()
+    lines = formatMetric('zillow_worker_pool_requests_total', 'counter',
+                         "Offloaded callback requests by outcome (submitted, coalesced onto an identical "
+                         "in-flight request, superseded by a newer request of the same session)",
+                         [('', {'result': result}, stats[result]) for result in ('submitted', 'coalesced', 'superseded')])
+    lines += formatMetric('zillow_worker_pool_in_flight', 'gauge', "Distinct requests running or queued in the pool",
+                          [('', {}, stats['in_flight'])])
+    return lines
+
+
+def startupMetricLines(startup_timings):
+    return formatMetric('zillow_startup_stage_seconds', 'gauge', "Time spent in each startup stage",
+                        [('', {'stage': stage}, seconds) for stage, seconds in startup_timings.items()])
@@ -0,0 +1,53 @@
+import functools
+
+import numpy as np
+
+PERCENTILES = np.arange(0, 101)
+
+
+def sortedColumn(source, col):
+    values = np.asarray(source.column(col), dtype=float)
+    order = np.argsort(values, kind='stable')
+    order = order[~np.isnan(values[order])]
+    sorted_values = values[order]
+    # np.quantile on the non-null values is what Series.quantile does under the hood
+    return {'positions': order.astype(np.int32 if len(values) < 2 ** 31 else np.int64), 'values': sorted_values,
+            'cutoffs': np.quantile(sorted_values, PERCENTILES / 100.0)}
+
+
+class QuantileIndex:
+    # Built once: the 0-100 integer percentile cutoffs of every metric column, plus the row positions
+    # of each column in ascending value order, so that a percentile slider becomes a table lookup
+    # followed by two binary searches instead of a full partial sort per callback. The positions and
+    # sorted values are kept by the source (memory-mapped from a columnar store), not per process.
+    def __init__(self, source, columns):
+        self.n_rows = len(source)
+        self.cutoffs = {}
+        self.sorted_positions = {}
+        self.sorted_values = {}
+        for col in columns:
+            index = source.derivedArrays(f"quantiles-{col}", functools.partial(sortedColumn, source, col))
+            self.sorted_positions[col] = index['positions']
+            self.sorted_values[col] = index['values']
+            self.cutoffs[col] = np.array(index['cutoffs'])
+
+    def cutoff(self, col, percentile):
+        return self.cutoffs[col][int(percentile)]
+
+    def bounds(self, col, percentiles):
+        return self.cutoff(col, percentiles[0]), self.cutoff(col, percentiles[1])
+
+    def valueRangePositions(self, col, low, high):
+        sorted_values = self.sorted_values[col]
+        start = np.searchsorted(sorted_values, low, side='left')
+        stop = np.searchsorted(sorted_values, high, side='right')
+        return self.sorted_positions[col][start:stop]
+
+    def percentileRangePositions(self, col, percentiles):
+        low, high = self.bounds(col, percentiles)
+        return self.valueRangePositions(col, low, high)
+
+    def percentileRangeMask(self, col, percentiles):
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[self.percentileRangePositions(col, percentiles)] = True
+        return mask
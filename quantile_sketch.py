@@ -0,0 +1,67 @@
+import numpy as np
+
+
+class QuantileSketch:
+    # Streaming quantiles with a relative error bound (the DDSketch scheme): every value is counted in
+    # the logarithmic bucket ceil(log_gamma(|value|)), so any quantile read back is within
+    # relative_accuracy of a value at that rank. Memory grows with the log of the value range rather
+    # than with the row count, and two sketches merge by adding bucket counts, so chunks can be
+    # sketched in separate processes and combined afterwards.
+    def __init__(self, relative_accuracy=0.005):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = np.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def addBuckets(self, buckets, magnitudes):
+        indices, counts = np.unique(np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64), return_counts=True)
+        for index, count in zip(indices.tolist(), counts.tolist()):
+            buckets[index] = buckets.get(index, 0) + count
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        self.addBuckets(self.positive, values[values > 0])
+        self.addBuckets(self.negative, -values[values < 0])
+        self.zeros += int(np.count_nonzero(values == 0))
+        self.count += len(values)
+        return self
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Only sketches with the same relative accuracy can be merged")
+        for buckets, other_buckets in ((self.positive, other.positive), (self.negative, other.negative)):
+            for index, count in other_buckets.items():
+                buckets[index] = buckets.get(index, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        return self
+
+    def bucketValue(self, index):
+        # The point of (gamma^(index-1), gamma^index] with the smallest worst-case relative error
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, q):
+        if not self.count:
+            return np.nan
+        # Same rank convention as np.quantile's default, rounded to the nearest counted value
+        rank = int(round(q * (self.count - 1)))
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self.bucketValue(index)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self.bucketValue(index)
+        return self.bucketValue(max(self.positive))
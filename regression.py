@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+import settings
+from sampling import stratifiedSample
+
+
+def groupedLeastSquares(x, y, groups, n_groups):
+    # Closed-form simple OLS for every group at once from per-group sums, identical to fitting
+    # y ~ 1 + x separately on each group's rows. The second-order sums are taken around the group
+    # means to avoid the cancellation of n * sum(x^2) - sum(x)^2 at dollar magnitudes.
+    n = np.bincount(groups, minlength=n_groups).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = np.bincount(groups, weights=x, minlength=n_groups) / n
+        mean_y = np.bincount(groups, weights=y, minlength=n_groups) / n
+        dx = x - mean_x[groups]
+        dy = y - mean_y[groups]
+        sxx = np.bincount(groups, weights=dx * dx, minlength=n_groups)
+        sxy = np.bincount(groups, weights=dx * dy, minlength=n_groups)
+        syy = np.bincount(groups, weights=dy * dy, minlength=n_groups)
+        slope = sxy / sxx
+        intercept = mean_y - slope * mean_x
+        r_squared = sxy * sxy / (sxx * syy)
+    return pd.DataFrame({'n': n, 'slope': slope, 'intercept': intercept, 'r_squared': r_squared})
+
+
+def markerQuotas(sizes, max_points, min_per_group):
+    # Points drawn per group: a floor of min_per_group (or the whole group), lowered when there are too
+    # many groups for it, plus the rest of max_points in proportion to the group's size
+    n_groups = max(np.count_nonzero(sizes), 1)
+    floor = min(min_per_group, max_points // n_groups)
+    spare = max(max_points - floor * n_groups, 0)
+    quotas = floor + np.floor(spare * sizes / max(sizes.sum(), 1))
+    return np.minimum(sizes, quotas).astype(np.int64)
+
+
+def regressionFigure(frame, x, y, color, title=None, max_points=settings.REGRESSION_MAX_POINTS,
+                     min_points_per_group=settings.REGRESSION_MIN_POINTS_PER_GROUP):
+    # Scatter of y vs x colored by the categories of color, with one OLS trendline per category.
+    # The lines are fitted on every row; only a stratified sample of at most max_points points is drawn,
+    # as WebGL markers.
+    x_values = frame[x].to_numpy(dtype=float)
+    y_values = frame[y].to_numpy(dtype=float)
+    groups, categories = pd.factorize(frame[color], sort=True)
+    valid = np.flatnonzero((groups >= 0) & ~np.isnan(x_values) & ~np.isnan(y_values))
+    x_values = x_values[valid]
+    y_values = y_values[valid]
+    groups = groups[valid]
+
+    fits = groupedLeastSquares(x_values, y_values, groups, len(categories))
+    low = pd.Series(x_values).groupby(groups).min()
+    high = pd.Series(x_values).groupby(groups).max()
+    quotas = markerQuotas(fits.n.to_numpy().astype(np.int64), max_points, min_points_per_group)
+    shown = stratifiedSample(np.arange(len(groups)), groups, quotas)
+    shown_groups = groups[shown]
+    group_starts = np.searchsorted(shown_groups, np.arange(len(categories) + 1))
+
+    palette = px.colors.qualitative.Plotly
+    traces = []
+    for code, category in enumerate(categories):
+        if fits.n[code] == 0:
+            continue
+        name = f"{color}={category}"
+        line_color = palette[code % len(palette)]
+        points = shown[group_starts[code]:group_starts[code + 1]]
+        traces.append(go.Scattergl(x=x_values[points], y=y_values[points], mode='markers', name=name,
+                                   legendgroup=name, marker_color=line_color,
+                                   hovertemplate=f"{name}<br>{x}=%{{x}}<br>{y}=%{{y}}<extra></extra>"))
+        fit = fits.iloc[code]
+        if np.isfinite(fit.slope):
+            line_x = np.array([low[code], high[code]])
+            traces.append(go.Scattergl(x=line_x, y=fit.intercept + fit.slope * line_x, mode='lines', name=name,
+                                       legendgroup=name, showlegend=False, line_color=line_color,
+                                       hovertemplate=f"<b>OLS trendline</b><br>{y} = {fit.slope:g} * {x}"
+                                                     f" + {fit.intercept:g}<br>R<sup>2</sup>={fit.r_squared:.6f}"
+                                                     f"<br>n={int(fit.n)}<extra>{name}</extra>"))
+    fig = go.Figure(traces)
+    fig.update_layout(title=title, xaxis_title=x, yaxis_title=y, legend_title_text=color)
+    return fig
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+# Two-sided 95% normal quantile used for every error bound shown
+confidence_z = 1.96
+
+
+def stratifiedSample(candidates, groups, cap, seed=0):
+    # Up to cap uniformly random entries of candidates per group, in group order. groups holds the
+    # group code of every candidate; one shuffle plus a stable sort ranks the entries within a group.
+    # cap is either one limit for every group or an array of limits indexed by group code.
+    candidates = np.asarray(candidates)
+    shuffle = np.random.default_rng(seed).permutation(len(candidates))
+    order = shuffle[np.argsort(groups[shuffle], kind='stable')]
+    sorted_groups = groups[order]
+    rank = np.arange(len(order)) - np.searchsorted(sorted_groups, sorted_groups, side='left')
+    cap = np.asarray(cap)
+    return candidates[order[rank < (cap[sorted_groups] if cap.ndim else cap)]]
+
+
+def quantileInterval(values, q):
+    # Distribution-free 95% bounds for the q quantile of the population a uniform sample was drawn from:
+    # the sample quantiles at the ranks q +- z * sqrt(q(1-q)/n)
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return np.nan, np.nan
+    spread = confidence_z * np.sqrt(q * (1 - q) / len(values))
+    return tuple(np.quantile(values, [max(q - spread, 0), min(q + spread, 1)]))
+
+
+class StratifiedSample:
+    # Rows drawn at one sampling fraction, with proportional allocation over the strata (at least one
+    # row from every stratum), and the filter columns of those rows. The estimators below weight each
+    # row by its stratum's population over sample size and give 95% bounds from the usual stratified
+    # variance, with the finite population correction.
+    def __init__(self, fraction, rows, strata, population, columns):
+        self.fraction = fraction
+        self.rows = rows
+        self.strata = strata
+        self.population = population
+        self.sizes = np.bincount(strata, minlength=len(population))
+        self.weights = (population / np.maximum(self.sizes, 1))[strata]
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.rows)
+
+    def totalVariance(self, z):
+        # Variance of the estimated population total of z (one value per sampled row)
+        sizes = self.sizes.astype(float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.bincount(self.strata, weights=z, minlength=len(sizes)) / sizes
+            squares = np.bincount(self.strata, weights=(z - means[self.strata]) ** 2, minlength=len(sizes))
+            variances = np.where(sizes > 1, squares / (sizes - 1), 0)
+            terms = self.population ** 2 * (1 - sizes / self.population) * variances / sizes
+        return float(np.nansum(terms))
+
+    def estimateCount(self, selected):
+        # Estimated number of population rows matching the filters that selected the sampled rows
+        indicator = selected.astype(float)
+        return float(np.sum(self.weights * indicator)), confidence_z * np.sqrt(self.totalVariance(indicator))
+
+    def estimateMean(self, values, selected):
+        # Ratio estimate of the mean of values over the matching rows, with a linearized variance
+        values = np.asarray(values, dtype=float)
+        counted = selected & ~np.isnan(values)
+        denominator = np.sum(self.weights * counted)
+        if denominator == 0:
+            return np.nan, np.nan
+        filled = np.where(counted, values, 0)
+        mean = np.sum(self.weights * filled) / denominator
+        residuals = (filled - mean * counted) / denominator
+        return float(mean), confidence_z * np.sqrt(self.totalVariance(residuals))
+
+
+class StratifiedSamples:
+    # Precomputed samples of the whole source at a few fractions, stratified by fips x bedroom count
+    # (with every count above max_bedrooms, and the missing ones, in a bucket of their own), so each
+    # county and house size stays represented however small the sample. Built once at startup; the
+    # samples are ordered smallest first.
+    def __init__(self, source, fractions, columns, max_bedrooms=6, seed=0):
+        fips_codes, _ = pd.factorize(np.asarray(source.column('fips')))
+        bedrooms = np.asarray(source.column('bedroomcnt'), dtype=float)
+        buckets = np.where(np.isnan(bedrooms), max_bedrooms + 2,
+                           np.clip(np.nan_to_num(bedrooms), 0, max_bedrooms + 1)).astype(np.int64)
+        strata = (fips_codes.astype(np.int64) + 1) * (max_bedrooms + 3) + buckets
+        strata = pd.factorize(strata)[0]
+        population = np.bincount(strata)
+        self.samples = []
+        for fraction in sorted(fractions):
+            quotas = np.maximum(np.ceil(population * fraction), 1).astype(np.int64)
+            rows = np.sort(stratifiedSample(np.arange(len(strata)), strata, quotas, seed))
+            sample_columns = {col: np.asarray(source.column(col)[rows]) for col in columns}
+            self.samples.append(StratifiedSample(fraction, rows, strata[rows], population, sample_columns))
+
+    def __iter__(self):
+        return iter(self.samples)
@@ -0,0 +1,19 @@
+categorical_cols = ['heatingorsystemtypeid', 'propertylandusetypeid', 'storytypeid', 'airconditioningtypeid',
+                    'architecturalstyletypeid', 'typeconstructiontypeid', 'buildingclasstypeid']
+years_of_relevance = ['yearbuilt']
+binary_cols = ['fireplaceflag', 'taxdelinquencyflag', 'hashottuborspa']
+count_cols = ['numberofstories', 'unitcnt', 'roomcnt', 'poolcnt', 'bathroomcnt', 'bedroomcnt', 'fireplacecnt']
+rating_cols = ['buildingqualitytypeid']
+location_cols = ['fips']
+metric_cols = ['calculatedfinishedsquarefeet', 'taxvaluedollarcnt']
+luxury_metrics_cols = ['poolsizesum']
+id_col = ['parcelid']
+date_cols = ['transactiondate']
+
+# Every column the dashboard references, i.e. everything the columnar store keeps
+stored_cols = (id_col + location_cols + date_cols + categorical_cols + years_of_relevance + binary_cols + count_cols
+               + rating_cols + metric_cols + luxury_metrics_cols)
+
+
+def isCategoricalCol(col):
+    return col in location_cols or col.endswith('typeid')
@@ -0,0 +1,90 @@
+import argparse
+import importlib
+
+import artifacts
+import settings
+
+try:
+    import gunicorn.app.base as gunicorn_base
+except ImportError:
+    gunicorn_base = None
+
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
+
+def loadApp():
+    # The dashboard is built by importing app, once per process: loading the data, building the indexes
+    # and registering the callbacks happen at module level there, so this returns that module (with
+    # my_app, its WSGI server and the worker pool to start) rather than a new app per call
+    return importlib.import_module('app')
+
+
+if gunicorn_base is not None:
+    class GunicornServer(gunicorn_base.BaseApplication):
+        # The app is loaded once in the gunicorn master (preload) and the web workers are forked
+        # from it, so the dataset and indexes are shared copy-on-write. Each web worker then forks its
+        # own share of the figure pool, after the fork, since a process pool does not survive one.
+        def __init__(self, app, options):
+            self.app = app
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+            workers = self.options['workers']
+            self.cfg.set('post_fork', lambda server, worker: self.app.worker_pool.start(workers))
+
+        def load(self):
+            return self.app.server
+
+
+def serveGunicorn(app, host, port, workers, threads):
+    GunicornServer(app, {
+        'bind': f"{host}:{port}",
+        'workers': workers,
+        'threads': threads,
+        'worker_class': 'gthread',
+        'preload_app': True,
+        'timeout': 120,
+    }).run()
+
+
+def serveWaitress(app, host, port, threads):
+    # Single process: the figure pool provides the parallelism
+    app.worker_pool.start()
+    waitress.serve(app.server, host=host, port=port, threads=threads)
+
+
+def serveDevelopment(app, host, port):
+    app.worker_pool.start()
+    app.server.run(host=host, port=port, threaded=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve the dashboard")
+    parser.add_argument('--server', choices=['auto', 'gunicorn', 'waitress', 'dev'], default='auto',
+                        help="auto picks gunicorn, then waitress, then the Flask development server")
+    parser.add_argument('--host', default=settings.HOST)
+    parser.add_argument('--port', type=int, default=settings.PORT)
+    parser.add_argument('--workers', type=int, default=settings.WEB_WORKERS)
+    parser.add_argument('--threads', type=int, default=settings.WEB_THREADS)
+    args = parser.parse_args()
+
+    server = args.server
+    if server == 'auto':
+        server = 'gunicorn' if gunicorn_base is not None else 'waitress' if waitress is not None else 'dev'
+    if server == 'gunicorn' and gunicorn_base is None or server == 'waitress' and waitress is None:
+        parser.error(f"{server} is not installed")
+
+    app = loadApp()
+    print(artifacts.startupReport())
+    if server == 'gunicorn':
+        serveGunicorn(app, args.host, args.port, args.workers, args.threads)
+    elif server == 'waitress':
+        serveWaitress(app, args.host, args.port, args.threads)
+    else:
+        serveDevelopment(app, args.host, args.port)
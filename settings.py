@@ -0,0 +1,93 @@
+import os
+
+### Runtime knobs, overridable through the environment so every worker process picks up the same values
+
+# memory: in-process LRU only, disk/shm: LRU backed by a directory shared between workers, off: no caching
+FIGURE_CACHE_BACKEND = os.environ.get('ZILLOW_FIGURE_CACHE', 'memory')
+FIGURE_CACHE_MAX_BYTES = int(os.environ.get('ZILLOW_FIGURE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+FIGURE_CACHE_SHARED_MAX_BYTES = int(os.environ.get('ZILLOW_FIGURE_CACHE_SHARED_MAX_BYTES', 1024 * 1024 * 1024))
+FIGURE_CACHE_DIR = os.environ.get('ZILLOW_FIGURE_CACHE_DIR', '../cache/figures')
+FIGURE_CACHE_SHM_DIR = os.environ.get('ZILLOW_FIGURE_CACHE_SHM_DIR', '/dev/shm/zillow-figures')
+
+# server: bin on the server with NumPy and ship one bar per bin, client: ship raw values to px.histogram
+HISTOGRAM_MODE = os.environ.get('ZILLOW_HISTOGRAM_MODE', 'server')
+HISTOGRAM_FINE_BINS = int(os.environ.get('ZILLOW_HISTOGRAM_FINE_BINS', 2000))
+HISTOGRAM_DEFAULT_BINS = 50
+
+# Box and violin plots above this many rows are drawn from server-side summary statistics
+SUMMARY_PLOT_MIN_ROWS = int(os.environ.get('ZILLOW_SUMMARY_PLOT_MIN_ROWS', 20000))
+SUMMARY_PLOT_OUTLIER_CAP = int(os.environ.get('ZILLOW_SUMMARY_PLOT_OUTLIER_CAP', 100))
+SUMMARY_PLOT_KDE_POINTS = int(os.environ.get('ZILLOW_SUMMARY_PLOT_KDE_POINTS', 50))
+
+### Data sources and the local artifact cache built from them by `python artifacts.py build`
+DATASET_PATH = os.environ.get('ZILLOW_DATASET_PATH', '../processed/sold_houses_no_outlier.pkl')
+DATA_DICTIONARY_PATH = os.environ.get('ZILLOW_DATA_DICTIONARY_PATH', '../zillow_data_dictionary.xlsx')
+COUNTIES_GEOJSON_URL = os.environ.get('ZILLOW_COUNTIES_GEOJSON_URL',
+                                      'https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json')
+ARTIFACT_CACHE_DIR = os.environ.get('ZILLOW_ARTIFACT_CACHE_DIR', '../cache/artifacts')
+# The columnar store keeps its rows grouped by fips and transaction month, so that filters on those skip
+# whole partitions
+STORE_PARTITIONED = os.environ.get('ZILLOW_STORE_PARTITIONED', '1') == '1'
+
+# Raw Kaggle files `python ingest.py` builds DATASET_PATH from, the rows parsed per chunk, and the metric
+# quantiles outside of which a sale counts as an outlier
+RAW_DATA_DIR = os.environ.get('ZILLOW_RAW_DATA_DIR', '../raw')
+INGEST_CHUNK_ROWS = int(os.environ.get('ZILLOW_INGEST_CHUNK_ROWS', 200000))
+INGEST_OUTLIER_QUANTILES = tuple(float(q) for q
+                                 in os.environ.get('ZILLOW_INGEST_OUTLIER_QUANTILES', '0.01,0.99').split(','))
+
+# County outlines are simplified to this tolerance and snapped to this many decimals, both in degrees;
+# 0.002 / 3 keeps them within ~200 m, far below what a county-level choropleth can show
+GEOMETRY_SIMPLIFY_TOLERANCE = float(os.environ.get('ZILLOW_GEOMETRY_SIMPLIFY_TOLERANCE', 0.002))
+GEOMETRY_DECIMALS = int(os.environ.get('ZILLOW_GEOMETRY_DECIMALS', 3))
+
+# Third-party page assets `python artifacts.py vendor` copies into the artifact cache; the page only
+# loads them from there, and without them once they have not been vendored
+CODEPEN_STYLESHEET_URL = 'https://codepen.io/chriddyp/pen/bWLwgP.css'
+MATHJAX_PACKAGE_URL = 'https://registry.npmjs.org/mathjax/-/mathjax-2.7.5.tgz'
+MATHJAX_CONFIG = 'TeX-MML-AM_CHTML'
+
+# Tab 3 aggregation cubes (one per aggregator column) kept in memory per process; from a columnar store
+# they are memory-mapped, so an evicted one is only reopened, not rebuilt
+AGGREGATION_CUBE_MAX_BYTES = int(os.environ.get('ZILLOW_AGGREGATION_CUBE_MAX_BYTES', 64 * 1024 * 1024))
+# Build years per cube bucket; a year range that cuts through a bucket reads that bucket's rows
+AGGREGATION_CUBE_YEAR_BUCKET = int(os.environ.get('ZILLOW_AGGREGATION_CUBE_YEAR_BUCKET', 10))
+
+# Row indices of recent tab 1 filter states shared by the per-figure callbacks
+SELECTION_CACHE_MAX_BYTES = int(os.environ.get('ZILLOW_SELECTION_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+# While a tab 2 / tab 3 percentile slider is dragged, figures come from the smallest of these stratified
+# samples that leaves at least APPROXIMATE_MIN_ROWS rows (exact results when none does); the exact
+# figures follow when the slider is released
+APPROXIMATE_SAMPLE_FRACTIONS = tuple(float(fraction) for fraction
+                                     in os.environ.get('ZILLOW_APPROXIMATE_SAMPLE_FRACTIONS', '0.01,0.1').split(','))
+APPROXIMATE_MIN_ROWS = int(os.environ.get('ZILLOW_APPROXIMATE_MIN_ROWS', 5000))
+
+# Markers drawn in the tab 3 regression scatter, split over the color groups in proportion to their size
+# with a floor per group; the fitted lines always use every row
+REGRESSION_MAX_POINTS = int(os.environ.get('ZILLOW_REGRESSION_MAX_POINTS', 20000))
+REGRESSION_MIN_POINTS_PER_GROUP = int(os.environ.get('ZILLOW_REGRESSION_MIN_POINTS_PER_GROUP', 100))
+
+# /export decodes and writes this many selected rows at a time, whatever the size of the selection
+EXPORT_CHUNK_ROWS = int(os.environ.get('ZILLOW_EXPORT_CHUNK_ROWS', 65536))
+
+# Processes forked to build figures off the request threads, for the whole host: every web worker forks an
+# even share of them (at least one); 0 runs every callback inline
+WORKER_PROCESSES = int(os.environ.get('ZILLOW_WORKER_PROCESSES', max((os.cpu_count() or 1) - 1, 1)))
+
+# /metrics is only answered for loopback clients unless made public
+METRICS_PUBLIC = os.environ.get('ZILLOW_METRICS_PUBLIC', '0') == '1'
+METRICS_SLOW_REQUESTS_KEPT = int(os.environ.get('ZILLOW_METRICS_SLOW_REQUESTS_KEPT', 20))
+# Requests carrying the profile header get a cProfile (or pyinstrument) dump, when profiling is allowed
+PROFILING_ENABLED = os.environ.get('ZILLOW_PROFILING', '0') == '1'
+PROFILE_HEADER = 'X-Zillow-Profile'
+PROFILE_DIR = os.environ.get('ZILLOW_PROFILE_DIR', '../profiles')
+
+### Serving (`python serve.py`)
+HOST = os.environ.get('ZILLOW_HOST', '0.0.0.0')
+PORT = int(os.environ.get('ZILLOW_PORT', 8020))
+# gunicorn worker processes and the threads each one serves requests with
+WEB_WORKERS = int(os.environ.get('ZILLOW_WEB_WORKERS', 2))
+WEB_THREADS = int(os.environ.get('ZILLOW_WEB_THREADS', 8))
+# gzip (and brotli, when the brotli package is installed) for responses, through flask-compress
+COMPRESS_RESPONSES = os.environ.get('ZILLOW_COMPRESS', '1') == '1'
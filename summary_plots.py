@@ -0,0 +1,181 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+import settings
+from sampling import stratifiedSample
+
+
+def groupedSummary(frame, value_col, group_col=None, outlier_cap=settings.SUMMARY_PLOT_OUTLIER_CAP, seed=0):
+    # One lexsort by (group, value) gives every per-group order statistic by index arithmetic, so
+    # quartiles, Tukey whiskers, means and a capped outlier sample come out of a single pass.
+    values = frame[value_col].to_numpy(dtype=float)
+    if group_col is None:
+        codes = np.zeros(len(values), dtype=np.intp)
+        categories = np.array([''], dtype=object)
+    else:
+        codes, categories = pd.factorize(frame[group_col], sort=True)
+        categories = np.asarray(categories, dtype=object)
+    keep = (codes >= 0) & ~np.isnan(values)
+    if not keep.any():
+        # Nothing to summarize; callers fall back to plotly express, which draws an empty figure
+        return None
+    codes = codes[keep]
+    values = values[keep]
+    order = np.lexsort((values, codes))
+    codes = codes[order]
+    values = values[order]
+
+    counts = np.bincount(codes, minlength=len(categories))
+    present = np.flatnonzero(counts)
+    counts = counts[present]
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.intp)
+    groups = np.repeat(np.arange(len(present)), counts)
+
+    def quantile(q):
+        # Same linear interpolation as Series.quantile
+        position = starts + q * (counts - 1)
+        low = np.floor(position).astype(np.intp)
+        high = np.minimum(low + 1, starts + counts - 1)
+        return values[low] + (values[high] - values[low]) * (position - low)
+
+    q1 = quantile(.25)
+    median = quantile(.5)
+    q3 = quantile(.75)
+    iqr = q3 - q1
+    inside = (values >= (q1 - 1.5 * iqr)[groups]) & (values <= (q3 + 1.5 * iqr)[groups])
+    summary = {
+        'categories': categories[present],
+        'counts': counts,
+        'q1': q1,
+        'median': median,
+        'q3': q3,
+        'mean': np.bincount(groups, weights=values) / counts,
+        'lowerfence': np.minimum.reduceat(np.where(inside, values, np.inf), starts),
+        'upperfence': np.maximum.reduceat(np.where(inside, values, -np.inf), starts),
+        'values': values,
+        'groups': groups,
+        'starts': starts,
+    }
+
+    outside = np.flatnonzero(~inside)
+    sampled = stratifiedSample(outside, groups[outside], outlier_cap, seed)
+    summary['outlier_groups'] = groups[sampled]
+    summary['outlier_values'] = values[sampled]
+    return summary
+
+
+def groupedDensity(summary, points=settings.SUMMARY_PLOT_KDE_POINTS):
+    # Gaussian KDE per group on a per-group grid between its min and max: values are binned onto the
+    # grid with one bincount, then every group is smoothed with its own Scott's-rule bandwidth in a
+    # single batched matrix product. Densities are scaled to a max of 1 like plotly's width scalemode.
+    values = summary['values']
+    groups = summary['groups']
+    counts = summary['counts']
+    starts = summary['starts']
+    group_min = values[starts]
+    group_max = values[starts + counts - 1]
+    span = np.where(group_max > group_min, group_max - group_min, 1.0)
+
+    grid_index = np.rint((values - group_min[groups]) / span[groups] * (points - 1)).astype(np.intp)
+    binned = np.bincount(groups * points + grid_index, minlength=len(counts) * points).reshape(len(counts), points)
+
+    mean = summary['mean']
+    variance = np.maximum(np.bincount(groups, weights=values * values) / counts - mean * mean, 0)
+    bandwidth = 1.06 * np.sqrt(variance) * counts ** -0.2 / span * (points - 1)
+    bandwidth = np.maximum(bandwidth, 1.0)
+    distance = np.arange(points)[:, None] - np.arange(points)[None, :]
+    kernel = np.exp(-0.5 * (distance[None, :, :] / bandwidth[:, None, None]) ** 2)
+    density = np.einsum('gij,gj->gi', kernel, binned)
+    density /= np.maximum(density.max(axis=1, keepdims=True), 1e-12)
+    grid = group_min[:, None] + span[:, None] * np.linspace(0, 1, points)[None, :]
+    return grid, density
+
+
+def categoryPositions(categories):
+    # Numeric categories (e.g. yearbuilt) keep their own axis positions, anything else is laid out
+    # at 0..k-1 and labelled through tick text
+    try:
+        positions = np.asarray(categories, dtype=float)
+        return positions, None
+    except (TypeError, ValueError):
+        return np.arange(len(categories), dtype=float), [str(category) for category in categories]
+
+
+def summaryBoxFigure(summary, value_label, group_label=None, orientation='v'):
+    categories = list(summary['categories'])
+    outlier_positions = summary['categories'][summary['outlier_groups']]
+    box = dict(q1=summary['q1'], median=summary['median'], q3=summary['q3'], mean=summary['mean'],
+               lowerfence=summary['lowerfence'], upperfence=summary['upperfence'], orientation=orientation,
+               name=value_label, boxpoints=False, marker_color='#636efa', showlegend=False)
+    if orientation == 'h':
+        fig = go.Figure(go.Box(y=categories, **box))
+        fig.add_trace(go.Scatter(x=summary['outlier_values'], y=outlier_positions, mode='markers',
+                                 marker_color='#636efa', name='outliers (sample)', showlegend=False))
+        fig.update_layout(xaxis_title=value_label, yaxis_title=group_label)
+    else:
+        fig = go.Figure(go.Box(x=categories, **box))
+        fig.add_trace(go.Scatter(x=outlier_positions, y=summary['outlier_values'], mode='markers',
+                                 marker_color='#636efa', name='outliers (sample)', showlegend=False))
+        fig.update_layout(xaxis_title=group_label, yaxis_title=value_label)
+    return fig
+
+
+def summaryViolinFigure(summary, value_label, group_label=None):
+    grid, density = groupedDensity(summary)
+    positions, tick_text = categoryPositions(summary['categories'])
+    gaps = np.diff(np.sort(positions))
+    half_width = 0.4 * (gaps.min() if len(gaps) else 1.0)
+
+    # Every violin is one closed outline; NaN separators let a single filled trace draw all of them
+    outline_x = np.concatenate([positions[:, None] + density * half_width,
+                                (positions[:, None] - density * half_width)[:, ::-1],
+                                np.full((len(positions), 1), np.nan)], axis=1)
+    outline_y = np.concatenate([grid, grid[:, ::-1], np.full((len(positions), 1), np.nan)], axis=1)
+    # The outline is display-only, so a few significant digits keep the payload compact
+    y_decimals = max(0, 4 - int(np.floor(np.log10(max(np.nanmax(np.abs(grid)), 1.0)))))
+    outline_x = np.round(outline_x, 2)
+    outline_y = np.round(outline_y, y_decimals)
+    fig = go.Figure(go.Scatter(x=outline_x.ravel(), y=outline_y.ravel(), fill='toself', mode='lines',
+                               line_color='#636efa', hoverinfo='skip', showlegend=False))
+    fig.add_trace(go.Scatter(x=positions, y=summary['median'], mode='markers', marker_color='white',
+                             marker_line_color='#636efa', marker_line_width=1, showlegend=False,
+                             customdata=np.stack([summary['counts'], summary['q1'], summary['q3']], axis=1),
+                             hovertemplate="median=%{y}<br>q1=%{customdata[1]}<br>q3=%{customdata[2]}"
+                                           "<br>n=%{customdata[0]}<extra></extra>"))
+    fig.update_layout(xaxis_title=group_label, yaxis_title=value_label)
+    if tick_text is not None:
+        fig.update_xaxes(tickvals=positions, ticktext=tick_text)
+    return fig
+
+
+def plotArguments(x, y):
+    # Mirrors px.box/px.violin: a lone x is a horizontal distribution, a lone y a vertical one, and
+    # x with y is y split by the categories of x
+    if y is None:
+        return x, None, 'h'
+    return y, x, 'v'
+
+
+def boxFigure(frame, x=None, y=None, labels=None, min_rows=settings.SUMMARY_PLOT_MIN_ROWS):
+    if len(frame) < min_rows or (x is None and y is None):
+        return px.box(frame, x=x, y=y, labels=labels)
+    labels = labels or {}
+    value_col, group_col, orientation = plotArguments(x, y)
+    summary = groupedSummary(frame, value_col, group_col)
+    if summary is None:
+        return px.box(frame, x=x, y=y, labels=labels)
+    return summaryBoxFigure(summary, labels.get(value_col, value_col), labels.get(group_col, group_col), orientation)
+
+
+def boxAndViolinFigures(frame, x, y, labels=None, min_rows=settings.SUMMARY_PLOT_MIN_ROWS):
+    # Both figures of y split by x, for views that switch between them; above min_rows both are drawn
+    # from one shared summary. Below it only the raw-point box is sent, and the violin is None: the
+    # browser redraws the same points as a violin (zillow.pickFigure), so they are not shipped twice.
+    labels = labels or {}
+    summary = groupedSummary(frame, y, x) if len(frame) >= min_rows else None
+    if summary is None:
+        return {"Box": px.box(frame, x=x, y=y, labels=labels), "Violin": None}
+    return {"Box": summaryBoxFigure(summary, labels.get(y, y), labels.get(x, x)),
+            "Violin": summaryViolinFigure(summary, labels.get(y, y), labels.get(x, x))}
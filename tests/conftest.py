@@ -0,0 +1,60 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from columnar_store import ColumnarStore, FrameSource, writeColumnarStore
+from filter_engine import FilterEngine
+from quantile_index import QuantileIndex
+from schema import metric_cols
+
+### A small synthetic parcel frame and the engines over it. Metric values sit on a coarse grid so that
+### many rows tie with the percentile cutoffs, and some are missing; every test runs once over a
+### FrameSource and once over a partitioned columnar store written to a temporary directory.
+
+
+def parcelFrame(n_rows=600, seed=7):
+    rng = np.random.default_rng(seed)
+    area = np.round(rng.normal(1600, 500, n_rows), -2)
+    value = np.round(rng.lognormal(12.5, 0.6, n_rows), -4)
+    area[rng.random(n_rows) < 0.03] = np.nan
+    value[rng.random(n_rows) < 0.03] = np.nan
+    year_built = rng.integers(1900, 2016, n_rows).astype(float)
+    year_built[rng.random(n_rows) < 0.02] = np.nan
+    heating = rng.choice([2.0, 7.0, 24.0, np.nan], n_rows, p=[0.4, 0.3, 0.05, 0.25])
+    # A single row of its own, whose standard deviation is undefined
+    heating[0] = 13.0
+    return pd.DataFrame({
+        'parcelid': np.arange(n_rows) + 10_000,
+        'fips': rng.choice(['06037', '06059', '06111'], n_rows, p=[0.6, 0.3, 0.1]),
+        'transactiondate': np.datetime64('2016-01-01') + rng.integers(0, 500, n_rows).astype('timedelta64[D]'),
+        'yearbuilt': year_built,
+        'heatingorsystemtypeid': heating,
+        'poolcnt': rng.choice([0.0, 1.0], n_rows, p=[0.8, 0.2]),
+        'bedroomcnt': rng.choice(np.arange(0.0, 7.0), n_rows),
+        'calculatedfinishedsquarefeet': area,
+        'taxvaluedollarcnt': value,
+    })
+
+
+@pytest.fixture(scope='session')
+def parcels():
+    return parcelFrame()
+
+
+@pytest.fixture(scope='session', params=['frame', 'store'])
+def source(request, parcels, tmp_path_factory):
+    if request.param == 'frame':
+        return FrameSource(parcels)
+    directory = str(tmp_path_factory.mktemp('store'))
+    writeColumnarStore(parcels, directory, partition_by=('fips', 'transactiondate'))
+    return ColumnarStore(directory)
+
+
+@pytest.fixture(scope='session')
+def filter_engine(source):
+    return FilterEngine(source, QuantileIndex(source, metric_cols))
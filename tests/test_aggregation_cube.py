@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregation_cube import AggregationCube
+from test_filter_engine import queryReference
+
+metrics = ['taxvaluedollarcnt', 'calculatedfinishedsquarefeet']
+
+# Tab 3 slider states; year ranges that cut through a decade bucket, end on its bounds or fall inside one
+roll_up_cases = [
+    {},
+    {'valuation_percentiles': [0, 100], 'area_percentiles': [0, 100], 'year_built': [1900, 2015]},
+    {'valuation_percentiles': [0, 10]},
+    {'valuation_percentiles': [25, 75], 'area_percentiles': [50, 50]},
+    {'area_percentiles': [90, 100]},
+    {'valuation_percentiles': [10, 90], 'year_built': [1950, 1990]},
+    {'area_percentiles': [0, 40], 'year_built': [1900, 1960]},
+    {'year_built': [1960, 1969]},
+    {'year_built': [1963, 1967]},
+    {'year_built': [2010, 2015]},
+    {'valuation_percentiles': [50, 50], 'year_built': [1931, 2003]},
+    {'year_built': [1980, 1970]},
+]
+
+
+def groupbyReference(df, col):
+    # What the bar and pie figures were built from: a groupby over the query chain's rows
+    groups = df.groupby(col)
+    reference = pd.DataFrame({'rows': groups.size()})
+    for metric in metrics:
+        reference[metric] = groups[metric].mean()
+        reference[metric + '_sum'] = groups[metric].sum()
+        reference[metric + '_count'] = groups[metric].count()
+        reference[metric + '_std'] = groups[metric].std()
+    return reference.reset_index()
+
+
+@pytest.fixture(scope='module')
+def aggregation_cube(filter_engine):
+    return AggregationCube(filter_engine, max_bytes=1 << 20)
+
+
+@pytest.mark.parametrize('roll_up', ['rollUp', 'rollUpCube', 'rollUpRows'])
+@pytest.mark.parametrize('col', ['fips', 'heatingorsystemtypeid', 'bedroomcnt', 'yearbuilt'])
+@pytest.mark.parametrize('filters', roll_up_cases)
+def testRollUpMatchesGroupby(parcels, aggregation_cube, roll_up, col, filters):
+    expected = groupbyReference(queryReference(parcels, **filters), col)
+    summary = getattr(aggregation_cube, roll_up)(col, **filters)
+    assert list(summary[col]) == list(expected[col])
+    np.testing.assert_array_equal(summary['rows'], expected['rows'])
+    for metric in metrics:
+        np.testing.assert_array_equal(summary[metric + '_count'], expected[metric + '_count'])
+        for stat in ('', '_sum', '_std'):
+            # A group of a single row has no standard deviation in either
+            np.testing.assert_allclose(summary[metric + stat], expected[metric + stat], rtol=1e-9, equal_nan=True)
+
+
+def testCubeIsSmallerThanRows(parcels, aggregation_cube):
+    assert len(aggregation_cube.cube('fips')['x']) < len(parcels)
@@ -0,0 +1,81 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+from werkzeug.datastructures import MultiDict
+
+import export
+
+filters = {'fips': ['06037', '06059'], 'bed_rooms': [1, 5], 'valuation_percentiles': [10, 90]}
+columns = ['parcelid', 'fips', 'transactiondate', 'yearbuilt', 'heatingorsystemtypeid', 'taxvaluedollarcnt']
+metrics = ['taxvaluedollarcnt', 'calculatedfinishedsquarefeet']
+
+
+def exportFrames(filter_engine, chunk_rows=50):
+    return (filter_engine.frame(rows, columns)[columns] for rows in filter_engine.selectChunks(chunk_rows, **filters))
+
+
+def expectedFrame(filter_engine):
+    return filter_engine.frame(filter_engine.select(**filters), columns)[columns].reset_index(drop=True)
+
+
+def testParseFilters():
+    args = MultiDict([('fips', '06037,06059'), ('fips', '06111'), ('pools', '1'), ('start_date', '2016-03-01'),
+                      ('bed_rooms', '1,5'), ('valuation_percentiles', '10,90'), ('bottom_area', 'true'),
+                      ('bottom_valuation', '0')])
+    assert export.parseFilters(args) == {'fips': ['06037', '06059', '06111'], 'pools': [1.0],
+                                         'start_date': '2016-03-01', 'bed_rooms': [1.0, 5.0],
+                                         'valuation_percentiles': [10, 90], 'bottom_area': True}
+    for bad in ({'bed_rooms': '5,1'}, {'area_percentiles': '0,200'}, {'start_date': 'garbage'}, {'year_built': '1'}):
+        with pytest.raises(ValueError):
+            export.parseFilters(MultiDict(bad))
+
+
+def testCsvRoundTrip(filter_engine):
+    expected = expectedFrame(filter_engine)
+    empty = filter_engine.frame(np.array([], dtype=np.int64), columns)[columns]
+    text = ''.join(export.csvStream(exportFrames(filter_engine), empty))
+    exported = pd.read_csv(io.StringIO(text), dtype={'fips': str}, parse_dates=['transactiondate'])
+    assert len(expected) > 50
+    pd.testing.assert_frame_equal(exported, expected, check_dtype=False)
+
+
+@pytest.mark.parametrize('file_format', ['parquet', 'arrow'])
+def testArrowRoundTrip(filter_engine, file_format):
+    pyarrow = pytest.importorskip('pyarrow')
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    expected = expectedFrame(filter_engine)
+    empty = filter_engine.frame(np.array([], dtype=np.int64), columns)[columns]
+    data = b''.join(export.arrowStream(exportFrames(filter_engine), empty, file_format))
+    if file_format == 'parquet':
+        table = pyarrow.parquet.read_table(pyarrow.BufferReader(data))
+    else:
+        table = pyarrow.ipc.open_stream(data).read_all()
+    pd.testing.assert_frame_equal(table.to_pandas(), expected, check_dtype=False)
+
+
+def testArrowStreamOfNoRows(filter_engine):
+    pyarrow = pytest.importorskip('pyarrow')
+    import pyarrow.ipc
+
+    empty = filter_engine.frame(np.array([], dtype=np.int64), columns)[columns]
+    data = b''.join(export.arrowStream(iter([]), empty, 'arrow'))
+    assert pyarrow.ipc.open_stream(data).read_all().num_rows == 0
+
+
+@pytest.mark.parametrize('col', ['fips', 'heatingorsystemtypeid', 'bedroomcnt'])
+def testChunkedAggregationMatchesGroupby(filter_engine, col):
+    frames = (filter_engine.frame(rows, metrics + [col]) for rows in filter_engine.selectChunks(37, **filters))
+    aggregated = export.aggregateFrames(frames, col, metrics)
+    frame = filter_engine.frame(filter_engine.select(**filters), metrics + [col])
+    grouped = frame.groupby(col)
+    assert list(aggregated[col]) == list(grouped.size().index)
+    np.testing.assert_array_equal(aggregated['rows'], grouped.size())
+    for metric in metrics:
+        np.testing.assert_array_equal(aggregated[metric + '_count'], grouped[metric].count())
+        np.testing.assert_allclose(aggregated[metric + '_sum'], grouped[metric].sum(), rtol=1e-9)
+        np.testing.assert_allclose(aggregated[metric], grouped[metric].mean(), rtol=1e-9)
+        np.testing.assert_allclose(aggregated[metric + '_std'], grouped[metric].std(), rtol=1e-6, equal_nan=True)
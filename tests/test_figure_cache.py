@@ -0,0 +1,37 @@
+import json
+
+import plotly.graph_objects as go
+from plotly.io.json import to_json_plotly
+
+from figure_cache import FigureCache, LRUCache, decodeOutputs, encodeOutputs
+
+
+def testEncodedOutputsRoundTrip():
+    figure = go.Figure(go.Bar(x=['a', 'b'], y=[1, 2]))
+    for outputs in ((figure, 'text', {'display': 'none'}), {'z': [1, None], 'label': 'é'}):
+        payload = encodeOutputs(outputs)
+        json.loads(payload)
+        decoded = decodeOutputs(payload)
+        if isinstance(outputs, tuple):
+            assert isinstance(decoded, tuple)
+            outputs, decoded = list(outputs), list(decoded)
+        assert decoded == json.loads(to_json_plotly(outputs))
+
+
+def testHitsAreSplicedIntoTheResponse():
+    # Within a request the memoized function hands placeholders to the callback, and the response the
+    # callback encodes around them carries the stored outputs, on a miss and on a hit alike
+    cache = FigureCache(LRUCache(1 << 20))
+    calls = []
+
+    @cache.memoize('figures')
+    def figures(title):
+        calls.append(title)
+        return go.Figure(layout={'title': title}), f"{title} caption"
+
+    respond = cache.splicing(lambda title: to_json_plotly({'response': list(figures(title))}))
+    expected = json.loads(to_json_plotly({'response': [go.Figure(layout={'title': 'x'}), 'x caption']}))
+    assert json.loads(respond('x')) == expected
+    assert json.loads(respond('x')) == expected
+    assert calls == ['x']
+    assert figures('x')[1] == 'x caption'
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+# Filter states as the tab callbacks pass them, slider ends at and inside the data's bounds
+filter_cases = [
+    {},
+    {'bed_rooms': [0, 6]},
+    {'bed_rooms': [2, 4]},
+    {'bed_rooms': [3, 3]},
+    {'year_built': [1900, 2015]},
+    {'year_built': [1950, 1980]},
+    {'area_percentiles': [0, 100]},
+    {'area_percentiles': [0, 10]},
+    {'area_percentiles': [25, 75]},
+    {'area_percentiles': [90, 100]},
+    {'area_percentiles': [50, 50]},
+    {'valuation_percentiles': [0, 100]},
+    {'valuation_percentiles': [0, 1]},
+    {'valuation_percentiles': [33, 66]},
+    {'valuation_percentiles': [99, 100]},
+    {'fips': []},
+    {'fips': ['06059']},
+    {'fips': ['06111', '06037']},
+    {'fips': ['99999']},
+    {'pools': [1.0]},
+    {'pools': [0.0, 1.0]},
+    {'start_date': '2016-03-15'},
+    {'end_date': '2016-06-30'},
+    {'start_date': '2016-02-01', 'end_date': '2016-02-29'},
+    {'bottom_valuation': True},
+    {'bottom_area': True},
+    {'bottom_valuation': True, 'bottom_area': True},
+    {'fips': ['06037'], 'pools': [0.0], 'bed_rooms': [1, 5], 'start_date': '2016-01-01', 'end_date': '2016-12-31',
+     'bottom_valuation': True},
+    {'fips': ['06059', '06111'], 'area_percentiles': [10, 90], 'valuation_percentiles': [20, 100],
+     'year_built': [1920, 2000]},
+]
+
+
+def queryReference(df, fips=None, pools=None, bed_rooms=None, start_date=None, end_date=None, bottom_valuation=False,
+                   bottom_area=False, area_percentiles=None, valuation_percentiles=None, year_built=None):
+    # The chained DataFrame.query filtering the callbacks did before the filter engine
+    query_df = df
+    if start_date is not None:
+        query_df = query_df.query("transactiondate>=@start_date")
+    if end_date is not None:
+        query_df = query_df.query("transactiondate<=@end_date")
+    if fips is not None and fips != []:
+        query_df = query_df.query("fips == @fips")
+    if pools is not None and pools != []:
+        query_df = query_df.query("poolcnt == @pools")
+    if bed_rooms is not None and len(bed_rooms) == 2:
+        query_df = query_df.query("bedroomcnt>=@bed_rooms[0]")
+        query_df = query_df.query("bedroomcnt<=@bed_rooms[1]")
+    if bottom_valuation:
+        bottom_50_percentile_pricepoint = df.taxvaluedollarcnt.quantile(.50)
+        query_df = query_df.query("taxvaluedollarcnt<=@bottom_50_percentile_pricepoint")
+    if bottom_area:
+        bottom_50_percentile_area = df.calculatedfinishedsquarefeet.quantile(.50)
+        query_df = query_df.query("calculatedfinishedsquarefeet<=@bottom_50_percentile_area")
+    if area_percentiles is not None and len(area_percentiles) == 2:
+        area_percentile_min = df.calculatedfinishedsquarefeet.quantile(float(area_percentiles[0]) / 100.0)
+        area_percentile_max = df.calculatedfinishedsquarefeet.quantile(float(area_percentiles[1]) / 100.0)
+        query_df = query_df.query("calculatedfinishedsquarefeet<=@area_percentile_max")
+        query_df = query_df.query("calculatedfinishedsquarefeet>=@area_percentile_min")
+    if valuation_percentiles is not None and len(valuation_percentiles) == 2:
+        valuation_percentile_min = df.taxvaluedollarcnt.quantile(float(valuation_percentiles[0]) / 100.0)
+        valuation_percentile_max = df.taxvaluedollarcnt.quantile(float(valuation_percentiles[1]) / 100.0)
+        query_df = query_df.query("taxvaluedollarcnt<=@valuation_percentile_max")
+        query_df = query_df.query("taxvaluedollarcnt>=@valuation_percentile_min")
+    if year_built is not None and len(year_built) == 2:
+        query_df = query_df.query("yearbuilt<=@year_built[1]")
+        query_df = query_df.query("yearbuilt>=@year_built[0]")
+    return query_df
+
+
+def selectedParcels(filter_engine, rows):
+    return np.sort(filter_engine.frame(rows, ['parcelid'])['parcelid'].to_numpy())
+
+
+@pytest.mark.parametrize('filters', filter_cases)
+def testSelectMatchesQueryChain(parcels, filter_engine, filters):
+    expected = np.sort(queryReference(parcels, **filters)['parcelid'].to_numpy())
+    np.testing.assert_array_equal(selectedParcels(filter_engine, filter_engine.select(**filters)), expected)
+
+
+@pytest.mark.parametrize('filters', filter_cases)
+def testSelectMatchesMask(filter_engine, filters):
+    # Partition pruning must select exactly the rows of the full mask, in row order
+    np.testing.assert_array_equal(filter_engine.select(**filters), np.flatnonzero(filter_engine.mask(**filters)))
+
+
+@pytest.mark.parametrize('filters', filter_cases)
+def testSelectChunksMatchSelect(filter_engine, filters):
+    chunks = list(filter_engine.selectChunks(37, **filters))
+    assert all(len(chunk) == 37 for chunk in chunks[:-1])
+    np.testing.assert_array_equal(np.concatenate([np.array([], dtype=np.int64)] + chunks),
+                                  filter_engine.select(**filters))
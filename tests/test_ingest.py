@@ -0,0 +1,123 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ingest
+from quantile_sketch import QuantileSketch
+from schema import binary_cols, date_cols, metric_cols, stored_cols
+
+### A small pair of raw Kaggle-shaped files per year, read back through the parallel ingest and through
+### the serial path it replaced: the whole properties file in one read_csv, a merge on parcelid and
+### one quantile sketch over every sale.
+
+# A column the raw files carry but the dashboard never reads
+unused_col = 'regionidzip'
+
+
+def rawProperties(n_rows, first_parcel, rng):
+    properties = pd.DataFrame({col: rng.choice([1.0, 2.0, 7.0, np.nan], n_rows) for col in ingest.raw_dtypes
+                               if col not in binary_cols})
+    properties['parcelid'] = np.arange(n_rows) + first_parcel
+    properties['fips'] = rng.choice([6037.0, 6059.0, 6111.0, np.nan], n_rows, p=[0.5, 0.3, 0.15, 0.05])
+    properties['yearbuilt'] = np.where(rng.random(n_rows) < 0.05, np.nan, rng.integers(1900, 2016, n_rows))
+    properties['poolcnt'] = rng.choice([1.0, np.nan], n_rows)
+    properties['calculatedfinishedsquarefeet'] = np.where(rng.random(n_rows) < 0.05, np.nan,
+                                                          np.round(rng.normal(1600, 500, n_rows)))
+    properties['taxvaluedollarcnt'] = np.round(rng.lognormal(12.5, 0.8, n_rows), -2)
+    properties['fireplaceflag'] = rng.choice(['true', ''], n_rows)
+    properties['hashottuborspa'] = rng.choice(['true', ''], n_rows)
+    properties['taxdelinquencyflag'] = rng.choice(['Y', ''], n_rows)
+    properties[unused_col] = rng.integers(90000, 99999, n_rows)
+    # Column order of the raw files rather than of the schema
+    return properties[sorted(properties.columns)]
+
+
+def rawTransactions(properties, year, rng):
+    # Most parcels sell once, some twice, some never, and a few sales name parcels the file lacks
+    parcels = np.r_[rng.choice(properties.parcelid, len(properties) * 3 // 4, replace=False),
+                    rng.choice(properties.parcelid, len(properties) // 10), properties.parcelid.max() + np.arange(1, 6)]
+    dates = np.datetime64(f'{year}-01-01') + rng.integers(0, 365, len(parcels)).astype('timedelta64[D]')
+    return pd.DataFrame({'parcelid': parcels, 'logerror': rng.normal(0, 0.1, len(parcels)), 'transactiondate': dates})
+
+
+@pytest.fixture(scope='session')
+def raw_dir(tmp_path_factory):
+    raw_dir = tmp_path_factory.mktemp('raw')
+    rng = np.random.default_rng(17)
+    for (name, train), year in zip(ingest.raw_sources.items(), [2016, 2017]):
+        properties = rawProperties(400, 10_000_000 + year * 1000, rng)
+        properties.to_csv(raw_dir / name, index=False)
+        rawTransactions(properties, year, rng).to_csv(raw_dir / train, index=False)
+    return str(raw_dir)
+
+
+def serialSales(raw_dir):
+    sales = []
+    for name, train in ingest.raw_sources.items():
+        properties = pd.read_csv(os.path.join(raw_dir, name), dtype=ingest.raw_dtypes)
+        transactions = pd.read_csv(os.path.join(raw_dir, train), parse_dates=date_cols)
+        df = properties.merge(transactions, on='parcelid')
+        df = df.dropna(subset=ingest.required_cols)
+        df['fips'] = df.fips.astype(int).astype(str).str.zfill(5)
+        df['yearbuilt'] = df.yearbuilt.astype(np.int64)
+        df['poolcnt'] = df.poolcnt.fillna(0)
+        df['fireplaceflag'] = df.fireplaceflag == 'true'
+        df['hashottuborspa'] = df.hashottuborspa == 'true'
+        sales.append(df[stored_cols])
+    return pd.concat(sales, ignore_index=True)
+
+
+def inStableOrder(df):
+    return df.sort_values(date_cols + ['parcelid'], kind='stable').reset_index(drop=True)
+
+
+def testByteRangesStartAtLines(raw_dir):
+    path = os.path.join(raw_dir, 'properties_2016.csv')
+    with open(path, 'rb') as handle:
+        data = handle.read()
+    header_end = data.index(b'\n') + 1
+    line_starts = {i + 1 for i in range(header_end - 1, len(data) - 1) if data[i] == ord('\n')}
+    for parts in [1, 3, 7, 50]:
+        ranges = ingest.byteRanges(path, parts)
+        assert ranges[0][0] == header_end and ranges[-1][1] == len(data)
+        assert all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+        assert {start for start, _ in ranges} <= line_starts
+    # The even split lands inside a line, which byteRanges then pushes to the next one
+    naive = header_end + (len(data) - header_end) // 3
+    assert naive not in line_starts
+    assert ingest.byteRanges(path, 3)[1][0] > naive
+
+
+@pytest.mark.parametrize('parts', [1, 3, 7])
+def testRangesJoinLikeTheSerialMerge(raw_dir, parts):
+    transactions = {name: ingest.readTransactions(os.path.join(raw_dir, train))
+                    for name, train in ingest.raw_sources.items()}
+    ingest.initWorker(transactions)
+    sales = []
+    rows_read = 0
+    for name in ingest.raw_sources:
+        path = os.path.join(raw_dir, name)
+        header = ingest.csvHeader(path)
+        for start, end in ingest.byteRanges(path, parts):
+            range_sales, _, range_rows = ingest.ingestRange((path, header, start, end, 16))
+            sales.extend(range_sales)
+            rows_read += range_rows
+    assert rows_read == 800
+    pd.testing.assert_frame_equal(inStableOrder(pd.concat(sales, ignore_index=True)),
+                                  inStableOrder(serialSales(raw_dir)))
+
+
+def testParallelIngestMatchesSerialPath(raw_dir):
+    quantiles = (0.05, 0.95)
+    df = ingest.ingest(raw_dir, workers=3, chunk_rows=16, quantiles=quantiles)
+
+    expected = serialSales(raw_dir)
+    keep = np.ones(len(expected), dtype=bool)
+    for col in metric_cols:
+        sketch = QuantileSketch().update(expected[col])
+        keep &= expected[col].between(sketch.quantile(quantiles[0]), sketch.quantile(quantiles[1])).to_numpy()
+    expected = inStableOrder(expected[keep])
+    assert 0 < len(expected) < keep.size
+    pd.testing.assert_frame_equal(df, expected)
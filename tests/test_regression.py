@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+from regression import groupedLeastSquares, regressionFigure
+
+
+def lineFrame():
+    # Dollar-sized values, where n * sum(x^2) - sum(x)^2 cancels, a group with constant x and a single point
+    rng = np.random.default_rng(5)
+    x = np.concatenate([rng.normal(8e5, 2e5, 300), rng.normal(3e5, 5e4, 40), np.full(10, 5e5), [4e5]])
+    y = np.concatenate([1e-3 * x[:300] + rng.normal(900, 200, 300), 2e-3 * x[300:340] + rng.normal(0, 50, 40),
+                        rng.normal(1500, 100, 10), [1200.0]])
+    groups = np.repeat([0, 1, 2, 3], [300, 40, 10, 1])
+    return x, y, groups
+
+
+def testFitsMatchPolyfit():
+    x, y, groups = lineFrame()
+    fits = groupedLeastSquares(x, y, groups, 5)
+    for group in (0, 1):
+        group_x, group_y = x[groups == group], y[groups == group]
+        slope, intercept = np.polyfit(group_x, group_y, 1)
+        np.testing.assert_allclose(fits.slope[group], slope, rtol=1e-9)
+        np.testing.assert_allclose(fits.intercept[group], intercept, rtol=1e-9)
+        np.testing.assert_allclose(fits.r_squared[group], np.corrcoef(group_x, group_y)[0, 1] ** 2)
+    # No line through a constant x or a single point, and none for a group without rows
+    assert fits.n.tolist() == [300, 40, 10, 1, 0]
+    assert np.isnan(fits.slope[2:]).all() and np.isnan(fits.intercept[2:]).all()
+
+
+def testFigureDrawsLinesOnlyForFittedGroups():
+    x, y, groups = lineFrame()
+    frame = pd.DataFrame({'x': x, 'y': y, 'group': np.array(['a', 'b', 'c', 'd'])[groups]})
+    fig = regressionFigure(frame, 'x', 'y', 'group', max_points=100, min_points_per_group=5)
+    lines = [trace.name for trace in fig.data if trace.mode == 'lines']
+    markers = {trace.name: len(trace.x) for trace in fig.data if trace.mode == 'markers'}
+    assert lines == ['group=a', 'group=b']
+    assert sum(markers.values()) <= 100 and markers['group=d'] == 1
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import gaussian_kde
+
+from summary_plots import groupedDensity, groupedSummary
+
+
+@pytest.fixture(scope='module')
+def groups():
+    # Groups of very different sizes and spreads, with missing values, ties and outliers on both sides
+    rng = np.random.default_rng(3)
+    sizes = {'a': 400, 'b': 60, 'c': 5, 'd': 1}
+    frame = pd.DataFrame({
+        'group': np.repeat(list(sizes), list(sizes.values())),
+        'value': np.concatenate([rng.lognormal(12, 0.5, sizes['a']), np.round(rng.normal(50, 10, sizes['b'])),
+                                 [1.0, 2.0, 2.0, 3.0, 100.0], [7.0]]),
+    })
+    frame.loc[rng.choice(len(frame), 10, replace=False), 'value'] = np.nan
+    return frame
+
+
+def testQuartilesAndFencesMatchPandas(groups):
+    summary = groupedSummary(groups, 'value', 'group', outlier_cap=len(groups))
+    grouped = groups.dropna().groupby('group')['value']
+    quartiles = grouped.quantile([.25, .5, .75]).unstack()
+    assert list(summary['categories']) == list(quartiles.index)
+    np.testing.assert_allclose(summary['q1'], quartiles[.25])
+    np.testing.assert_allclose(summary['median'], quartiles[.5])
+    np.testing.assert_allclose(summary['q3'], quartiles[.75])
+    np.testing.assert_allclose(summary['mean'], grouped.mean())
+    np.testing.assert_array_equal(summary['counts'], grouped.size())
+
+    # Tukey fences: the extreme values within 1.5 IQR of the quartiles, and everything else an outlier
+    iqr = quartiles[.75] - quartiles[.25]
+    low, high = quartiles[.25] - 1.5 * iqr, quartiles[.75] + 1.5 * iqr
+    values = groups.dropna()
+    inside = values['value'].between(values['group'].map(low), values['group'].map(high))
+    np.testing.assert_allclose(summary['lowerfence'], values[inside].groupby('group')['value'].min())
+    np.testing.assert_allclose(summary['upperfence'], values[inside].groupby('group')['value'].max())
+    outliers = pd.Series(summary['categories'][summary['outlier_groups']]).value_counts()
+    expected = (~inside).groupby(values['group']).sum()
+    assert outliers.reindex(expected.index, fill_value=0).tolist() == expected.tolist()
+    assert (~inside).sum() > 0
+
+
+def testOutliersAreCappedPerGroup(groups):
+    everything = groupedSummary(groups, 'value', 'group', outlier_cap=len(groups))
+    summary = groupedSummary(groups, 'value', 'group', outlier_cap=2)
+    expected = np.minimum(np.bincount(everything['outlier_groups'], minlength=len(everything['counts'])), 2)
+    np.testing.assert_array_equal(np.bincount(summary['outlier_groups'], minlength=len(summary['counts'])), expected)
+    assert np.isin(summary['outlier_values'], everything['outlier_values']).all()
+
+
+def testDensityMatchesGaussianKde(groups):
+    points = 200
+    summary = groupedSummary(groups, 'value', 'group')
+    grid, density = groupedDensity(summary, points)
+    for index, category in enumerate(summary['categories']):
+        values = groups.loc[groups['group'] == category, 'value'].dropna().to_numpy()
+        if len(values) < 20:
+            # The bandwidth floor of one grid step governs tiny groups
+            continue
+        # The same rule of thumb bandwidth, 1.06 sd n^-1/5, in gaussian_kde's terms (it scales the ddof=1 sd)
+        factor = 1.06 * len(values) ** -0.2 * np.std(values) / np.std(values, ddof=1)
+        expected = gaussian_kde(values, bw_method=factor)(grid[index])
+        np.testing.assert_allclose(density[index], expected / expected.max(), atol=0.03)
@@ -0,0 +1,179 @@
+import functools
+import itertools
+import multiprocessing
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+
+from dash.exceptions import PreventUpdate
+from flask import has_request_context, request
+from figure_cache import cacheKey, decodeOutputs, encodeOutputs
+from instrumentation import profiledCall
+
+session_cookie = 'zillow_session'
+# Sent by assets/clientside.js with every callback request, a different id for every page load
+page_header = 'X-Zillow-Page'
+
+# The pool whose tasks the forked workers run; set by WorkerPool.start before the fork
+active_pool = None
+
+
+def runTask(name, args, profile=None):
+    # Executed in a worker process: the callback body runs against the data source inherited from
+    # the parent, and the outputs come back already serialized, along with the phases and the profile
+    # (when the request asked for one) taken here
+    pool = active_pool
+    start = time.perf_counter()
+    profiled = None
+    with pool.metrics.captured() if pool.metrics is not None else nullcontext() as captured:
+        if profile is None:
+            outputs = pool.tasks[name](*args)
+        else:
+            outputs, profiled = profiledCall(profile, pool.tasks[name], args)
+    return encodeOutputs(outputs), captured, time.perf_counter() - start, profiled
+
+
+def ping():
+    return True
+
+
+def sessionId():
+    # The browser tab a request comes from, or None when it cannot be told apart from other clients (no
+    # session cookie yet): such a request is coalesced with identical ones but never superseded
+    if not has_request_context() or not request.cookies.get(session_cookie):
+        return None
+    page = request.headers.get(page_header)
+    return request.cookies[session_cookie] + (f":{page}" if page else '')
+
+
+class WorkerPool:
+    # Runs the CPU-bound callback bodies (aggregation and figure building) in forked worker
+    # processes, so a slow tab 3 regression does not hold up a tab 1 redraw and the dataset is
+    # shared copy-on-write (or through the page cache, for the memory-mapped store) instead of
+    # copied per worker. Identical requests already in flight wait on the same result rather than
+    # recomputing it, and a request is superseded as soon as the same browser tab asks the same
+    # callback for something else: it is cancelled if it has not started and its response is dropped
+    # with PreventUpdate, so a slider drag only ever keeps the latest position queued.
+    def __init__(self, processes, metrics=None):
+        self.processes = processes
+        self.metrics = metrics
+        self.tasks = {}
+        self.executor = None
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.latest = {}
+        self.tickets = itertools.count()
+        self.counts = {'submitted': 0, 'coalesced': 0, 'superseded': 0}
+
+    def start(self, web_workers=1):
+        # Call once everything the tasks read is loaded and before the server starts its threads:
+        # the workers are forked right here, all at once. processes is the budget for the host, so each
+        # of web_workers serving processes forks its share of it.
+        global active_pool
+        if self.processes <= 0:
+            return
+        active_pool = self
+        self.executor = ProcessPoolExecutor(max(self.processes // web_workers, 1),
+                                            mp_context=multiprocessing.get_context('fork'))
+        self.executor.submit(ping).result()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def offload(self, name):
+        def decorator(func):
+            self.tasks[name] = func
+
+            @functools.wraps(func)
+            def wrapper(*args):
+                if self.executor is None:
+                    return func(*args)
+                return decodeOutputs(self.run(name, args))
+
+            def encoded(*args):
+                # The outputs as figure_cache.encodeOutputs serializes them, which is how they come back
+                # from a worker
+                if self.executor is None:
+                    return encodeOutputs(func(*args))
+                return self.run(name, args)
+
+            wrapper.encoded = encoded
+            return wrapper
+
+        return decorator
+
+    def run(self, name, args):
+        # The outputs of name(*args) as encoded in the worker, see figure_cache.encodeOutputs
+        key = cacheKey(name, args)
+        session = sessionId()
+        ticket = next(self.tickets)
+        profile = self.metrics.requestedProfiler() if self.metrics is not None else None
+        if profile is not None:
+            # A profiled request gets a run of its own, neither shared with nor joining an identical one
+            key = f"{key}-profiled-{ticket}"
+        with self.lock:
+            entry = self.in_flight.get(key)
+            if entry is None:
+                entry = {'future': self.executor.submit(runTask, name, args, profile), 'waiters': 0, 'live': 0}
+                self.in_flight[key] = entry
+                self.counts['submitted'] += 1
+            else:
+                self.counts['coalesced'] += 1
+            entry['waiters'] += 1
+            entry['live'] += 1
+            if session is not None:
+                previous = self.latest.get((session, name))
+                self.latest[(session, name)] = (ticket, entry)
+                if previous is not None and previous[1] is not entry:
+                    self.supersede(previous[1])
+
+        start = time.perf_counter()
+        try:
+            payload, captured, seconds, profiled = entry['future'].result()
+        except CancelledError:
+            payload = None
+        finally:
+            with self.lock:
+                entry['waiters'] -= 1
+                if entry['waiters'] == 0 and self.in_flight.get(key) is entry:
+                    del self.in_flight[key]
+                latest = self.latest.get((session, name))
+                superseded = session is not None and (latest is None or latest[0] != ticket)
+                if not superseded:
+                    entry['live'] -= 1
+                    if session is not None:
+                        del self.latest[(session, name)]
+        if superseded or payload is None:
+            raise PreventUpdate
+
+        if self.metrics is not None and captured is not None:
+            captured['phases']['queue'] = max(time.perf_counter() - start - seconds, 0.0)
+            self.metrics.absorb(captured)
+        if profiled is not None:
+            self.metrics.absorbProfile(profiled)
+        return payload
+
+    def supersede(self, entry):
+        # Caller holds the lock. Nobody else still wants this result: stop it if it has not started
+        self.counts['superseded'] += 1
+        entry['live'] -= 1
+        if entry['live'] == 0 and entry['future'].cancel():
+            for key, candidate in list(self.in_flight.items()):
+                if candidate is entry:
+                    del self.in_flight[key]
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, in_flight=len(self.in_flight))
+
+    def attach(self, server):
+        # Tags every browser with a session cookie so superseding only ever drops its own requests
+        @server.after_request
+        def setSessionCookie(response):
+            if session_cookie not in request.cookies:
+                response.set_cookie(session_cookie, uuid.uuid4().hex, httponly=True, samesite='Lax')
+            return response